@@ -3,6 +3,7 @@ import logging
 
 import os
 import sys
+import hashlib
 try:
     import configparser as ConfigParser
 except ImportError:
@@ -30,6 +31,29 @@ default_skip_existing = False
 default_use_checksum_existence_check = False
 default_target_folder = ''
 default_auto_tag = False
+default_partial_checksum_size = 64 * 1024
+default_checksum_algorithm = 'sha512'
+default_checksum_buffer_size = 1024 * 1024
+default_checksum_mmap_threshold = 32 * 1024 * 1024
+default_metadata_header_size = 128 * 1024
+default_metadata_backend = 'exifread'
+default_metadata_cache_size = 4096
+default_relocation_batch_size = 32
+default_exiftool_extensions = ['cr2', 'rw2'] + default_movie_extensions
+default_raw_extensions = ['nef', 'cr2', 'rw2']
+default_journal_sync_interval = 64
+default_journal_sync_seconds = 1.0
+default_watch_settle_seconds = 2.0
+default_watch_batch_size = 64
+default_watch_queue_size = 256
+default_watch_max_pending = 10000
+default_watch_report_seconds = 60
+default_watch_state_seconds = 1.0
+default_thumbnail_dimensions = '400x400'
+default_thumbnail_timeout = 60
+default_thumbnail_max_tasks_per_child = 100
+default_thumbnail_queue_size = 256
+default_thumbnail_index_name = '.mediaphile-thumbnails.db'
 
 def get_user_config_filename(folder=None):
     """
@@ -43,6 +67,54 @@ def get_user_config_filename(folder=None):
     return os.path.join(mediaphile_home, 'mediaphile.ini')
 
 
+def get_index_filename(folder=None):
+    """
+    Returns the location of the file index database, stored next to mediaphile.ini.
+
+    :param folder: location of mediaphile.ini to use
+    """
+    return os.path.join(os.path.split(get_user_config_filename(folder))[0], 'mediaphile.db')
+
+
+def _get_run_filename(kind, operation, source, target, folder=None):
+    """
+    Returns the location of a file holding the state of runs of operation from source to target, stored in a folder
+    called kind next to mediaphile.ini. Runs on the same folders share the file.
+    """
+    state_folder = os.path.join(os.path.split(get_user_config_filename(folder))[0], kind)
+    if not os.path.exists(state_folder):
+        os.makedirs(state_folder)
+
+    key = '\0'.join([operation, os.path.abspath(source or ''), os.path.abspath(target or source or '')])
+    return os.path.join(state_folder, '%s-%s.%s' % (operation, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16],
+                                                    kind.rstrip('s')))
+
+
+def get_journal_filename(operation, source, target, folder=None):
+    """
+    Returns the location of the journal of a run of operation from source to target, stored in a journals folder next
+    to mediaphile.ini, see Journal. Runs on the same folders share their journal, so a run can be resumed.
+
+    :param operation: the name of the command, like relocate_photos.
+    :param source: the source folder of the run.
+    :param target: the target folder of the run.
+    :param folder: location of mediaphile.ini to use
+    """
+    return _get_run_filename('journals', operation, source, target, folder)
+
+
+def get_watcher_state_filename(source, target, folder=None):
+    """
+    Returns the location of the high-water mark of the watcher relocating files from source to target, stored in a
+    watchers folder next to mediaphile.ini, see HighWaterMark.
+
+    :param source: the watched folder.
+    :param target: the target folder.
+    :param folder: location of mediaphile.ini to use
+    """
+    return _get_run_filename('watchers', 'watch', source, target, folder)
+
+
 def get_user_config(folder=None):
     """
     Returns user configurations found in ~/mediaphile/mediaphile.ini or creates a configuration using defaults if it doesn't
@@ -70,7 +142,9 @@ def get_user_config(folder=None):
                                 'skip existing': default_skip_existing,
                                 'use checksum existence check': default_use_checksum_existence_check,
                                 'target folder': default_target_folder,
-                                'auto tag': default_auto_tag
+                                'auto tag': default_auto_tag,
+                                'checksum algorithm': default_checksum_algorithm,
+                                'metadata backend': default_metadata_backend
         }
 
         with open(config_file, 'w') as configfile:
@@ -82,6 +156,38 @@ def get_user_config(folder=None):
     return config
 
 
+def get_configured_checksum_algorithm(config, algorithm=None):
+    """
+    Returns the checksum algorithm to use, either algorithm if provided, the one in the configuration or the default.
+
+    :param config: the configuration returned by get_user_config.
+    :param algorithm: algorithm provided on the command-line, if any.
+    """
+    if algorithm:
+        return algorithm
+
+    if config.has_option('options', 'checksum algorithm'):
+        return config.get('options', 'checksum algorithm')
+
+    return default_checksum_algorithm
+
+
+def get_metadata_backend(config, backend=None):
+    """
+    Returns the metadata backend to use, either backend if provided, the one in the configuration or the default.
+
+    :param config: the configuration returned by get_user_config.
+    :param backend: backend provided on the command-line, if any.
+    """
+    if backend:
+        return backend
+
+    if config.has_option('options', 'metadata backend'):
+        return config.get('options', 'metadata backend')
+
+    return default_metadata_backend
+
+
 def validate_environment():
     """
     Checks the python environment for required packages.
@@ -122,6 +228,14 @@ def validate_environment():
         print("lxml is missing.")
         optional += 1
 
+    try:
+        import xxhash
+
+        print("xxhash is installed.")
+    except (ImportError):
+        print("xxhash is missing.")
+        optional += 1
+
     try:
         import pyinotify
 
@@ -130,6 +244,21 @@ def validate_environment():
         print("pyinotify is missing.")
         optional += 1
 
+    try:
+        import msgpack
+
+        print("msgpack is installed.")
+    except (ImportError):
+        print("msgpack is missing.")
+        optional += 1
+
+    from mediaphile.lib.exiftool import EXIFTOOL_SUPPORT
+    if EXIFTOOL_SUPPORT:
+        print("exiftool is installed.")
+    else:
+        print("exiftool is missing.")
+        optional += 1
+
     print("")
     if not errors and not optional:
         print("Environment is ok.")
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
+import sys
 from optparse import OptionParser, OptionGroup
-from mediaphile.cli import add_common_options, check_common_options
+from mediaphile.cli import add_common_options, check_common_options, get_user_config, get_index_filename, \
+    get_configured_checksum_algorithm
+from mediaphile.lib.db import FileIndex
 
 
 def main():
@@ -13,12 +16,40 @@ def main():
     common_group.add_option("-s", "--source", dest="source", help="the source folder to process")
     common_group.add_option("--dry-run", dest="dru_run", action="store_true",
                             help="Just do a test-run. No actual changes will be made")
+    common_group.add_option("--configuration-folder", dest="configuration_folder",
+                            help="folder containing mediaphile.ini to use")
+    common_group.add_option("--database", dest="database",
+                            help="the index database to use, defaults to mediaphile.db next to mediaphile.ini")
+    common_group.add_option("--no-checksums", dest="no_checksums", action="store_true",
+                            help="do not calculate checksums of new or changed files")
+    common_group.add_option("--checksum-algorithm", dest="checksum_algorithm",
+                            help="hash algorithm used for checksums, like sha512, blake2b or xxh3_64")
+    common_group.add_option("--workers", dest="workers", type="int",
+                            help="number of threads scanning the source folder")
     parser.add_option_group(common_group)
 
     add_common_options(parser)
     (options, args) = parser.parse_args()
     check_common_options(options, args)
 
+    if not options.source:
+        print("ERROR: You must supply a source folder.\n")
+        sys.exit(1)
+
+    config = get_user_config(options.configuration_folder or None)
+    database = options.database or get_index_filename(options.configuration_folder or None)
+
+    checksum_algorithm = get_configured_checksum_algorithm(config, options.checksum_algorithm)
+    with FileIndex(database, checksum_algorithm=checksum_algorithm) as file_index:
+        stats = file_index.refresh(
+            options.source,
+            photo_extensions_to_include=[ext.strip() for ext in config.get('options', 'photo extensions').split(',')],
+            checksums=not options.no_checksums,
+            workers=options.workers)
+
+    print("Indexed %s in %s: %s added, %s updated, %s unchanged, %s removed." % (
+        options.source, database, stats['added'], stats['updated'], stats['unchanged'], stats['removed']))
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
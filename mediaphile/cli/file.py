@@ -3,8 +3,11 @@ import logging
 
 import sys
 from optparse import OptionParser, OptionGroup
-from mediaphile.cli import add_common_options, check_common_options
-from mediaphile.lib.file_operations import find_duplicates
+from mediaphile.cli import add_common_options, check_common_options, get_index_filename, get_user_config, \
+    get_configured_checksum_algorithm, get_journal_filename
+from mediaphile.lib.file_operations import find_duplicates, find_new_files
+from mediaphile.lib.db import FileIndex
+from mediaphile.lib.journal import Journal
 
 
 def main():
@@ -18,12 +21,22 @@ def main():
     common_group.add_option("-t", "--target", dest="target", help="the target folder for new files")
     common_group.add_option("--dry-run", dest="dry_run", action="store_true",
                             help="Just do a test-run. No actual changes will be made.")
+    common_group.add_option("--use-index", dest="use_index", action="store_true",
+                            help="look up checksums in the index built by mediaphile.db")
+    common_group.add_option("--checksum-algorithm", dest="checksum_algorithm",
+                            help="hash algorithm used to compare files, like sha512, blake2b or xxh3_64")
+    common_group.add_option("-j", "--jobs", dest="jobs", type="int",
+                            help="number of processes hashing files in parallel")
+    common_group.add_option("--use-threads", dest="use_threads", action="store_true",
+                            help="hash files in parallel using threads instead of processes")
     parser.add_option_group(common_group)
 
     duplicate_group = OptionGroup(parser, "Duplicate handling")
     duplicate_group.add_option("-d", "--find_duplicates", action="store_true",
                                help="locates duplicates in source folder compared to target folder",
                                dest="find_duplicates")
+    duplicate_group.add_option("--resume", dest="resume", action="store_true",
+                               help="skip files compared by an earlier, interrupted run on the same folders")
     duplicate_group.add_option("-x", "--delete_duplicates", action="store_true", dest="delete",
                                help="deletes any duplicate file from source folder found in both source and target folder")
     duplicate_group.add_option("-r", "--rename", action="store_true", dest="rename",
@@ -31,7 +44,7 @@ def main():
     parser.add_option_group(duplicate_group)
 
     new_content_group = OptionGroup(parser, "Finding new files")
-    new_content_group.add_option("-n", "--new_files",
+    new_content_group.add_option("-n", "--new_files", action="store_true",
                                  help="locates new files in source folder compared to target folder",
                                  dest="new_files")
     parser.add_option_group(new_content_group)
@@ -50,15 +63,47 @@ def main():
 
     print(vars(options))
 
+    checksum_algorithm = get_configured_checksum_algorithm(get_user_config(), options.checksum_algorithm)
+    file_index = options.use_index and FileIndex(get_index_filename(), checksum_algorithm=checksum_algorithm) or None
+
     if options.find_duplicates:
-        list(find_duplicates(
-            options.source,
-            options.target,
-            delete_duplicates=options.delete,
-            rename_duplicates=options.rename,
-            dry_run=options.dry_run,
-            verbose=options.verbose
-        ))
+        journal = not options.dry_run and Journal(
+            get_journal_filename('find_duplicates', options.source, options.target), resume=options.resume) or None
+        try:
+            list(find_duplicates(
+                options.source,
+                options.target,
+                delete_duplicates=options.delete,
+                rename_duplicates=options.rename,
+                dry_run=options.dry_run,
+                verbose=options.verbose,
+                file_index=file_index,
+                checksum_algorithm=checksum_algorithm,
+                jobs=options.jobs,
+                use_threads=options.use_threads,
+                journal=journal
+            ))
+        except BaseException:
+            if journal:
+                journal.close()
+            raise
+
+        if journal:
+            journal.discard()
+
+    if options.new_files:
+        for filename in find_new_files(
+                options.source,
+                options.target,
+                verbose=options.verbose,
+                file_index=file_index,
+                checksum_algorithm=checksum_algorithm,
+                jobs=options.jobs,
+                use_threads=options.use_threads):
+            print(filename)
+
+    if file_index:
+        file_index.close()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
+import sys
 from optparse import OptionParser, OptionGroup
-from mediaphile.cli import add_common_options, check_common_options
+from mediaphile.cli import add_common_options, check_common_options, get_user_config, get_metadata_backend, \
+    get_watcher_state_filename, default_watch_settle_seconds, default_watch_batch_size, default_watch_queue_size, \
+    default_watch_max_pending
 from mediaphile.lib import folderwatcher
+from mediaphile.lib.metadata import metadata_backends
 
 
 def main():
@@ -10,17 +14,76 @@ def main():
     """
     parser = OptionParser()
 
-    common_group = OptionGroup(parser, "Common parameters")
-    common_group.add_option("-s", "--source", dest="source", help="the source folder to process")
-    common_group.add_option("--dry-run", dest="dru_run", action="store_true",
+    common_group = OptionGroup(parser, "Relocates photos and movies arriving in a folder into a date-based hierarchy")
+    common_group.add_option("-s", "--source", dest="source", help="the folder to watch")
+    common_group.add_option("-t", "--target", dest="target", help="the target folder for new files")
+    common_group.add_option("-d", "--delete", dest="delete", action="store_true",
+                            help="delete source files when processed")
+    common_group.add_option("--dry-run", dest="dry_run", action="store_true",
                             help="Just do a test-run. No actual changes will be made")
+    common_group.add_option("-a", "--auto-tag", dest="auto_tag", action="store_true",
+                            help="use prepending folders as tags instead of day part from date")
+    common_group.add_option("--tag", dest="tag", help="tag to use instead of day part from date")
+    common_group.add_option("--configuration-folder", dest="configuration_folder",
+                            help="folder containing mediaphile.ini to use")
+    common_group.add_option("-j", "--jobs", dest="jobs", type="int",
+                            help="number of threads relocating files at the same time")
+    common_group.add_option("--metadata-jobs", dest="metadata_jobs", type="int",
+                            help="number of processes reading metadata at the same time")
+    common_group.add_option("--metadata-backend", dest="metadata_backend", type="choice", choices=metadata_backends,
+                            help="read metadata using exifread, exiftool or auto, which uses exiftool for raw photos "
+                                 "and movies if installed")
+    common_group.add_option("--settle-seconds", dest="settle_seconds", type="float",
+                            default=default_watch_settle_seconds,
+                            help="number of seconds a file must stay unchanged before it's relocated")
+    common_group.add_option("--batch-size", dest="batch_size", type="int", default=default_watch_batch_size,
+                            help="max number of settled files handed on to be relocated at a time")
+    common_group.add_option("--queue-size", dest="queue_size", type="int", default=default_watch_queue_size,
+                            help="max number of files waiting for metadata to be read or to be relocated")
+    common_group.add_option("--max-pending", dest="max_pending", type="int", default=default_watch_max_pending,
+                            help="max number of files waiting to settle before no more events are read")
     parser.add_option_group(common_group)
 
     add_common_options(parser)
     (options, args) = parser.parse_args()
     check_common_options(options, args)
 
-    folderwatcher.run()
+    if not options.source or not options.target:
+        print("ERROR: You must supply both source- and target-folders.\n")
+        sys.exit(1)
+
+    if not folderwatcher.PYINOTIFY_SUPPORT:
+        print("ERROR: pyinotify must be installed to watch folders.\n")
+        sys.exit(1)
+
+    config = get_user_config(options.configuration_folder or None)
+    try:
+        folderwatcher.run(
+            options.source,
+            options.target,
+            settle_seconds=options.settle_seconds,
+            batch_size=options.batch_size,
+            queue_size=options.queue_size,
+            metadata_jobs=options.metadata_jobs,
+            max_pending=options.max_pending,
+            state_filename=not options.dry_run and get_watcher_state_filename(
+                options.source, options.target, options.configuration_folder or None) or None,
+            remove_source=options.delete,
+            jobs=options.jobs,
+            metadata_backend=get_metadata_backend(config, options.metadata_backend),
+            tag=options.tag,
+            auto_tag=options.auto_tag or config.getboolean('options', 'auto tag'),
+            dry_run=options.dry_run,
+            photo_extensions_to_include=[ext.strip() for ext in config.get('options', 'photo extensions').split(',')],
+            movie_extensions_to_include=[ext.strip() for ext in config.get('options', 'movie extensions').split(',')],
+            append_timestamp=config.getboolean('options', 'append timestamp'),
+            skip_existing=config.getboolean('options', 'skip existing'),
+            timestamp_format=config.get('options', 'timestamp format'),
+            duplicate_filename_format=config.get('options', 'duplicate filename format'),
+            new_filename_format=config.get('options', 'new filename format'))
+    except KeyboardInterrupt:
+        pass
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,7 +2,8 @@
 import sys
 from optparse import OptionParser, OptionGroup
 from mediaphile.lib.movies import relocate_movies
-from mediaphile.cli import add_common_options, check_common_options
+from mediaphile.lib.journal import Journal
+from mediaphile.cli import add_common_options, check_common_options, get_journal_filename
 
 
 def main():
@@ -16,6 +17,8 @@ def main():
     common_group.add_option("-t", "--target", dest="target", help="the target folder for new files")
     common_group.add_option("--dry-run", dest="dru_run", action="store_true",
                             help="Just do a test-run. No actual changes will be made")
+    common_group.add_option("--resume", dest="resume", action="store_true",
+                            help="skip movies relocated by an earlier, interrupted run on the same folders")
     parser.add_option_group(common_group)
 
     add_common_options(parser)
@@ -26,7 +29,14 @@ def main():
         print("ERROR: You must supply both source- and target-folders.\n")
         sys.exit(1)
 
-    relocate_movies(options.source, options.target)
+    journal = Journal(get_journal_filename('relocate_movies', options.source, options.target), resume=options.resume)
+    try:
+        relocate_movies(options.source, options.target, journal=journal)
+    except BaseException:
+        journal.close()
+        raise
+
+    journal.discard()
 
 
 if __name__ == "__main__":
@@ -5,9 +5,13 @@ import sys
 from optparse import OptionParser, OptionGroup
 from os.path import expanduser
 from mediaphile.lib import sizeof_fmt, get_term_mapping
-from mediaphile.lib.metadata import get_metadata
+from mediaphile.lib.metadata import get_metadata_many, metadata_backends
 from mediaphile.lib.photos import relocate_photos, get_photos_in_folder
-from mediaphile.cli import add_common_options, check_common_options, get_user_config
+from mediaphile.lib.db import FileIndex
+from mediaphile.lib.plan import apply_plan
+from mediaphile.lib.journal import Journal
+from mediaphile.cli import add_common_options, check_common_options, get_user_config, get_index_filename, \
+    get_configured_checksum_algorithm, get_metadata_backend, get_journal_filename
 
 
 def print_help(parser):
@@ -27,17 +31,22 @@ def print_help(parser):
     print("mediaphile -s %s -t %s" % (source, target))
 
 
-def list_photos(folder):
+def list_photos(folder, metadata_backend=None):
     """
     Lists all photos in folder with photo specific data.
+
+    :param metadata_backend: the metadata backend to use, see get_metadata. Uses the configured backend if None.
     """
     config = get_user_config()
+    metadata_backend = get_metadata_backend(config, metadata_backend)
     photo_extensions_to_include = [ext.strip() for ext in config.get('options', 'photo extensions').split(',')]
     for folder, filenames in get_photos_in_folder(folder, photo_extensions_to_include=photo_extensions_to_include).items():
         print("\n%s\n" % folder)
+        metadata_per_file = get_metadata_many([os.path.join(folder, filename) for filename in filenames],
+                                              backend=metadata_backend)
         for filename in filenames:
             complete_filename = os.path.join(folder, filename)
-            metadata = get_metadata(complete_filename)
+            metadata = metadata_per_file[complete_filename]
             size = os.stat(complete_filename).st_size
             make_n_model = ''
             if metadata:
@@ -74,6 +83,23 @@ def main():
     common_group.add_option("-a", "--auto-tag", dest="auto_tag", action="store_true",
                             help="use prepending folders as tags instead of day part from date")
     common_group.add_option("--tag", dest="tag", help="tag to use instead of day part from date")
+    common_group.add_option("--use-index", dest="use_index", action="store_true",
+                            help="look up dates and checksums in the index built by mediaphile.db")
+    common_group.add_option("--metadata-backend", dest="metadata_backend", type="choice", choices=metadata_backends,
+                            help="read metadata using exifread, exiftool or auto, which uses exiftool for raw photos "
+                                 "and movies if installed")
+    common_group.add_option("-j", "--jobs", dest="jobs", type="int",
+                            help="number of processes reading metadata and threads moving or copying photos at the "
+                                 "same time")
+    common_group.add_option("--plan", dest="plan", metavar="FILE",
+                            help="write the planned moves or copies to FILE, as JSON lines or msgpack if FILE ends "
+                                 "with .msgpack, instead of relocating any photos")
+    common_group.add_option("--plan-checksums", dest="plan_checksums", action="store_true",
+                            help="add checksums of the photos to the plan, verified when the plan is applied")
+    common_group.add_option("--apply-plan", dest="apply_plan", metavar="FILE",
+                            help="relocate photos as planned in FILE, continuing where an earlier run stopped")
+    common_group.add_option("--resume", dest="resume", action="store_true",
+                            help="skip photos relocated by an earlier, interrupted run on the same folders")
     parser.add_option_group(common_group)
 
     add_common_options(parser)
@@ -85,7 +111,12 @@ def main():
             print("You must provide a source when using the -l option.")
             sys.exit(1)
 
-        list_photos(options.source)
+        list_photos(options.source, options.metadata_backend)
+
+    elif options.apply_plan:
+        result = apply_plan(options.apply_plan, jobs=options.jobs)
+        print("Relocated %(completed)s photos, %(previously_completed)s relocated by earlier runs." % result)
+        sys.exit(0)
 
     elif not options.source and not options.target:
         print("ERROR: You must supply both source- and target-folders.\n")
@@ -93,21 +124,43 @@ def main():
         sys.exit(1)
 
     config = get_user_config(options.configuration_folder or None)
-
-    relocate_photos(
-        source_dir=options.source,
-        target_dir=options.target,
-        append_timestamp=config.getboolean('options', 'append timestamp') or False,
-        remove_source=options.delete,
-        tag=options.tag,
-        dry_run=options.dry_run,
-        photo_extensions_to_include=[ext.strip() for ext in config.get('options', 'photo extensions').split(',')],
-        timestamp_format=config.get('options', 'timestamp format'),
-        duplicate_filename_format=config.get('options', 'duplicate filename format'),
-        new_filename_format=config.get('options', 'new filename format'),
-        path_prefix=options.path_prefix,
-        skip_existing=options.skip_existing or config.getboolean('options', 'skip existing'),
-        auto_tag=options.auto_tag or config.getboolean('options', 'auto tag'))
+    file_index = options.use_index and FileIndex(get_index_filename(options.configuration_folder or None),
+                                                 checksum_algorithm=get_configured_checksum_algorithm(config)) or None
+    journal = not options.dry_run and not options.plan and Journal(
+        get_journal_filename('relocate_photos', options.source, options.target, options.configuration_folder or None),
+        resume=options.resume) or None
+
+    try:
+        relocate_photos(
+            source_dir=options.source,
+            target_dir=options.target,
+            append_timestamp=config.getboolean('options', 'append timestamp') or False,
+            remove_source=options.delete,
+            tag=options.tag,
+            dry_run=options.dry_run,
+            photo_extensions_to_include=[ext.strip() for ext in config.get('options', 'photo extensions').split(',')],
+            timestamp_format=config.get('options', 'timestamp format'),
+            duplicate_filename_format=config.get('options', 'duplicate filename format'),
+            new_filename_format=config.get('options', 'new filename format'),
+            path_prefix=options.path_prefix,
+            skip_existing=options.skip_existing or config.getboolean('options', 'skip existing'),
+            auto_tag=options.auto_tag or config.getboolean('options', 'auto tag'),
+            file_index=file_index,
+            metadata_backend=get_metadata_backend(config, options.metadata_backend),
+            jobs=options.jobs,
+            plan_filename=options.plan,
+            checksum_algorithm=options.plan_checksums and get_configured_checksum_algorithm(config) or None,
+            journal=journal)
+    except BaseException:
+        if journal:
+            journal.close()
+        raise
+
+    if journal:
+        journal.discard()
+
+    if file_index:
+        file_index.close()
 
 
 if __name__ == "__main__":
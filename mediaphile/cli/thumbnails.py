@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 
+import os
 import sys
 from optparse import OptionParser, OptionGroup
-from mediaphile.cli import add_common_options, check_common_options
+from mediaphile.cli import add_common_options, check_common_options, get_user_config, default_thumbnail_dimensions, \
+    default_thumbnail_timeout, default_thumbnail_max_tasks_per_child, default_thumbnail_index_name
+from mediaphile.lib.thumbnails import generate_folder_thumbnails, parse_dimensions, ThumbnailIndex
 
 
 def main():
@@ -14,32 +17,84 @@ def main():
     common_group = OptionGroup(parser, "Common parameters")
     common_group.add_option("-s", "--source", dest="source", help="the source folder to process")
     common_group.add_option("-t", "--target", dest="target", help="the target folder for new files")
-    common_group.add_option("--dry-run", dest="dru_run", action="store_true",
+    common_group.add_option("--dry-run", dest="dry_run", action="store_true",
                             help="Just do a test-run. No actual changes will be made")
+    common_group.add_option("--configuration-folder", dest="configuration_folder",
+                            help="folder containing mediaphile.ini to use")
     parser.add_option_group(common_group)
 
     thumb_group = OptionGroup(parser, "Thumbnail generation")
     thumb_group.add_option("-w", "--generate_thumbnails", dest="generate_thumbnails", action="store_true",
                       help="Creates thumbnails target folder for all photos in source folder")
     thumb_group.add_option("-o", "--dimensions", dest="thumbnail_dimensions", action="store",
-                      help="""Dimensions for thumbnail in pixels, for example 400x400 (height X width).
+                      default=default_thumbnail_dimensions,
+                      help="""Dimensions for thumbnail in pixels, for example 400x400 (width X height).
                       Can also generate thumbnail with different dimensions by providing a list of dimensions, like:
                       -o 400x400,800x600,1024x768. NB! No spaces!""")
     thumb_group.add_option("--crop", dest="crop_thumbnails", action="store_true",
                       help="Crops thumbnails and uses width and height values as boundries")
+    thumb_group.add_option("-j", "--jobs", dest="jobs", type="int",
+                      help="number of processes generating thumbnails at the same time")
+    thumb_group.add_option("--timeout", dest="timeout", type="float", default=default_thumbnail_timeout,
+                      help="max number of seconds to spend on a photo when using --jobs")
+    thumb_group.add_option("--max-tasks-per-child", dest="max_tasks_per_child", type="int",
+                      default=default_thumbnail_max_tasks_per_child,
+                      help="number of photos a process handles before it is replaced, to limit memory usage")
+    thumb_group.add_option("--no-index", dest="no_index", action="store_true",
+                      help="don't keep an index of generated thumbnails in the target folder. Without it thumbnails "
+                           "of changed photos are not generated again")
+    thumb_group.add_option("--prune", dest="prune", action="store_true",
+                      help="removes thumbnails of photos no longer found in the source folder")
     parser.add_option_group(thumb_group)
 
     add_common_options(parser)
     (options, args) = parser.parse_args()
     check_common_options(options, args)
 
-    if not options.source and not options.target:
+    if not options.source or not options.target:
         print("ERROR: You must supply both source- and target-folders.\n")
         sys.exit(1)
 
-    elif options.generate_thumbnails:
-        pass
+    elif options.generate_thumbnails or options.prune:
+        try:
+            sizes = parse_dimensions(options.thumbnail_dimensions)
+        except ValueError as ex:
+            print("ERROR: %s\n" % ex)
+            sys.exit(1)
+
+        if options.prune and options.no_index:
+            print("ERROR: Thumbnails can only be pruned using the index.\n")
+            sys.exit(1)
+
+        thumbnail_index = None
+        if not options.no_index and not options.dry_run or options.prune:
+            os.makedirs(options.target, exist_ok=True)
+            thumbnail_index = ThumbnailIndex(os.path.join(options.target, default_thumbnail_index_name))
+
+        try:
+            if options.generate_thumbnails:
+                config = get_user_config(options.configuration_folder or None)
+                count = generate_folder_thumbnails(
+                    options.source,
+                    options.target,
+                    sizes,
+                    crop=options.crop_thumbnails,
+                    photo_extensions_to_include=[ext.strip() for ext in
+                                                 config.get('options', 'photo extensions').split(',')],
+                    dry_run=options.dry_run,
+                    jobs=options.jobs,
+                    timeout=options.timeout,
+                    max_tasks_per_child=options.max_tasks_per_child,
+                    thumbnail_index=thumbnail_index)
+                print("Generated thumbnails of %s photos." % count)
+
+            if options.prune:
+                count = thumbnail_index.prune(options.source, options.dry_run)
+                print("Removed %s thumbnails of photos no longer found." % count)
+        finally:
+            if thumbnail_index:
+                thumbnail_index.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
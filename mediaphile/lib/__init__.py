@@ -103,7 +103,7 @@ class PerformanceLogger:
         if PerformanceLogger.enabled:
             self.logger.debug(str(self))
 
-        return True
+        return False
 
     def __str__(self):
         """
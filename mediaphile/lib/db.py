@@ -0,0 +1,235 @@
+import os
+import json
+import sqlite3
+import logging
+
+import dateutil.parser
+
+from mediaphile.cli import default_checksum_algorithm
+from mediaphile.lib.file_operations import walk, get_checksum, get_checksum_algorithm
+from mediaphile.lib.metadata import get_parsed_metadata
+
+logger = logging.getLogger("verbose")
+
+schema = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    inode INTEGER NOT NULL,
+    checksum TEXT,
+    checksum_algorithm TEXT,
+    metadata TEXT
+)
+"""
+
+
+def _encode_metadata(metadata):
+    """
+    Serializes the dictionary returned from get_parsed_metadata to json.
+    """
+    result = dict(metadata)
+    result['date'] = result['date'].isoformat()
+    return json.dumps(result, default=str)
+
+
+def _decode_metadata(data):
+    """
+    Restores a dictionary serialized by _encode_metadata.
+    """
+    result = json.loads(data)
+    result['date'] = dateutil.parser.parse(result['date'])
+    return result
+
+
+class FileIndex:
+    """
+    A persistent catalog of files, their checksums and parsed metadata stored in a SQLite database.
+
+    Every entry remembers the size, mtime and inode of the file when it was indexed. An entry is only trusted as long
+    as these values match the file on disk, so a changed or replaced file is always processed again. Checksums are
+    stored along with the name of their hash algorithm and only used if it matches the algorithm of the index.
+    """
+
+    def __init__(self, filename, commit_interval=1000, checksum_algorithm=default_checksum_algorithm):
+        """
+
+        :param filename: the SQLite database to use. Created if it doesn't exist.
+        :param commit_interval: number of changed entries between each commit when refreshing.
+        :param checksum_algorithm: the hash algorithm to use for checksums, see get_checksum_algorithm.
+        """
+        self.filename = filename
+        self.commit_interval = commit_interval
+        self.checksum_algorithm = get_checksum_algorithm(checksum_algorithm)
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(schema)
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(files)')]
+        if 'checksum_algorithm' not in columns:
+            # checksums stored before the algorithm was configurable are all SHA512
+            self.connection.execute("ALTER TABLE files ADD COLUMN checksum_algorithm TEXT DEFAULT 'sha512'")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Commits any pending changes and closes the database.
+        """
+        if self.connection:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def _lookup(self, filename, st):
+        """
+        Returns the (checksum, metadata) stored for filename or None if the file is unknown or has changed. The checksum
+        is None if it was calculated using another algorithm than the one used by the index.
+        """
+        row = self.connection.execute(
+            'SELECT size, mtime, inode, checksum, checksum_algorithm, metadata FROM files WHERE path = ?',
+            (filename,)).fetchone()
+        if row and row[:3] == (st.st_size, st.st_mtime, st.st_ino):
+            return row[4] == self.checksum_algorithm and row[3] or None, row[5]
+
+        return None
+
+    def _store(self, filename, st, checksum=None, metadata=None):
+        """
+        Inserts or replaces the entry for filename. The metadata must already be serialized by _encode_metadata.
+        """
+        self.connection.execute(
+            'INSERT OR REPLACE INTO files (path, size, mtime, inode, checksum, checksum_algorithm, metadata) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (filename, st.st_size, st.st_mtime, st.st_ino, checksum, checksum and self.checksum_algorithm or None,
+             metadata))
+
+    def lookup_checksum(self, filename, st=None):
+        """
+        Returns the checksum of filename if found in the index and the file is unchanged since it was indexed.
+
+        :param filename: the file to process.
+        :param st: the stat_result of the file, if already known.
+        :returns: a string or None.
+        """
+        filename = os.path.abspath(filename)
+        row = self._lookup(filename, st or os.stat(filename))
+        return row and row[0] or None
+
+    def store_checksum(self, filename, checksum, st=None):
+        """
+        Stores the checksum of filename, calculated using the algorithm of the index.
+
+        :param filename: the file to process.
+        :param checksum: the checksum of the file.
+        :param st: the stat_result of the file, if already known.
+        """
+        filename = os.path.abspath(filename)
+        st = st or os.stat(filename)
+        row = self._lookup(filename, st)
+        self._store(filename, st, checksum, row and row[1] or None)
+
+    def get_checksum(self, filename, st=None):
+        """
+        Returns the checksum of filename, from the index if the file is unchanged since it was indexed.
+
+        :param filename: the file to process.
+        :param st: the stat_result of the file, if already known.
+        :returns: a string.
+        """
+        st = st or os.stat(filename)
+        checksum = self.lookup_checksum(filename, st)
+        if not checksum:
+            checksum = get_checksum(filename, self.checksum_algorithm)
+            self.store_checksum(filename, checksum, st)
+
+        return checksum
+
+    def get_parsed_metadata(self, filename, st=None):
+        """
+        Returns the parsed metadata of filename, from the index if the file is unchanged since it was indexed.
+
+        :param filename: the file to process.
+        :param st: the stat_result of the file, if already known.
+        :returns: the dictionary returned by get_parsed_metadata.
+        """
+        filename = os.path.abspath(filename)
+        st = st or os.stat(filename)
+        row = self._lookup(filename, st)
+        if row and row[1]:
+            return _decode_metadata(row[1])
+
+        metadata = get_parsed_metadata(filename)
+        self._store(filename, st, row and row[0] or None, _encode_metadata(metadata))
+        return metadata
+
+    def get_date(self, filename, st=None):
+        """
+        Returns the date of filename as found by get_parsed_metadata.
+
+        :param filename: the file to process.
+        :param st: the stat_result of the file, if already known.
+        :returns: datetime
+        """
+        return self.get_parsed_metadata(filename, st)['date']
+
+    def refresh(self, folder, photo_extensions_to_include=None, checksums=True, workers=None):
+        """
+        Brings the index up to date with the files found in folder. Only new or changed files are processed and entries
+        for files no longer present in folder are removed.
+
+        :param folder: the folder to index.
+        :param photo_extensions_to_include: files with these extensions get their metadata indexed. If None no metadata
+            will be indexed.
+        :param checksums: boolean value indicating if we index the checksum of every file.
+        :param workers: number of threads scanning the folder, None or 1 for a serial scan.
+        :returns: a dictionary with the number of added, updated, unchanged and removed entries.
+        """
+        folder = os.path.abspath(folder)
+        prefix = folder.rstrip(os.sep) + os.sep
+        known = dict(((row[0], row[1:]) for row in self.connection.execute(
+            'SELECT path, size, mtime, inode, checksum_algorithm FROM files WHERE substr(path, 1, ?) = ?',
+            (len(prefix), prefix))))
+
+        stats = dict(added=0, updated=0, unchanged=0, removed=0)
+        changes = 0
+        for filename, st in walk(folder, with_stat=True, workers=workers):
+            previous = known.pop(filename, None)
+            if previous and previous[:3] == (st.st_size, st.st_mtime, st.st_ino):
+                if checksums and previous[3] != self.checksum_algorithm:
+                    logger.debug("Updating checksum of %s" % filename)
+                    self.connection.execute(
+                        'UPDATE files SET checksum = ?, checksum_algorithm = ? WHERE path = ?',
+                        (get_checksum(filename, self.checksum_algorithm), self.checksum_algorithm, filename))
+                    stats['updated'] += 1
+                    changes += 1
+                else:
+                    stats['unchanged'] += 1
+                continue
+
+            stats[previous and 'updated' or 'added'] += 1
+            logger.debug("Indexing %s" % filename)
+
+            metadata = None
+            ext = os.path.splitext(filename)[-1][1:].lower()
+            if photo_extensions_to_include and ext in photo_extensions_to_include:
+                try:
+                    metadata = _encode_metadata(get_parsed_metadata(filename))
+                except (Exception, SystemExit) as ex:
+                    logger.warning("Error reading metadata from %s: %s" % (filename, ex))
+
+            self._store(filename, st, checksums and get_checksum(filename, self.checksum_algorithm) or None,
+                        metadata)
+            changes += 1
+            if changes % self.commit_interval == 0:
+                self.connection.commit()
+
+        self.connection.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in known))
+        stats['removed'] = len(known)
+        self.connection.commit()
+        return stats
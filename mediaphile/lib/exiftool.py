@@ -0,0 +1,157 @@
+import os
+import json
+import atexit
+import logging
+import shutil
+import threading
+import subprocess
+
+logger = logging.getLogger("verbose")
+
+EXIFTOOL_SUPPORT = bool(shutil.which('exiftool'))
+
+# exiftool tag names and the corresponding keys used by exifread
+tag_mapping = {
+    'Make': 'Image Make',
+    'Model': 'Image Model',
+    'DateTimeOriginal': 'EXIF DateTimeOriginal',
+    'CreateDate': 'EXIF DateTimeDigitized',
+    'GPSLatitude': 'GPS GPSLatitude',
+    'GPSLatitudeRef': 'GPS GPSLatitudeRef',
+    'GPSLongitude': 'GPS GPSLongitude',
+    'GPSLongitudeRef': 'GPS GPSLongitudeRef',
+    'GPSAltitude': 'GPS GPSAltitude',
+}
+
+
+class ExifToolError(Exception):
+    """
+    Raised when the exiftool process cannot be started or stops responding.
+    """
+    pass
+
+
+class ExifTool(object):
+    """
+    Keeps a single exiftool process running in -stay_open mode and feeds it batches of files, so the cost of starting
+    exiftool, which is considerable, is paid once instead of once per file.
+
+    Usage:
+
+        with ExifTool() as exiftool:
+            for filename, tags in exiftool.get_tags(filenames).items():
+                ...
+    """
+
+    def __init__(self, executable='exiftool', batch_size=100):
+        """
+
+        :param executable: the exiftool executable, or a list with a command and its arguments.
+        :param batch_size: max number of files in every request sent to exiftool.
+        """
+        self.command = isinstance(executable, str) and [executable] or list(executable)
+        self.batch_size = batch_size
+        self.process = None
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        """
+        Starts the exiftool process, unless already running.
+        """
+        if self.process and self.process.poll() is None:
+            return
+
+        logger.debug("Starting %s" % ' '.join(self.command))
+        try:
+            self.process = subprocess.Popen(self.command + ['-stay_open', 'True', '-@', '-'], stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError as ex:
+            raise ExifToolError("Unable to start %s: %s" % (self.command[0], ex))
+
+    def close(self):
+        """
+        Tells the exiftool process to exit and waits for it to do so.
+        """
+        if not self.process:
+            return
+
+        try:
+            self.process.stdin.write(b'-stay_open\nFalse\n')
+            self.process.stdin.flush()
+            self.process.stdin.close()
+            self.process.wait(10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+
+    def execute(self, *args):
+        """
+        Runs exiftool with args in the running process and returns its output.
+
+        :param args: the command-line arguments, one per line sent to exiftool.
+        :returns: bytes.
+        """
+        with self.lock:
+            self.start()
+            try:
+                self.process.stdin.write(b''.join(os.fsencode(arg) + b'\n' for arg in args) + b'-execute\n')
+                self.process.stdin.flush()
+            except OSError as ex:
+                raise ExifToolError("Lost connection to exiftool: %s" % ex)
+
+            output = []
+            while True:
+                line = self.process.stdout.readline()
+                if not line:
+                    raise ExifToolError("exiftool exited unexpectedly.")
+                if line.rstrip() == b'{ready}':
+                    return b''.join(output)
+                output.append(line)
+
+    def get_tags(self, filenames):
+        """
+        Reads the tags listed in tag_mapping from filenames.
+
+        :param filenames: the files to process.
+        :returns: a dictionary with the filename as key and a dictionary of exifread style tags as value. Files exiftool
+            couldn't read are left out.
+        """
+        filenames = list(filenames)
+        result = {}
+        for index in range(0, len(filenames), self.batch_size):
+            batch = filenames[index:index + self.batch_size]
+            # exiftool always reports paths using forward slashes
+            source_files = dict((filename.replace(os.sep, '/'), filename) for filename in batch)
+            output = self.execute('-json', '-n', '-fast', *(['-%s' % tag for tag in tag_mapping] + batch))
+            for entry in output.strip() and json.loads(output.decode('utf-8')) or []:
+                filename = source_files.get(entry.pop('SourceFile', None))
+                if filename:
+                    result[filename] = dict((tag_mapping[tag], value) for tag, value in entry.items()
+                                            if tag in tag_mapping)
+
+        return result
+
+
+_exiftool = None
+
+
+def get_exiftool():
+    """
+    Returns the ExifTool instance shared by all callers in this process, started the first time it is used and closed
+    when the process exits.
+    """
+    global _exiftool
+    if not _exiftool:
+        _exiftool = ExifTool()
+        atexit.register(_exiftool.close)
+
+    return _exiftool
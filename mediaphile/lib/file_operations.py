@@ -1,33 +1,175 @@
 import os
+import errno
 import platform
+import mmap
+import time
+import shutil
 import hashlib
 import logging
+import threading
 
 import datetime
-
-from mediaphile.cli import default_new_filename_format, default_timestamp_format, default_duplicate_filename_format
+from itertools import repeat
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import xxhash
+    XXHASH_SUPPORT = True
+except ImportError:
+    XXHASH_SUPPORT = False
+
+from mediaphile.cli import default_new_filename_format, default_timestamp_format, default_duplicate_filename_format, \
+    default_partial_checksum_size, default_checksum_algorithm, default_checksum_buffer_size, \
+    default_checksum_mmap_threshold
 from mediaphile.lib import months, PerformanceLogger
 
 logger = logging.getLogger("verbose")
 
+xxhash_algorithms = ('xxh32', 'xxh64', 'xxh3_64', 'xxh3_128')
+
+# ioctl cloning the contents of a file into another on filesystems like btrfs and XFS, from linux/fs.h
+FICLONE = 0x40049409
+
+# errors meaning a copy strategy isn't supported by the kernel or filesystems involved
+_unsupported_copy_errors = (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EBADF)
 
-def generate_valid_target(filename, duplicate_filename_format=default_duplicate_filename_format):
+
+def generate_valid_target(filename, duplicate_filename_format=default_duplicate_filename_format, registry=None):
     """
     Generates a new filename if there is already an existing file with the same name.
 
     :param filename: the target file we want to create
+    :param duplicate_filename_format: format of the new filename, see default_duplicate_filename_format.
+    :param registry: a TargetNameRegistry to reserve the filename in instead of probing the filesystem.
     :returns: string
     """
+    if registry is not None:
+        return registry.reserve(filename, duplicate_filename_format)
+
+    base_name, ext = os.path.splitext(filename)
     counter = 1
-    while True:
-        if not os.path.exists(filename):
-            break
-        base_name, ext = os.path.splitext(filename)
+    while os.path.exists(filename):
         filename = duplicate_filename_format % dict(filename=base_name, counter=counter, file_extension=ext)
         counter += 1
     return filename
 
 
+class TargetNameRegistry:
+    """
+    Hands out unique target filenames without probing the filesystem for every candidate.
+
+    The names in a target folder are read using a single directory listing the first time the folder is used, and every
+    filename handed out is added to them. The next free counter for every filename is remembered, so a burst of files
+    with the same name gets its names in constant time. The registry is safe to share between threads.
+
+    Files created in a target folder by others after it has been listed are not known to the registry.
+    """
+
+    def __init__(self):
+        self.folders = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def _get_names(self, folder):
+        """
+        Returns the set of names in folder, listing it the first time. Must be called holding the lock.
+        """
+        names = self.folders.get(folder)
+        if names is None:
+            try:
+                names = set(os.listdir(folder))
+            except (FileNotFoundError, NotADirectoryError):
+                names = set()
+            self.folders[folder] = names
+
+        return names
+
+    def exists(self, filename):
+        """
+        Returns True if filename exists or has been handed out by the registry.
+        """
+        folder, name = os.path.split(filename)
+        with self.lock:
+            return name in self._get_names(folder)
+
+    def reserve(self, filename, duplicate_filename_format=default_duplicate_filename_format):
+        """
+        Returns filename, or a new filename generated using duplicate_filename_format if it is taken, and marks it as
+        taken.
+
+        :param filename: the target file we want to create.
+        :param duplicate_filename_format: format of the new filename, see default_duplicate_filename_format.
+        :returns: string
+        """
+        folder, name = os.path.split(filename)
+        with self.lock:
+            names = self._get_names(folder)
+            if name in names:
+                base_name, ext = os.path.splitext(filename)
+                counter = self.counters.get(filename, 1)
+                while True:
+                    candidate = duplicate_filename_format % dict(filename=base_name, counter=counter,
+                                                                 file_extension=ext)
+                    counter += 1
+                    if os.path.basename(candidate) not in names:
+                        break
+                self.counters[filename] = counter
+                filename, name = candidate, os.path.basename(candidate)
+
+            names.add(name)
+            return filename
+
+
+class DirectoryCache:
+    """
+    Remembers the folders known to exist during a run, so a folder receiving thousands of files is created, or found
+    to exist, once instead of once per file. The cache is safe to share between threads.
+
+    Folders removed by others after they were created or found are not noticed by the cache.
+    """
+
+    def __init__(self):
+        self.folders = set()
+        self.lock = threading.Lock()
+
+    def makedirs(self, folder):
+        """
+        Creates folder and any missing parent folders, unless already known to exist.
+        """
+        if folder in self.folders:
+            return
+
+        with self.lock:
+            if folder in self.folders:
+                return
+
+            os.makedirs(folder, exist_ok=True)
+            while folder not in self.folders:
+                self.folders.add(folder)
+                parent = os.path.dirname(folder)
+                if parent == folder:
+                    break
+                folder = parent
+
+    def makedirs_many(self, folders):
+        """
+        Creates all folders not known to exist, each of them once.
+        """
+        for folder in sorted(set(folders)):
+            self.makedirs(folder)
+
+
 def get_tag_from_filename(filename, source_dir):
     """
 
@@ -84,37 +226,132 @@ def generate_filename_from_date(filename, file_date, timestamp_format=default_ti
     return new_filename_format % dict(filename=basename, timestamp=timestamp, file_extension=ext)
 
 
-def dirwalk(folder, extensions_to_include=None):
+def dirwalk(folder, extensions_to_include=None, with_stat=False):
     """
     Traverse a directory yielding any file matching extensions_to_include or all if extensions_to_include is None.
     NB! The list of extensions must be in the form of ['jpg', 'png'] and not ['.jpg', '.png']!
 
+    The tree is traversed using os.scandir and an explicit stack of folders, so deep hierarchies do not pay for nested
+    generators and the file type of every entry comes from the directory listing itself. Symlinks to folders are
+    yielded as files and not followed.
+
     :param folder: the directory to traverse/scan.
     :param extensions_to_include: list if file-extensions to include. If not provided or None all files will be included.
+    :param with_stat: boolean value indicating if we yield (filename, stat_result) tuples instead of filenames. The
+        stat_result is fetched from the directory entry, costing at most one stat call per file.
     """
     extensions_check = extensions_to_include is not None
-    for f in os.listdir(folder):
-        full_path = os.path.join(folder, f)
-        if os.path.isdir(full_path) and not os.path.islink(full_path):
-            for x in dirwalk(full_path, extensions_to_include):
-                ext = os.path.splitext(x)[-1][1:].lower()
-                if not extensions_check or ext in extensions_to_include:
-                    yield x
-        else:
-            ext = os.path.splitext(full_path)[-1][1:].lower()
-            if not extensions_check or ext in extensions_to_include:
-                yield full_path
+    folders = [folder]
+    while folders:
+        current_folder = folders.pop()
+        sub_folders = []
+        with scandir(current_folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_folders.append(entry.path)
+                    continue
+
+                if extensions_check:
+                    ext = os.path.splitext(entry.name)[-1][1:].lower()
+                    if ext not in extensions_to_include:
+                        continue
+
+                if with_stat:
+                    yield entry.path, entry.stat()
+                else:
+                    yield entry.path
+
+        # reversed to visit sub folders in listing order when popping from the stack
+        sub_folders.reverse()
+        folders.extend(sub_folders)
 
 
-def get_files_in_folder(folder, extensions_to_include=None, sort_filenames=True):
+def _scan_folder(folder, extensions_to_include=None, with_stat=False):
+    """
+    Lists a single folder for parallel_dirwalk.
+
+    :param folder: the folder to list.
+    :param extensions_to_include: list of file-extensions to include, or None to include all files.
+    :param with_stat: boolean value indicating if we return (filename, stat_result) tuples instead of filenames.
+    :returns: a tuple of matching files and sub folders found in folder.
+    """
+    files = []
+    sub_folders = []
+    with scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                sub_folders.append(entry.path)
+                continue
+
+            if extensions_to_include is not None:
+                ext = os.path.splitext(entry.name)[-1][1:].lower()
+                if ext not in extensions_to_include:
+                    continue
+
+            files.append(with_stat and (entry.path, entry.stat()) or entry.path)
+
+    return files, sub_folders
+
+
+def parallel_dirwalk(folder, extensions_to_include=None, with_stat=False, workers=4, max_pending=None):
+    """
+    Same as dirwalk, but lists folders concurrently in a pool of threads. Useful on network or RAID-backed storage where
+    every directory listing is a round trip and a serial walk spends most of its time waiting.
+
+    Results are streamed back as the listings complete, so the order of the files is not deterministic. At most
+    max_pending listings are in flight at any time, which keeps memory usage bounded even if the consumer is slow.
+
+    :param folder: the directory to traverse/scan.
+    :param extensions_to_include: list of file-extensions to include. If not provided or None all files will be included.
+    :param with_stat: boolean value indicating if we yield (filename, stat_result) tuples instead of filenames.
+    :param workers: number of threads listing folders.
+    :param max_pending: max number of listings in flight. Defaults to workers * 4.
+    """
+    max_pending = max_pending or workers * 4
+    folders = deque([folder])
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while folders or pending:
+                while folders and len(pending) < max_pending:
+                    pending.add(executor.submit(_scan_folder, folders.popleft(), extensions_to_include, with_stat))
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, sub_folders = future.result()
+                    folders.extend(sub_folders)
+                    for f in files:
+                        yield f
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def walk(folder, extensions_to_include=None, with_stat=False, workers=None):
+    """
+    Traverse a directory using parallel_dirwalk if more than one worker is requested, or dirwalk if not.
+
+    :param folder: the directory to traverse/scan.
+    :param extensions_to_include: list of file-extensions to include. If not provided or None all files will be included.
+    :param with_stat: boolean value indicating if we yield (filename, stat_result) tuples instead of filenames.
+    :param workers: number of threads listing folders, None or 1 for a serial scan.
+    """
+    if workers and workers > 1:
+        return parallel_dirwalk(folder, extensions_to_include, with_stat=with_stat, workers=workers)
+
+    return dirwalk(folder, extensions_to_include, with_stat=with_stat)
+
+
+def get_files_in_folder(folder, extensions_to_include=None, sort_filenames=True, workers=None):
     """
 
     :param folder:
     :param extensions_to_include:
     :param sort_filenames:
+    :param workers: number of threads scanning the folder, None or 1 for a serial scan.
     """
     result = {}
-    for filename in dirwalk(folder, extensions_to_include):
+    for filename in walk(folder, extensions_to_include, workers=workers):
         path, filename = os.path.split(filename)
         result.setdefault(path, []).append(filename)
 
@@ -137,147 +374,661 @@ def remove_source_folders(folders):
             os.removedirs(folder)
 
 
+class Checksums:
+    """
+    Calculates and remembers the partial and full checksums of files, so no checksum is calculated more than once.
+
+    If jobs is more than one the files are hashed in parallel using a pool of processes, or a pool of threads if
+    use_threads is True. Threads are usually enough for large files, as hashlib releases the GIL while hashing.
+    """
+
+    def __init__(self, algorithm=default_checksum_algorithm, jobs=None, use_threads=False, file_index=None,
+                 chunk_size=default_partial_checksum_size):
+        """
+
+        :param algorithm: the hash algorithm to use. Ignored if file_index is provided, as the algorithm of the index is
+            used instead.
+        :param jobs: number of processes or threads hashing files, None or 1 to hash files in the current thread.
+        :param use_threads: boolean value indicating if we use threads instead of processes.
+        :param file_index: a FileIndex to look up and store full checksums in.
+        :param chunk_size: number of bytes from the start and end of the files to use for partial checksums.
+        """
+        self.algorithm = file_index and file_index.checksum_algorithm or get_checksum_algorithm(algorithm)
+        self.jobs = jobs or 1
+        self.use_threads = use_threads
+        self.file_index = file_index
+        self.chunk_size = chunk_size
+        self.partial = {}
+        self.full = {}
+        self.executor = None
+        if self.jobs > 1:
+            self.executor = use_threads and ThreadPoolExecutor(self.jobs) or ProcessPoolExecutor(self.jobs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the pool of processes or threads.
+        """
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+    def _map(self, func, filenames, *args):
+        """
+        Returns a list of func(filename, *args) for every filename, calculated using the pool if available.
+        """
+        if not self.executor or len(filenames) < 2:
+            return [func(filename, *args) for filename in filenames]
+
+        chunk_size = not self.use_threads and max(1, len(filenames) // (self.jobs * 4)) or 1
+        return list(self.executor.map(func, filenames, *[repeat(arg) for arg in args], chunksize=chunk_size))
+
+    def calculate_partial(self, filenames):
+        """
+        Calculates the partial checksums of filenames, available in the partial dictionary afterwards.
+
+        :param filenames: list of filenames.
+        """
+        missing = [filename for filename in dict.fromkeys(filenames) if filename not in self.partial]
+        self.partial.update(zip(missing, self._map(get_partial_checksum, missing, self.chunk_size, self.algorithm)))
+
+    def calculate_full(self, entries):
+        """
+        Calculates the full checksums of the files in entries, available in the full dictionary afterwards.
+
+        :param entries: list of (filename, stat_result) tuples. The stat_result may be None.
+        """
+        missing = {}
+        for filename, st in entries:
+            if filename in self.full or filename in missing:
+                continue
+
+            digest = self.file_index and self.file_index.lookup_checksum(filename, st)
+            if digest:
+                self.full[filename] = digest
+            else:
+                missing[filename] = st
+
+        filenames = list(missing)
+        for filename, digest in zip(filenames, self._map(get_checksum, filenames, self.algorithm)):
+            self.full[filename] = digest
+            if self.file_index:
+                self.file_index.store_checksum(filename, digest, missing[filename])
+
+
 def find_duplicates(source_folder, target_folder, delete_duplicates=False,
-                    rename_duplicates=False, dry_run=False, verbose=False, use_timestamp_for_diff=False):
+                    rename_duplicates=False, dry_run=False, verbose=False, use_timestamp_for_diff=False,
+                    file_index=None, checksum_algorithm=default_checksum_algorithm, jobs=None, use_threads=False,
+                    journal=None):
     """
     Finds filenames present in both the source folder and the target folder and optionally removes them.
 
+    Files are compared in stages: only files of equal size are compared, then only files with equal checksums of their
+    first and last bytes get a full checksum. Every checksum is calculated at most once per file.
+
     :param source_folder: the source folder.
     :param target_folder: the master folder.
     :param delete_duplicates: boolean value to indicate if we want to remove any duplicates found from the source folder.
     :param verbose: boolean value indicating verbose log.
+    :param file_index: a FileIndex to look up checksums in, or None to calculate every checksum.
+    :param checksum_algorithm: the hash algorithm to use. Ignored if file_index is provided, as the algorithm of the
+        index is used instead.
+    :param jobs: number of processes hashing files in parallel, None or 1 to hash files one at a time.
+    :param use_threads: boolean value indicating if we hash files in threads instead of processes.
+    :param journal: a Journal every compared file is recorded in, along with the file it duplicates, if any. Files
+        recorded as compared by an earlier run are not compared again, and recorded duplicates are handled as found.
     """
     source_files = {}
     target_files = {}
+    resumed = []
 
-    if verbose:
-        performance_log.debug("Scanning source folder ..."),
+    with PerformanceLogger("Scanning source folder"):
+        for filename, st in dirwalk(source_folder, with_stat=True):
+            source_files.setdefault(st.st_size, []).append((filename, st))
 
-    for filename in dirwalk(source_folder):
-        st = os.stat(filename)
-        source_files.setdefault(st.st_size, []).append((filename, st))
-
-    if verbose:
-        performance_log.debug("done!")
-
-    if verbose:
-        performance_log.debug("Scanning target folder ..."),
-
-    for filename in dirwalk(target_folder):
-        st = os.stat(filename)
-        target_files.setdefault(st.st_size, []).append((filename, st))
-
-    if verbose:
-        performance_log.debug("done!")
-
-    for file_size, file_data in target_files.items():
-        existing_files = source_files.get(file_size, [])
-        for existing_filename, existing_st in existing_files:
-            for filename, st in file_data:
-                duplicate_found = False
-                if use_timestamp_for_diff:
-                    existing_creation_time = st.st_mtime < st.st_ctime and st.st_mtime or st.st_ctime
-                    st_creation_time = existing_st.st_mtime < existing_st.st_ctime and existing_st.st_mtime or existing_st.st_ctime
-                    if existing_creation_time == st_creation_time:
-                        duplicate_found = True
+    with PerformanceLogger("Scanning target folder"):
+        for filename, st in dirwalk(target_folder, with_stat=True):
+            record = journal and journal.is_completed('compare', filename, st)
+            if record:
+                if record['target']:
+                    resumed.append((filename, record['target']))
+            else:
+                target_files.setdefault(st.st_size, []).append((filename, st))
+
+    buckets = [(source_files[file_size], file_data) for file_size, file_data in target_files.items()
+               if file_size in source_files]
+    if journal:
+        # files of a size not found in the source folder are new without comparing anything
+        for file_size, file_data in target_files.items():
+            if file_size not in source_files:
+                for filename, st in file_data:
+                    journal.record('compare', filename, None, st)
+
+    def handle(duplicates):
+        for filename, existing_filename in duplicates:
+            if verbose:
+                logger.debug("%s = %s." % (filename, existing_filename))
+
+            if rename_duplicates:
+                if dry_run:
+                    logger.debug("%s renamed to %s" % (filename, '?'))
                 else:
-                    duplicate_found = get_checksum(filename) == get_checksum(existing_filename)
+                    pass
 
-                if duplicate_found:
-                    if verbose:
-                        logger.debug("%s = %s." % (filename, existing_filename))
+            if delete_duplicates:
+                if dry_run:
+                    logger.debug("%s removed" % filename)
+                else:
+                    os.remove(filename)
+
+            yield filename
+
+    for filename in handle(resumed):
+        yield filename
 
-                    if rename_duplicates:
-                        if dry_run:
-                            logger.debug("%s renamed to %s" % (filename, '?'))
-                        else:
-                            pass
+    with Checksums(checksum_algorithm, jobs, use_threads, file_index) as checksums:
+        for batch in _batches(buckets, max(jobs or 1, 1) * 64):
+            if use_timestamp_for_diff:
+                results = [_compare_timestamps(existing_files, file_data) for existing_files, file_data in batch]
+            else:
+                results = [duplicates for duplicates, new_files in compare_buckets(batch, checksums)]
 
-                    if delete_duplicates:
-                        if dry_run:
-                            logger.debug("%s removed" % filename)
-                        else:
-                            os.remove(filename)
+            if journal:
+                for (existing_files, file_data), duplicates in zip(batch, results):
+                    existing_filenames = dict(duplicates)
+                    for filename, st in file_data:
+                        journal.record('compare', filename, existing_filenames.get(filename), st)
 
+            for duplicates in results:
+                for filename in handle(duplicates):
                     yield filename
 
 
-def get_checksum(filename):
+def _batches(buckets, batch_size):
+    """
+    Groups buckets of (source_entries, target_entries) into batches of at least batch_size files, so the files of
+    several small buckets can be hashed in parallel.
+    """
+    batch = []
+    files = 0
+    for bucket in buckets:
+        batch.append(bucket)
+        files += len(bucket[0]) + len(bucket[1])
+        if files >= batch_size:
+            yield batch
+            batch = []
+            files = 0
+
+    if batch:
+        yield batch
+
+
+def _compare_timestamps(source_entries, target_entries):
+    """
+    Returns (filename, source filename) for every file in target_entries created at the same time as a file in
+    source_entries.
+
+    :param source_entries: list of (filename, stat_result) tuples.
+    :param target_entries: list of (filename, stat_result) tuples.
+    """
+    creation_times = {}
+    for filename, st in source_entries:
+        creation_times.setdefault(st.st_mtime < st.st_ctime and st.st_mtime or st.st_ctime, filename)
+
+    result = []
+    for filename, st in target_entries:
+        existing_filename = creation_times.get(st.st_mtime < st.st_ctime and st.st_mtime or st.st_ctime)
+        if existing_filename:
+            result.append((filename, existing_filename))
+
+    return result
+
+
+def compare_buckets(buckets, checksums):
+    """
+    Splits the files in the target entries of every bucket into files with the same content as a file in the source
+    entries of the bucket and files with new content.
+
+    Files are first compared using checksums of their first and last bytes, and only files still matching are compared
+    by their full checksum. Files no larger than two chunks are completely covered by the first stage. The checksums of
+    all the files in the buckets are calculated together in each stage, in parallel if checksums has a pool.
+
+    :param buckets: list of (source_entries, target_entries) tuples, where both are lists of (filename, stat_result)
+        tuples and all files in a bucket have the same size.
+    :param checksums: a Checksums instance.
+    :returns: a list with a tuple for every bucket, of a list of (filename, source filename) for the duplicates and a
+        list of new filenames.
+    """
+    # files in buckets without source entries are new whatever their content is
+    checksums.calculate_partial([filename for source_entries, target_entries in buckets if source_entries
+                                 for filename, st in source_entries + target_entries])
+
+    matches = []
+    full_checksums_needed = []
+    for source_entries, target_entries in buckets:
+        partial_matches = {}
+        for filename, st in source_entries:
+            partial_matches.setdefault(checksums.partial[filename], []).append((filename, st))
+
+        bucket = []
+        for filename, st in target_entries:
+            candidates = source_entries and partial_matches.get(checksums.partial[filename], []) or []
+            complete = st.st_size <= 2 * checksums.chunk_size
+            if candidates and not complete:
+                full_checksums_needed.append((filename, st))
+                full_checksums_needed.extend(candidates)
+            bucket.append((filename, candidates, complete))
+        matches.append(bucket)
+
+    checksums.calculate_full(full_checksums_needed)
+
+    result = []
+    for bucket in matches:
+        duplicates = []
+        new_files = []
+        for filename, candidates, complete in bucket:
+            existing_filename = None
+            if candidates and complete:
+                existing_filename = candidates[0][0]
+            elif candidates:
+                digest = checksums.full[filename]
+                for candidate, candidate_st in candidates:
+                    if checksums.full[candidate] == digest:
+                        existing_filename = candidate
+                        break
+
+            if existing_filename:
+                duplicates.append((filename, existing_filename))
+            else:
+                new_files.append(filename)
+
+        result.append((duplicates, new_files))
+
+    return result
+
+
+def compare_contents(source_entries, target_entries, checksums=None, chunk_size=default_partial_checksum_size,
+                     algorithm=default_checksum_algorithm):
     """
-    Generates a hexdigest version of the SHA512 checksum generated from the provided filename.
+    Splits files of equal size in target_entries into files with the same content as a file in source_entries and
+    files with new content. See compare_buckets.
+
+    :param source_entries: list of (filename, stat_result) tuples, all of the same size.
+    :param target_entries: list of (filename, stat_result) tuples, same size as source_entries.
+    :param checksums: a Checksums instance, or None to create one using chunk_size and algorithm.
+    :param chunk_size: number of bytes from the start and end of the files to use in the first stage.
+    :param algorithm: the hash algorithm to use.
+    :returns: a tuple of a list of (filename, source filename) for the duplicates and a list of new filenames.
+    """
+    checksums = checksums or Checksums(algorithm, chunk_size=chunk_size)
+    return compare_buckets([(source_entries, target_entries)], checksums)[0]
+
+
+def get_partial_checksum(filename, chunk_size=default_partial_checksum_size, algorithm=default_checksum_algorithm):
+    """
+    Generates a hexdigest version of the checksum of the first and last chunk_size bytes of the provided filename.
+    Files no larger than two chunks are hashed completely.
 
     :param filename:
+    :param chunk_size: number of bytes to read from the start and the end of the file.
+    :param algorithm: the hash algorithm to use, see get_checksum_algorithm.
+    :returns: a string.
+    """
+    result = new_checksum(algorithm)
+    with open(filename, 'rb') as f:
+        result.update(f.read(chunk_size))
+        size = os.fstat(f.fileno()).st_size
+        if size > chunk_size:
+            f.seek(max(chunk_size, size - chunk_size))
+            result.update(f.read())
+
+    return result.hexdigest()
+
+
+def get_checksum_algorithm(algorithm=default_checksum_algorithm):
+    """
+    Returns the name of the hash algorithm actually used when asking for algorithm. Any algorithm provided by hashlib
+    can be used, like sha512 or the faster blake2b. The non-cryptographic xxh32, xxh64, xxh3_64 and xxh3_128 are even
+    faster, but requires the xxhash package. If it is not installed blake2b is used instead.
+
+    :param algorithm: name of the hash algorithm.
     :returns: a string.
     """
-    f = open(filename)
-    result = hashlib.sha512()
+    algorithm = algorithm.strip().lower()
+    if algorithm in xxhash_algorithms:
+        return XXHASH_SUPPORT and algorithm or 'blake2b'
+
+    if algorithm not in hashlib.algorithms_available:
+        raise ValueError("Unknown checksum algorithm '%s'." % algorithm)
+
+    return algorithm
+
+
+def new_checksum(algorithm=default_checksum_algorithm):
+    """
+    Returns a new hash object for algorithm, see get_checksum_algorithm.
+
+    :param algorithm: name of the hash algorithm.
+    """
+    algorithm = get_checksum_algorithm(algorithm)
+    if algorithm in xxhash_algorithms:
+        return getattr(xxhash, algorithm)()
+
+    return hashlib.new(algorithm)
+
+
+def _update_checksum_using_readinto(f, result, buffer_size):
+    """
+    Updates the hash object result with the contents of the file object f, read into a single reused buffer.
+    """
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
     while 1:
-        data = f.read(4096)
-        if not data:
+        length = f.readinto(buffer)
+        if not length:
             break
-        result.update(data)
+        result.update(view[:length])
+
+
+def _update_checksum_using_mmap(f, result, buffer_size):
+    """
+    Updates the hash object result with the contents of the file object f, using a memory map of the file. Falls back
+    to _update_checksum_using_readinto if the file cannot be mapped.
+    """
+    try:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError, OverflowError):
+        return _update_checksum_using_readinto(f, result, buffer_size)
+
+    try:
+        if hasattr(mapped, 'madvise'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+        view = memoryview(mapped)
+        try:
+            # updating in chunks lets hashlib release the GIL for a while instead of holding it for the whole file
+            for offset in range(0, len(view), buffer_size):
+                result.update(view[offset:offset + buffer_size])
+        finally:
+            view.release()
+    finally:
+        mapped.close()
+
+
+checksum_strategies = {
+    'readinto': _update_checksum_using_readinto,
+    'mmap': _update_checksum_using_mmap,
+}
+
+
+def get_checksum(filename, algorithm=default_checksum_algorithm, strategy=None,
+                 buffer_size=default_checksum_buffer_size):
+    """
+    Generates a hexdigest version of the checksum generated from the provided filename.
+
+    Files are read into a single reused buffer, and files of default_checksum_mmap_threshold bytes or more are memory
+    mapped instead, so hashing large RAW-files and movies is not slowed down by lots of small reads and allocations.
+
+    :param filename:
+    :param algorithm: the hash algorithm to use, see get_checksum_algorithm.
+    :param strategy: 'readinto' or 'mmap' to override the strategy chosen by the size of the file.
+    :param buffer_size: number of bytes to read, or hash, at a time.
+    :returns: a string.
+    """
+    result = new_checksum(algorithm)
+    with open(filename, 'rb') as f:
+        if not strategy:
+            size = os.fstat(f.fileno()).st_size
+            strategy = size >= default_checksum_mmap_threshold and 'mmap' or 'readinto'
+            buffer_size = min(buffer_size, size + 1)
+
+        checksum_strategies[strategy](f, result, buffer_size)
+
     return result.hexdigest()
 
 
-def build_file_cache(path, ignore_files=None):
+def _copy_using_reflink(src, dst, size):
+    """
+    Makes dst share the data blocks of src, so no data is copied at all.
+    """
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    return os.fstat(dst.fileno()).st_size
+
+
+def _copy_using_copy_file_range(src, dst, size):
+    """
+    Copies src to dst inside the kernel, which may also be done by the filesystem or storage itself.
+    """
+    copied = 0
+    while copied < size:
+        length = os.copy_file_range(src.fileno(), dst.fileno(), size - copied)
+        if not length:
+            break
+        copied += length
+    return copied
+
+
+def _copy_using_sendfile(src, dst, size):
+    """
+    Copies src to dst inside the kernel.
+    """
+    copied = 0
+    while copied < size:
+        length = os.sendfile(dst.fileno(), src.fileno(), copied, min(size - copied, 1024 * 1024 * 1024))
+        if not length:
+            break
+        copied += length
+    return copied
+
+
+def _copy_using_read_write(src, dst, size):
+    """
+    Copies src to dst by reading and writing chunks in userspace.
+    """
+    shutil.copyfileobj(src, dst, default_checksum_buffer_size)
+    return dst.tell()
+
+
+# tried in order until one of them is supported, strategies not available on this platform are None. Every strategy
+# returns the number of bytes copied, which may be less than the size of the file if the strategy is not supported
+copy_strategies = [
+    ('reflink', platform.system() == 'Linux' and fcntl and _copy_using_reflink or None),
+    ('copy_file_range', hasattr(os, 'copy_file_range') and _copy_using_copy_file_range or None),
+    ('sendfile', platform.system() == 'Linux' and hasattr(os, 'sendfile') and _copy_using_sendfile or None),
+    ('read_write', _copy_using_read_write),
+]
+
+# (strategy, source device, target device) known not to work, so they are not tried for every file
+_unsupported_copy_strategies = set()
+
+
+class TransferStatistics:
+    """
+    Counts the files and bytes moved or copied using every strategy, and the time spent, so the throughput of every
+    strategy can be reported in the performance log. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self.strategies = {}
+        self.lock = threading.Lock()
+
+    def add(self, strategy, size, duration):
+        """
+        Records a file of size bytes transferred in duration seconds using strategy.
+        """
+        with self.lock:
+            files, total_size, total_duration = self.strategies.get(strategy, (0, 0, 0.0))
+            self.strategies[strategy] = (files + 1, total_size + size, total_duration + duration)
+
+    def log(self):
+        """
+        Logs files, bytes and bytes/s of every strategy used to the performance log, if enabled.
+        """
+        if not PerformanceLogger.enabled:
+            return
+
+        performance_logger = logging.getLogger("PerformanceLogger")
+        with self.lock:
+            for strategy, (files, size, duration) in sorted(self.strategies.items()):
+                performance_logger.debug("Transferred %s files, %s bytes using %s. %.1f bytes/s." % (
+                    files, size, strategy, size / max(duration, 1e-9)))
+
+
+def copy_file(source, target, statistics=None, atomic=False):
+    """
+    Copies the contents and permission bits of source to target like shutil.copy, using the fastest strategy in
+    copy_strategies supported by the filesystems involved: a reflink, an in-kernel copy or a userspace copy.
+
+    :param source: the file to copy.
+    :param target: the filename of the copy.
+    :param statistics: a TransferStatistics to record the copy in.
+    :param atomic: boolean value indicating if we copy to a temporary file renamed to target when complete, so target
+        never exists partially copied.
+    """
+    filename = atomic and '%s.%s.part' % (target, os.getpid()) or target
+    with open(source, 'rb') as src, open(filename, 'wb') as dst:
+        src_st = os.fstat(src.fileno())
+        devices = (src_st.st_dev, os.fstat(dst.fileno()).st_dev)
+        for strategy, copy in copy_strategies:
+            if not copy or (strategy, devices) in _unsupported_copy_strategies:
+                continue
+
+            start = time.time()
+            try:
+                copied = copy(src, dst, src_st.st_size)
+            except OSError as ex:
+                if ex.errno not in _unsupported_copy_errors or strategy == 'read_write':
+                    raise
+                logger.debug("Copying using %s not supported from %s to %s: %s" % (strategy, source, target, ex))
+                _unsupported_copy_strategies.add((strategy, devices))
+                copied = None
+
+            if copied != src_st.st_size or os.fstat(dst.fileno()).st_size != src_st.st_size:
+                if copied is not None:
+                    if strategy == 'read_write':
+                        raise OSError(errno.EIO, "Copied %s of %s bytes from %s to %s" % (
+                            copied, src_st.st_size, source, target))
+                    logger.debug("Copying using %s stopped after %s of %s bytes from %s to %s" % (
+                        strategy, copied, src_st.st_size, source, target))
+                    if not copied:
+                        # like shutil, a strategy copying nothing at all is considered unsupported
+                        _unsupported_copy_strategies.add((strategy, devices))
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+                continue
+
+            if statistics:
+                statistics.add(strategy, src_st.st_size, time.time() - start)
+            break
+
+    shutil.copymode(source, filename)
+    if atomic:
+        os.replace(filename, target)
+
+
+def move_file(source, target, statistics=None, atomic=False):
+    """
+    Moves source to target like shutil.move. Files are renamed if source and target are on the same filesystem, and
+    copied using copy_file and removed otherwise.
+
+    :param source: the file to move.
+    :param target: the new filename.
+    :param statistics: a TransferStatistics to record the move in.
+    :param atomic: see copy_file.
+    """
+    start = time.time()
+    try:
+        os.rename(source, target)
+    except OSError as ex:
+        if ex.errno != errno.EXDEV:
+            raise
+    else:
+        if statistics:
+            statistics.add('rename', os.stat(target).st_size, time.time() - start)
+        return
+
+    if atomic:
+        filename = '%s.%s.part' % (target, os.getpid())
+        copy_file(source, filename, statistics)
+        shutil.copystat(source, filename)
+        os.replace(filename, target)
+    else:
+        copy_file(source, target, statistics)
+        shutil.copystat(source, target)
+
+    if os.stat(target).st_size != os.stat(source).st_size:
+        raise OSError(errno.EIO, "%s was not completely copied to %s, keeping the source" % (source, target))
+    os.unlink(source)
+
+
+def transfer_file(source, target, remove_source=False, statistics=None, atomic=False):
+    """
+    Moves source to target if remove_source is True, copies it otherwise. See move_file and copy_file.
+    """
+    if remove_source:
+        move_file(source, target, statistics, atomic)
+    else:
+        copy_file(source, target, statistics, atomic)
+
+
+def build_file_cache(path, ignore_files=None, workers=None):
     """
     Builds a cache using filesize as key and a list of matching filenames as value.
 
     :param path: the folder containing files to process.
+    :param workers: number of threads scanning the folder, None or 1 for a serial scan.
     :returns: a dictionary of filesize mapped against matching filenames in path.
     """
     result = {}
-    for filename in dirwalk(path):
-        p, f = os.path.split(filename)
-        if ignore_files and f.lower() in ignore_files:
+    for filename, st in walk(path, with_stat=True, workers=workers):
+        if ignore_files and os.path.basename(filename).lower() in ignore_files:
             continue
-        st = os.stat(filename)
         result.setdefault(st.st_size, []).append(filename)
     return result
 
 
-def find_new_files(source_folder, target_folder, verbose=False):
+def find_new_files(source_folder, target_folder, verbose=False, file_index=None,
+                   checksum_algorithm=default_checksum_algorithm, jobs=None, use_threads=False):
     """
-    Locates files in the source folder not present in the target folder. Uses filesize to determine if something is
-    duplicate or not.
+    Locates files in the source folder not present in the target folder. Uses filesize, and checksums for files of
+    equal size, to determine if something is duplicate or not. Every new file is yielded once.
 
     :param source_folder: the folder containing files you want to check are present in the target folder.
     :param target_folder: the folder containing existing files.
     :param verbose: boolean value indicating if the process logs debug info or not.
+    :param file_index: a FileIndex to look up checksums in, or None to calculate every checksum.
+    :param checksum_algorithm: the hash algorithm to use if file_index is not provided.
+    :param jobs: number of processes hashing files in parallel, None or 1 to hash files one at a time.
+    :param use_threads: boolean value indicating if we hash files in threads instead of processes.
     """
+    source_files = {}
+    target_files = {}
+
     with PerformanceLogger("Scanning source folder"):
-        source_files = build_file_cache(source_folder)
+        for filename, st in dirwalk(source_folder, with_stat=True):
+            source_files.setdefault(st.st_size, []).append((filename, st))
 
     with PerformanceLogger("Scanning target folder"):
-        target_files = build_file_cache(target_folder)
+        for filename, st in dirwalk(target_folder, with_stat=True):
+            target_files.setdefault(st.st_size, []).append((filename, st))
+
+    buckets = [(source_files.get(file_size, []), file_data) for file_size, file_data in target_files.items()]
 
-    sha_cache = {}
-    with PerformanceLogger("Locating new content"):
-        for file_size, filenames in target_files.items():
-            if not file_size in source_files.keys():
-                for filename in filenames:
+    with Checksums(checksum_algorithm, jobs, use_threads, file_index) as checksums, \
+            PerformanceLogger("Locating new content"):
+        for batch in _batches(buckets, max(jobs or 1, 1) * 64):
+            for duplicates, new_files in compare_buckets(batch, checksums):
+                for filename in new_files:
                     if verbose:
                         logger.debug(filename)
 
                     yield filename
-            else:
-                for existing_filename in source_files[file_size]:
-                    for filename in filenames:
-
-                        if existing_filename[:8] == filename[:8]:
-                            continue
-
-                        if not existing_filename in sha_cache:
-                            sha_cache[existing_filename] = get_checksum(existing_filename)
-
-                        if not filename in sha_cache:
-                            sha_cache[filename] = get_checksum(filename)
-
-                        if sha_cache[existing_filename] != sha_cache[filename]:
-                            if verbose:
-                                logger.debug(filename)
-
-                            yield filename
 
 
 def clean_up(source_folder, ignore_files=None):
@@ -1,33 +1,695 @@
-import pyinotify
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-# The watch manager stores the watches and provides operations on watches
-wm = pyinotify.WatchManager()
+try:
+    import pyinotify
+    PYINOTIFY_SUPPORT = True
+except ImportError:
+    PYINOTIFY_SUPPORT = False
 
-mask = pyinotify.IN_DELETE | pyinotify.IN_CREATE  # watched events
+from mediaphile.cli import default_photo_extensions, default_movie_extensions, default_watch_settle_seconds, \
+    default_watch_batch_size, default_watch_queue_size, default_watch_max_pending, default_watch_report_seconds, \
+    default_metadata_backend, default_watch_state_seconds
+from mediaphile.lib import PerformanceLogger
+from mediaphile.lib.file_operations import dirwalk, walk, get_tag_from_filename, TargetNameRegistry, DirectoryCache, \
+    TransferStatistics
+from mediaphile.lib.photos import relocate_photo, get_date_from_file
+from mediaphile.lib.movies import relocate_movie
 
+logger = logging.getLogger("verbose")
 
-class EventHandler(pyinotify.ProcessEvent):
+# files completely written to or moved into a watched folder, and new folders which may already hold files
+mask = PYINOTIFY_SUPPORT and (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE) or 0
+
+# only acted on for folders, as a file is created before it's written
+create_mask = PYINOTIFY_SUPPORT and pyinotify.IN_CREATE or 0
+
+# the kernel dropped events as they weren't read fast enough
+overflow_mask = PYINOTIFY_SUPPORT and pyinotify.IN_Q_OVERFLOW or 0
+
+
+class Debouncer:
+    """
+    Holds back files reported by inotify until they have settled, meaning no new event was reported for the file and
+    its size and modification time stayed the same for settle_seconds, so files still being written, like uploads
+    closing and reopening the file, aren't picked up half-way.
+    """
+
+    def __init__(self, settle_seconds=default_watch_settle_seconds, clock=time.monotonic):
+        """
+
+        :param settle_seconds: number of seconds a file must stay unchanged before it's ready.
+        :param clock: function returning the current time in seconds.
+        """
+        self.settle_seconds = settle_seconds
+        self.clock = clock
+        # filename -> (time of first event, time of last event, (size, mtime)), ordered by time of last event
+        self.pending = OrderedDict()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _signature(self, filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def add(self, filename):
+        """
+        Adds filename, or restarts its settle period if already added.
+        """
+        signature = self._signature(filename)
+        if signature:
+            now = self.clock()
+            arrival, seen, previous = self.pending.pop(filename, (now, None, None))
+            self.pending[filename] = (arrival, now, signature)
+
+    def settled(self, max_files=None):
+        """
+        Returns the files that have settled and forgets them. Files no longer present are forgotten, and files found
+        changed get a new settle period.
+
+        :param max_files: max number of files to return, None for all.
+        :returns: a list of (filename, time of first event) tuples, in the order the files settled.
+        """
+        now = self.clock()
+        result = []
+        for filename, (arrival, seen, signature) in list(self.pending.items()):
+            if now - seen < self.settle_seconds or max_files and len(result) >= max_files:
+                break
+
+            del self.pending[filename]
+            current = self._signature(filename)
+            if current == signature:
+                result.append((filename, arrival))
+            elif current:
+                self.pending[filename] = (arrival, now, current)
+
+        return result
+
+    def ready(self, max_files=None):
+        """
+        Returns the files that have settled and forgets them, see settled.
+
+        :param max_files: max number of files to return, None for all.
+        :returns: a list of filenames, in the order they settled.
+        """
+        return [filename for filename, arrival in self.settled(max_files)]
+
+    def next_timeout(self):
+        """
+        Returns the number of seconds until the first pending file may be ready, or None if nothing is pending.
+        """
+        for arrival, seen, signature in self.pending.values():
+            return max(0, seen + self.settle_seconds - self.clock())
+        return None
+
+
+class Ingester:
+    """
+    Relocates photos and movies into a date-based hierarchy in the target folder using relocate_photo and
+    relocate_movie, a batch at a time, by a pool of threads. Target filenames and folders are tracked for the lifetime
+    of the ingester, like for a single run of relocate_photos.
+    """
+
+    def __init__(self, source_dir, target_dir, remove_source=True, jobs=None, tag=None, auto_tag=False, dry_run=False,
+                 photo_extensions_to_include=None, movie_extensions_to_include=None,
+                 metadata_backend=default_metadata_backend, **options):
+        """
+
+        :param source_dir: the watched folder, used to generate tags if auto_tag is True.
+        :param target_dir: the folder to build the date-based hierarchy in.
+        :param remove_source: boolean value indicating if we move files instead of copying them.
+        :param jobs: number of threads relocating files, None for one.
+        :param tag: string value to use instead of the day-part in the folder structure.
+        :param auto_tag: boolean value indicating if the folders a file was found in are used as tag.
+        :param dry_run: boolean value indicating if we only log what would have been done.
+        :param photo_extensions_to_include: extensions of the files relocated as photos.
+        :param movie_extensions_to_include: extensions of the files relocated as movies.
+        :param metadata_backend: the metadata backend used to read dates from photos, see get_metadata.
+        :param options: keyword arguments for relocate_photo, like append_timestamp or timestamp_format.
+        """
+        self.source_dir = source_dir
+        self.target_dir = target_dir
+        self.remove_source = remove_source
+        self.tag = tag
+        self.auto_tag = auto_tag
+        self.dry_run = dry_run
+        self.photo_extensions = set(photo_extensions_to_include or default_photo_extensions)
+        self.movie_extensions = set(movie_extensions_to_include or default_movie_extensions)
+        self.metadata_backend = metadata_backend
+        self.options = options
+        self.registry = TargetNameRegistry()
+        self.directories = DirectoryCache()
+        self.statistics = TransferStatistics()
+        self.jobs = jobs or 1
+        self.pool = ThreadPoolExecutor(self.jobs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Waits for files being relocated and shuts down the pool of threads.
+        """
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+            self.statistics.log()
+
+    def accepts(self, filename):
+        """
+        Returns True if filename is a photo or a movie.
+        """
+        ext = os.path.splitext(filename)[-1][1:].lower()
+        return ext in self.photo_extensions or ext in self.movie_extensions
+
+    def is_photo(self, filename):
+        """
+        Returns True if filename is a photo, which gets its date from its metadata.
+        """
+        return os.path.splitext(filename)[-1][1:].lower() in self.photo_extensions
+
+    def place(self, filename, file_date=None):
+        """
+        Relocates a single photo or movie. Errors are logged, so a single bad file doesn't stop the ingester.
+
+        :param file_date: the date of a photo, if already known.
+        :returns: the new filename, or None if the file was skipped or failed.
+        """
+        tag = self.tag or self.auto_tag and get_tag_from_filename(filename, self.source_dir) or None
+        try:
+            if self.is_photo(filename):
+                file_date = file_date or get_date_from_file(filename, self.metadata_backend)
+                return relocate_photo(filename, self.target_dir, file_date=file_date,
+                                      remove_source=self.remove_source, tag=tag,
+                                      dry_run=self.dry_run, registry=self.registry, directories=self.directories,
+                                      statistics=self.statistics, **self.options)
+
+            if self.dry_run:
+                logger.debug('%s %s' % (self.remove_source and 'move' or 'copy', filename))
+                return None
+
+            return relocate_movie(filename, self.target_dir,
+                                  append_timestamp=self.options.get('append_timestamp', True),
+                                  remove_source=self.remove_source, tag=tag,
+                                  skip_existing=self.options.get('skip_existing', False),
+                                  path_prefix=self.options.get('path_prefix'), registry=self.registry,
+                                  directories=self.directories, statistics=self.statistics)
+        except (Exception, SystemExit) as ex:
+            logger.warning("Error relocating %s: %s" % (filename, ex))
+            return None
+
+    def process(self, filenames):
+        """
+        Relocates a batch of files using the pool of threads and waits for all of them.
+
+        :returns: a list of new filenames, None for skipped or failed files.
+        """
+        return list(self.pool.map(self.place, filenames))
+
+
+class HighWaterMark:
     """
-    Eventhandler for inotify.
+    Remembers which files in a watched folder have been handled, so a watcher that was stopped, or crashed, only has
+    to look at files changed after the mark when it starts, instead of relocating everything again or missing files
+    arriving while it was down.
+
+    Files are compared by their ctime, which, unlike their mtime, is updated when a file is moved into the folder.
+    Every file with a ctime up to the mark has been handled. The mark only advances up to the oldest file still waiting
+    to settle or being relocated, and the inodes of files handled after the mark are remembered, so files being copied
+    instead of moved aren't relocated twice.
+
+    The state is saved to filename at most every save_seconds seconds and when the watcher stops, so after a crash at
+    most the files handled during the last save_seconds seconds are looked at again.
     """
-    def process_IN_CREATE(self, event):
+
+    def __init__(self, filename=None, save_seconds=default_watch_state_seconds, clock=time.monotonic, mark=0):
+        """
+
+        :param filename: the file holding the state, loaded if it exists. None to not persist the state.
+        :param save_seconds: min number of seconds between every save.
+        :param clock: function returning the current time in seconds.
+        :param mark: the ctime in nanoseconds up to which files are considered handled, if there's no saved state.
+        """
+        self.filename = filename
+        self.save_seconds = save_seconds
+        self.clock = clock
+        self.mark = mark
+        # inode -> ctime of handled files with a ctime after the mark
+        self.handled = {}
+        # filename -> (inode, ctime) of files waiting to settle or being relocated
+        self.in_flight = {}
+        self.last_save = clock()
+        self.changed = False
+        if filename and os.path.exists(filename):
+            with open(filename) as f:
+                state = json.load(f)
+            self.mark = state['mark']
+            self.handled = dict((inode, ctime) for inode, ctime in state['handled'])
+            logger.debug("Loaded high-water mark %s from %s" % (self.mark, filename))
+
+    def is_new(self, st):
+        """
+        Returns True if the file with stat_result st has not been handled.
+        """
+        return st.st_ctime_ns > self.mark and self.handled.get(st.st_ino) != st.st_ctime_ns
+
+    def add(self, filename, st):
         """
-        Handles creation of files.
+        Records filename as waiting to be relocated.
+        """
+        self.in_flight[filename] = (st.st_ino, st.st_ctime_ns)
+
+    def done(self, filename):
+        """
+        Records filename as handled, whether it was relocated, skipped or failed. The mark is advanced when saved.
+        """
+        entry = self.in_flight.pop(filename, None)
+        if entry:
+            inode, ctime = entry
+            self.handled[inode] = ctime
+            self.changed = True
+
+    def advance(self):
         """
-        print "Creating:", event.pathname
+        Advances the mark as far as the files waiting to settle or being relocated allow.
+        """
+        if self.in_flight:
+            mark = min(ctime for inode, ctime in self.in_flight.values()) - 1
+        else:
+            mark = max(self.handled.values() or [self.mark])
+
+        if mark > self.mark:
+            self.mark = mark
+            self.handled = dict((inode, ctime) for inode, ctime in self.handled.items() if ctime > mark)
+
+    def save(self, force=False):
+        """
+        Saves the state, if changed and save_seconds seconds have passed since it was last saved.
+
+        :param force: boolean value indicating if we save now, however long ago the state was last saved.
+        """
+        if not self.changed or not force and self.clock() - self.last_save < self.save_seconds:
+            return
+
+        # files removed while waiting to settle won't be done
+        for filename in [filename for filename in self.in_flight if not os.path.exists(filename)]:
+            del self.in_flight[filename]
+        self.advance()
+        if not self.filename:
+            self.last_save = self.clock()
+            self.changed = False
+            return
+
+        temporary_filename = '%s.%s.part' % (self.filename, os.getpid())
+        with open(temporary_filename, 'w') as f:
+            json.dump(dict(mark=self.mark, handled=list(self.handled.items())), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_filename, self.filename)
+        self.last_save = self.clock()
+        self.changed = False
+
+
+class FolderWatcher:
+    """
+    Watches a folder, and its sub folders, using inotify and relocates every photo and movie written or moved into it
+    using an Ingester, in batches of at most batch_size files once they have settled, see Debouncer.
+
+    Instances are called with every inotify event, which makes them usable as the default_proc_fun of a pyinotify
+    Notifier.
+
+    If a HighWaterMark is provided, the files arriving while the watcher was down are found by reconcile, when it
+    starts. Otherwise a HighWaterMark kept in memory, starting when the watcher is created, remembers the files handled,
+    so a rescan after the kernel dropped events doesn't relocate them again.
+    """
+
+    def __init__(self, source_dir, ingester, settle_seconds=default_watch_settle_seconds,
+                 batch_size=default_watch_batch_size, high_water_mark=None):
+        """
+
+        :param source_dir: the folder to watch.
+        :param ingester: the Ingester relocating the files.
+        :param settle_seconds: see Debouncer.
+        :param batch_size: max number of files handed to the ingester at a time.
+        :param high_water_mark: a HighWaterMark recording the files handled, or None.
+        """
+        self.source_dir = source_dir
+        self.ingester = ingester
+        self.batch_size = batch_size
+        self.debouncer = Debouncer(settle_seconds)
+        self.reconciles = high_water_mark is not None
+        self.high_water_mark = high_water_mark or HighWaterMark(mark=time.time_ns())
+
+    def add(self, filename, st=None):
+        """
+        Queues filename to be relocated, if it's a photo or a movie.
+
+        :param st: the stat_result of filename, if already known.
+        """
+        if self.ingester.accepts(filename):
+            self.debouncer.add(filename)
+            try:
+                self.high_water_mark.add(filename, st or os.stat(filename))
+            except OSError:
+                pass
+
+    def done(self, filename):
+        """
+        Records filename as handled in the high-water mark.
+        """
+        self.high_water_mark.done(filename)
+        self.high_water_mark.save()
+
+    def reconcile(self):
+        """
+        Queues the files in the watched folder changed after the high-water mark, meaning the files that arrived while
+        the watcher was down. Only the stat of every file is needed for this.
+
+        :returns: the number of files queued.
+        """
+        if not self.reconciles:
+            return 0
+
+        count = self.rescan()
+        logger.debug("Found %s files that arrived in %s since the watcher last ran" % (count, self.source_dir))
+        return count
+
+    def rescan(self):
+        """
+        Queues the files in the watched folder not handled according to the high-water mark.
+
+        :returns: the number of files queued.
+        """
+        count = 0
+        for filename, st in walk(self.source_dir, with_stat=True):
+            if self.high_water_mark.is_new(st) and self.ingester.accepts(filename):
+                self.add(filename, st)
+                count += 1
+
+        return count
+
+    def add_folder(self, folder):
+        """
+        Queues every photo and movie in folder, like folders moved into the watched folder in one go.
+        """
+        for filename in dirwalk(folder):
+            self.add(filename)
+
+    def __call__(self, event):
+        event_mask = getattr(event, 'mask', 0)
+        if event_mask & overflow_mask:
+            logger.warning("Events were lost, scanning %s" % self.source_dir)
+            self.rescan()
+        elif event.dir:
+            self.add_folder(event.pathname)
+        elif not event_mask & create_mask:
+            self.add(event.pathname)
+
+    def process_ready(self):
+        """
+        Relocates the next batch of settled files.
+
+        :returns: the number of files handed to the ingester.
+        """
+        batch = self.debouncer.ready(self.batch_size)
+        if batch:
+            logger.debug("Relocating %s files, %s pending" % (len(batch), len(self.debouncer)))
+            self.ingester.process(batch)
+            for filename in batch:
+                self.done(filename)
+
+        return len(batch)
+
+    def run(self):
+        """
+        Watches the folder until interrupted.
+        """
+        if not PYINOTIFY_SUPPORT:
+            raise ValueError("pyinotify must be installed to watch %s." % self.source_dir)
+
+        wm = pyinotify.WatchManager()
+        notifier = pyinotify.Notifier(wm, default_proc_fun=self)
+        wm.add_watch(self.source_dir, mask, rec=True, auto_add=True)
+        logger.debug("Watching %s" % self.source_dir)
+        self.reconcile()
+        try:
+            while True:
+                timeout = self.debouncer.next_timeout()
+                if notifier.check_events(timeout is not None and int(timeout * 1000) + 1 or None):
+                    notifier.read_events()
+                    notifier.process_events()
+
+                while self.process_ready():
+                    pass
+        finally:
+            notifier.stop()
+            self.high_water_mark.save(force=True)
+
+
+class WatcherStatistics:
+    """
+    Keeps track of the depth of the queues of an AsyncFolderWatcher and the latency from the first event for a file to
+    its placement in the target folder, so they can be reported in the performance log.
+    """
+
+    def __init__(self):
+        self.placed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.queue_depths = {}
+        self.max_queue_depths = {}
+
+    def add_latency(self, latency):
+        """
+        Records a file placed latency seconds after its first event.
+        """
+        self.placed += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def sample_queue_depth(self, name, depth):
+        """
+        Records the current depth of the queue called name.
+        """
+        self.queue_depths[name] = depth
+        self.max_queue_depths[name] = max(self.max_queue_depths.get(name, 0), depth)
+
+    def __str__(self):
+        return "%s files placed, latency %.2fs on average, %.2fs max. Queue depth %s" % (
+            self.placed, self.placed and self.total_latency / self.placed or 0.0, self.max_latency,
+            ', '.join('%s %s (max %s)' % (name, depth, self.max_queue_depths[name])
+                      for name, depth in sorted(self.queue_depths.items())))
+
+    def log(self):
+        """
+        Logs the statistics to the performance log, if enabled.
+        """
+        if PerformanceLogger.enabled:
+            logging.getLogger("PerformanceLogger").debug(str(self))
+
+
+class AsyncFolderWatcher(FolderWatcher):
+    """
+    Watches a folder like FolderWatcher, handling inotify events in an asyncio event loop, so reading events never
+    waits for files being relocated.
+
+    Settled files flow through two bounded queues: the first is consumed by metadata_jobs tasks reading the dates of
+    photos in a pool of processes, the second by tasks relocating the files in the pool of threads of the ingester.
+    When relocating falls behind the queues fill up, settled files stay in the debouncer and once more than
+    max_pending files are pending, no more events are read until half of them are handled. Events the kernel drops in
+    the meantime are recovered by scanning the watched folder, see FolderWatcher.
+    """
+
+    def __init__(self, source_dir, ingester, settle_seconds=default_watch_settle_seconds,
+                 queue_size=default_watch_queue_size, metadata_jobs=None, max_pending=default_watch_max_pending,
+                 report_seconds=default_watch_report_seconds, high_water_mark=None,
+                 batch_size=default_watch_batch_size):
+        """
+
+        :param source_dir: the folder to watch.
+        :param ingester: the Ingester relocating the files. The size of its pool of threads decides the number of
+            files relocated at the same time.
+        :param settle_seconds: see Debouncer.
+        :param queue_size: max number of files in each queue.
+        :param metadata_jobs: number of processes reading metadata, None or 1 to read metadata in a thread.
+        :param max_pending: max number of files waiting to settle or for room in the queues before reading events is
+            paused.
+        :param report_seconds: number of seconds between every report of the statistics to the performance log.
+        :param high_water_mark: see FolderWatcher.
+        :param batch_size: max number of settled files taken from the debouncer at a time.
+        """
+        FolderWatcher.__init__(self, source_dir, ingester, settle_seconds, batch_size=batch_size,
+                               high_water_mark=high_water_mark)
+        self.queue_size = queue_size
+        self.metadata_jobs = metadata_jobs or 1
+        self.max_pending = max_pending
+        self.report_seconds = report_seconds
+        self.statistics = WatcherStatistics()
+        # created by process, as an Event created outside the running loop is bound to another loop before Python 3.10
+        self.wakeup = None
+        self.watch_manager = None
+        self.notifier = None
+        self.paused = False
+
+    def add(self, filename, st=None):
+        FolderWatcher.add(self, filename, st)
+        if self.wakeup:
+            self.wakeup.set()
+        self._throttle()
+
+    def _throttle(self):
+        """
+        Pauses reading events when too many files are pending and resumes when half of them are handled.
+        """
+        if not self.notifier:
+            return
+
+        loop = asyncio.get_running_loop()
+        pending = len(self.debouncer)
+        if not self.paused and pending >= self.max_pending:
+            logger.debug("%s files pending, pausing reading events" % pending)
+            loop.remove_reader(self.watch_manager.get_fd())
+            self.paused = True
+        elif self.paused and pending < self.max_pending // 2:
+            logger.debug("%s files pending, resuming reading events" % pending)
+            loop.add_reader(self.watch_manager.get_fd(), self.notifier.handle_read)
+            self.paused = False
+
+    async def _settle(self, settled, until_idle):
+        while True:
+            batch = self.debouncer.settled(self.batch_size)
+            for item in batch:
+                await settled.put(item)
+                self.statistics.sample_queue_depth('metadata', settled.qsize())
+            self._throttle()
+            if batch:
+                continue
+
+            if until_idle and not len(self.debouncer):
+                return
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.debouncer.next_timeout())
+            except asyncio.TimeoutError:
+                pass
+
+    async def _read_dates(self, settled, placements, pool):
+        loop = asyncio.get_running_loop()
+        while True:
+            filename, arrival = await settled.get()
+            file_date = None
+            if self.ingester.is_photo(filename):
+                try:
+                    file_date = await loop.run_in_executor(pool, get_date_from_file, filename,
+                                                           self.ingester.metadata_backend)
+                except Exception as ex:
+                    logger.warning("Error reading the date of %s: %s" % (filename, ex))
+
+            await placements.put((filename, arrival, file_date))
+            self.statistics.sample_queue_depth('placement', placements.qsize())
+            settled.task_done()
+
+    async def _place(self, placements):
+        loop = asyncio.get_running_loop()
+        while True:
+            filename, arrival, file_date = await placements.get()
+            try:
+                await loop.run_in_executor(self.ingester.pool, self.ingester.place, filename, file_date)
+                self.statistics.add_latency(self.debouncer.clock() - arrival)
+                self.done(filename)
+            finally:
+                placements.task_done()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_seconds)
+            self.statistics.log()
+
+    async def process(self, until_idle=False):
+        """
+        Relocates settled files as they come, until cancelled.
+
+        :param until_idle: boolean value indicating if we return once all pending files are relocated instead.
+        """
+        self.wakeup = asyncio.Event()
+        settled = asyncio.Queue(self.queue_size)
+        placements = asyncio.Queue(self.queue_size)
+        pool = self.metadata_jobs > 1 and ProcessPoolExecutor(self.metadata_jobs) or ThreadPoolExecutor(1)
+        workers = [asyncio.ensure_future(self._read_dates(settled, placements, pool))
+                   for counter in range(self.metadata_jobs)]
+        workers.extend(asyncio.ensure_future(self._place(placements))
+                       for counter in range(self.ingester.jobs))
+        workers.append(asyncio.ensure_future(self._report()))
+        try:
+            await self._settle(settled, until_idle)
+            await settled.join()
+            await placements.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            pool.shutdown()
+            self.statistics.log()
+            self.high_water_mark.save(force=True)
+
+    async def watch(self):
+        """
+        Watches the folder until cancelled.
+        """
+        if not PYINOTIFY_SUPPORT:
+            raise ValueError("pyinotify must be installed to watch %s." % self.source_dir)
+
+        self.watch_manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.AsyncioNotifier(self.watch_manager, asyncio.get_running_loop(),
+                                                  default_proc_fun=self)
+        self.watch_manager.add_watch(self.source_dir, mask, rec=True, auto_add=True)
+        logger.debug("Watching %s" % self.source_dir)
+        try:
+            self.reconcile()
+            await self.process()
+        finally:
+            self.notifier.stop()
+            self.notifier = None
 
-    def process_IN_DELETE(self, event):
+    def run(self):
         """
-        Handles deletion of files.
+        Watches the folder until interrupted.
         """
-        print "Removing:", event.pathname
+        asyncio.run(self.watch())
 
 
-def run():
+def run(source_dir, target_dir, settle_seconds=default_watch_settle_seconds, queue_size=default_watch_queue_size,
+        metadata_jobs=None, max_pending=default_watch_max_pending, state_filename=None,
+        batch_size=default_watch_batch_size, **options):
     """
+    Watches source_dir and relocates every photo and movie arriving in it into a date-based hierarchy in target_dir,
+    until interrupted. See AsyncFolderWatcher.
 
+    :param source_dir: the folder to watch.
+    :param target_dir: the folder to build the date-based hierarchy in.
+    :param settle_seconds: see Debouncer.
+    :param queue_size: see AsyncFolderWatcher.
+    :param metadata_jobs: see AsyncFolderWatcher.
+    :param max_pending: see AsyncFolderWatcher.
+    :param state_filename: the file holding the HighWaterMark of the watcher, used to find the files that arrived
+        while it was down. None to not look for them.
+    :param batch_size: see AsyncFolderWatcher.
+    :param options: keyword arguments for Ingester.
     """
-    handler = EventHandler()
-    notifier = pyinotify.Notifier(wm, handler)
-    wdd = wm.add_watch('/tmp', mask, rec=True)
-    notifier.loop()
\ No newline at end of file
+    high_water_mark = state_filename and HighWaterMark(state_filename) or None
+    with Ingester(source_dir, target_dir, **options) as ingester:
+        AsyncFolderWatcher(source_dir, ingester, settle_seconds, queue_size, metadata_jobs, max_pending,
+                           high_water_mark=high_water_mark, batch_size=batch_size).run()
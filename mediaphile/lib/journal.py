@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from mediaphile.cli import default_journal_sync_interval, default_journal_sync_seconds
+
+logger = logging.getLogger("verbose")
+
+
+class Journal:
+    """
+    An append-only journal of completed operations, like relocating or comparing a file, used to resume a long run
+    that was interrupted or crashed without doing the completed work again.
+
+    Every operation is written as a line of JSON when it's completed. The journal is flushed and synced to disk in
+    batches, every sync_interval operations or sync_seconds seconds, whatever comes first, so at most the last batch is
+    lost in a crash. Those operations are simply done again when resuming, which is harmless for moves as their source
+    no longer exists. A line only partially written when the process died is ignored.
+
+    Usage:
+
+        with Journal(filename, resume=True) as journal:
+            for filename in filenames:
+                if not journal.is_completed('relocate', filename):
+                    ...
+                    journal.record('relocate', filename, new_filename, st)
+    """
+
+    def __init__(self, filename, resume=False, sync_interval=default_journal_sync_interval,
+                 sync_seconds=default_journal_sync_seconds):
+        """
+
+        :param filename: the journal file. Created if it doesn't exist.
+        :param resume: boolean value indicating if the operations in an existing journal are read, to be skipped, or
+            the journal is started over.
+        :param sync_interval: max number of operations recorded between every sync to disk.
+        :param sync_seconds: max number of seconds between every sync to disk.
+        """
+        self.filename = filename
+        self.sync_interval = sync_interval
+        self.sync_seconds = sync_seconds
+        self.completed = {}
+        self.lock = threading.Lock()
+        if resume and os.path.exists(filename):
+            self._read()
+            logger.debug("Resuming from %s, %s operations already completed" % (filename, len(self.completed)))
+
+        self.file = open(filename, resume and 'a' or 'w', encoding='utf-8')
+        self.pending = 0
+        self.last_sync = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _read(self):
+        with open(self.filename, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Ignoring incomplete entry in %s" % self.filename)
+                    continue
+
+                self.completed[(record['operation'], record['source'])] = record
+
+    def is_completed(self, operation, source, st=None):
+        """
+        Returns the record of operation on source if completed by this or an earlier run.
+
+        :param operation: the name of the operation.
+        :param source: the file the operation was done on.
+        :param st: the current stat_result of source, if it still exists. If provided the operation is only considered
+            completed if source is unchanged since it was recorded.
+        :returns: a dictionary with operation, source, target, size and mtime_ns, or None.
+        """
+        record = self.completed.get((operation, source))
+        if record and st and (record.get('size') != st.st_size or
+                              record.get('mtime_ns') not in (None, st.st_mtime_ns)):
+            return None
+
+        return record
+
+    def record(self, operation, source, target=None, st=None, size=None):
+        """
+        Records operation on source as completed. Safe to call from several threads.
+
+        :param operation: the name of the operation.
+        :param source: the file the operation was done on.
+        :param target: the file created by the operation, or any other file it relates source to, if any.
+        :param st: the stat_result of source before the operation.
+        :param size: the size of source, if st isn't known.
+        """
+        record = dict(operation=operation, source=source, target=target,
+                      size=st.st_size if st else size, mtime_ns=st.st_mtime_ns if st else None)
+        with self.lock:
+            self.completed[(operation, source)] = record
+            self.file.write(json.dumps(record) + '\n')
+            self.pending += 1
+            if self.pending >= self.sync_interval or time.time() - self.last_sync >= self.sync_seconds:
+                self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_sync = time.time()
+
+    def sync(self):
+        """
+        Writes all recorded operations to disk.
+        """
+        with self.lock:
+            if self.pending:
+                self._sync()
+
+    def close(self):
+        """
+        Writes all recorded operations to disk and closes the journal.
+        """
+        if self.file:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def discard(self):
+        """
+        Closes and removes the journal, when the run it belongs to is completed.
+        """
+        self.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def skip_completed(files, journal, operation):
+    """
+    Removes the files operation was completed on, according to journal, from files as returned by get_files_in_folder.
+
+    :param files: a dictionary with folders as keys and lists of filenames as values.
+    :param journal: a Journal, or None to keep all files.
+    :param operation: the name of the operation.
+    :returns: a dictionary like files, without folders where all files are completed.
+    """
+    if not journal:
+        return files
+
+    result = {}
+    skipped = 0
+    for folder, filenames in files.items():
+        remaining = []
+        for filename in filenames:
+            complete_filename = os.path.join(folder, filename)
+            if journal.is_completed(operation, complete_filename, os.stat(complete_filename)):
+                skipped += 1
+            else:
+                remaining.append(filename)
+        if remaining:
+            result[folder] = remaining
+
+    logger.debug("Skipping %s files completed by an earlier run" % skipped)
+    return result
@@ -3,10 +3,25 @@ import os
 import time
 import datetime
 import re
+import threading
+from collections import OrderedDict
 import exifread
+from mediaphile.cli import default_metadata_header_size, default_metadata_backend, default_exiftool_extensions, \
+    default_metadata_cache_size
+from mediaphile.lib.exiftool import EXIFTOOL_SUPPORT, get_exiftool
 from mediaphile.lib.file_operations import creation_date
 from mediaphile.lib import months
 
+# the last tag needed by get_parsed_metadata. Make, model and GPS are found in IFD0 and DateTimeDigitized early in the
+# EXIF IFD, so exifread can skip the remaining EXIF tags, including the maker notes.
+fast_metadata_stop_tag = 'DateTimeDigitized'
+
+# exifread reads every file, exiftool every file and auto uses exiftool for default_exiftool_extensions if installed
+metadata_backends = ('exifread', 'exiftool', 'auto')
+
+# how much metadata a call to get_metadata reads; a cached result can be used for any request of the same or lower level
+METADATA_FAST, METADATA_DEFAULT, METADATA_DETAILS = range(3)
+
 
 # Credits http://eran.sandler.co.il/2011/05/20/extract-gps-latitude-and-longitude-data-from-exif-using-python-imaging-library-pil/
 def _frac_to_simple(frac):
@@ -131,33 +146,239 @@ def extract_gps_info(data):
     return my_lon, my_lat, altitude
 
 
-def get_metadata(filename, details=False):
+class HeaderFile(object):
+    """
+    A read-only file object serving reads from the first header_size bytes of a file, read once. Reads outside the
+    header are passed on to the underlying file, so parsing never fails because the metadata is located further into
+    the file than expected.
     """
 
-    :param filename:
-    :return:
+    def __init__(self, f, header_size=default_metadata_header_size):
+        """
+
+        :param f: a file opened in binary mode.
+        :param header_size: number of bytes to read up front.
+        """
+        self.f = f
+        self.header = f.read(header_size)
+        self.position = 0
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += os.fstat(self.f.fileno()).st_size
+        self.position = offset
+        return offset
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if 0 <= size and self.position + size <= len(self.header):
+            data = self.header[self.position:self.position + size]
+        else:
+            self.f.seek(self.position)
+            data = self.f.read(size)
+        self.position += len(data)
+        return data
+
+
+def _add_exif_date(result):
+    """
+    Adds 'EXIF Date' to result, parsed from 'EXIF DateTimeDigitized' if found and valid.
+    """
+    if 'EXIF DateTimeDigitized' in result:
+        try:
+            result['EXIF Date'] = datetime.datetime.fromtimestamp(
+                time.mktime(time.strptime(str(result['EXIF DateTimeDigitized'])[:19], "%Y:%m:%d %H:%M:%S")))
+        except (ValueError, OverflowError):
+            pass
+
+    return result
+
+
+def _use_exiftool(filename, backend):
+    """
+    Returns True if the metadata of filename should be read by exiftool using backend.
+    """
+    if backend == 'auto':
+        return EXIFTOOL_SUPPORT and os.path.splitext(filename)[-1][1:].lower() in default_exiftool_extensions
+
+    return backend == 'exiftool'
+
+
+class MetadataCache(object):
+    """
+    A bounded LRU cache of the metadata read by get_metadata, so the EXIF data of a file is parsed once per process no
+    matter how many times it's asked for. Entries are keyed by path, size and modification time, so a changed file is
+    always read again.
+    """
+
+    def __init__(self, max_entries=default_metadata_cache_size):
+        """
+
+        :param max_entries: max number of files to keep metadata for. The least recently used entries are evicted first.
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def key(filename):
+        """
+        Returns the cache key of filename; its absolute path, size and modification time.
+        """
+        st = os.stat(filename)
+        return os.path.abspath(filename), st.st_size, st.st_mtime_ns
+
+    def get(self, key, level=METADATA_DEFAULT):
+        """
+        Returns a copy of the cached metadata for key, or None if not cached, the file has changed or the cached
+        metadata was read using a lower level than level.
+        """
+        with self.lock:
+            entry = self.entries.get(key[0])
+            if entry and entry[0] == key[1:] and entry[1] >= level:
+                self.entries.move_to_end(key[0])
+                self.hits += 1
+                return dict(entry[2])
+
+            self.misses += 1
+            return None
+
+    def put(self, key, level, metadata):
+        """
+        Stores metadata read from the file identified by key using level, replacing any previous entry for the file.
+        """
+        with self.lock:
+            self.entries[key[0]] = (key[1:], level, metadata)
+            self.entries.move_to_end(key[0])
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Removes all entries and resets the counters.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of hits, misses, evictions and entries, and the hit rate in percent.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, entries=len(self.entries),
+                        hit_rate=lookups and 100.0 * self.hits / lookups or 0.0)
+
+    def __str__(self):
+        return "%(hits)s hits, %(misses)s misses (%(hit_rate).1f%% hit rate), %(entries)s entries, " \
+               "%(evictions)s evictions" % self.stats()
+
+
+# shared by all callers of get_metadata in this process
+metadata_cache = MetadataCache()
+
+
+def _read_metadata(filename, details=False, fast=False):
+    """
+    Reads the EXIF metadata of filename using exifread, see get_metadata.
     """
     path, filename = os.path.split(filename)
     path = os.path.abspath(path)
     filename, ext = os.path.splitext(filename)
     complete_filename = os.path.join(path, filename+ext)
 
-    f = open(complete_filename, 'rb')
-    tags = exifread.process_file(f, details=details)
+    with open(complete_filename, 'rb') as f:
+        if fast:
+            tags = exifread.process_file(HeaderFile(f), stop_tag=fast_metadata_stop_tag, details=False,
+                                         extract_thumbnail=False)
+        else:
+            tags = exifread.process_file(f, details=details)
     result = {'CreationDate': creation_date(complete_filename)}
 
     if not tags:
         return result
 
     for tag in tags.keys():
-        print("%s=%s" %(tag, tags[tag]))
-
         if tag not in ('JPEGThumbnail', 'TIFFThumbnail', 'Filename', 'EXIF MakerNote'):
             result[tag] = tags[tag]
 
-    if 'EXIF DateTimeDigitized' in result:
-        result['EXIF Date'] = datetime.datetime.fromtimestamp(
-            time.mktime(time.strptime(str(result['EXIF DateTimeDigitized']), "%Y:%m:%d %H:%M:%S")))
+    return _add_exif_date(result)
+
+
+def get_metadata(filename, details=False, fast=False, backend=default_metadata_backend, use_cache=True):
+    """
+    Reads the EXIF metadata of filename.
+
+    :param filename: the file to process.
+    :param details: boolean value indicating if we process the maker notes too. Ignored when fast is True.
+    :param fast: boolean value indicating if we only read the tags needed by get_parsed_metadata; date, make, model and
+        GPS information. Parsing stops once these are found, thumbnails are skipped and only the header of the file is
+        read, unless the metadata is located further into the file.
+    :param backend: the metadata backend to use, one of metadata_backends. The exiftool backend only reads the tags
+        needed by get_parsed_metadata.
+    :param use_cache: boolean value indicating if we look up and store the metadata in metadata_cache.
+    :return: a dictionary with the tags found and 'CreationDate', and 'EXIF Date' if the file has a DateTimeDigitized tag.
+    """
+    return get_metadata_many([filename], details, fast, backend, use_cache)[filename]
+
+
+def get_metadata_many(filenames, details=False, fast=False, backend=default_metadata_backend, use_cache=True):
+    """
+    Reads the EXIF metadata of several files. Files handled by exiftool are sent to a single exiftool process in
+    batches, so it is started once per run instead of once per file.
+
+    :param filenames: the files to process.
+    :param details: see get_metadata.
+    :param fast: see get_metadata.
+    :param backend: the metadata backend to use, one of metadata_backends.
+    :param use_cache: see get_metadata.
+    :return: a dictionary with the filename as key and the dictionary returned by get_metadata as value.
+    """
+    if backend not in metadata_backends:
+        raise ValueError("Unknown metadata backend %s, use one of %s." % (backend, ', '.join(metadata_backends)))
+
+    level = METADATA_DEFAULT
+    if fast:
+        level = METADATA_FAST
+    elif details:
+        level = METADATA_DETAILS
+
+    result = {}
+    keys = {}
+    for filename in filenames:
+        if use_cache:
+            keys[filename] = MetadataCache.key(filename)
+            cached = metadata_cache.get(keys[filename], level)
+            if cached is not None:
+                result[filename] = cached
+                continue
+
+        result[filename] = None
+
+    missing = [filename for filename, metadata in result.items() if metadata is None]
+    exiftool_filenames = [filename for filename in missing if _use_exiftool(filename, backend)]
+    tags = exiftool_filenames and get_exiftool().get_tags(exiftool_filenames) or {}
+
+    for filename in missing:
+        if filename in tags:
+            # exiftool reads the same tags whatever level is asked for
+            metadata = _add_exif_date(dict(tags[filename], CreationDate=creation_date(filename)))
+            metadata_level = METADATA_DETAILS
+        else:
+            # files exiftool couldn't read are given to exifread
+            metadata = _read_metadata(filename, details, fast)
+            metadata_level = level
+
+        if use_cache:
+            metadata_cache.put(keys[filename], metadata_level, metadata)
+        result[filename] = dict(metadata)
 
     return result
     #     result['exposure_time'] = _frac_to_simple(metadata.get("ExposureTime", metadata.get('ShutterSpeedValue', 0)))
@@ -165,14 +386,16 @@ def get_metadata(filename, details=False):
     #     result['focal_length'] = _frac_to_simple(metadata.get("FocalLength", -1.0))
 
 
-def get_parsed_metadata(filename, params=None):
+def get_parsed_metadata(filename, params=None, backend=default_metadata_backend):
     """
 
     :param filename:
+    :param params: the dictionary returned by get_metadata, read from filename if None.
+    :param backend: the metadata backend to use if params is None, see get_metadata.
     :return:
     """
     if not params:
-        params = get_metadata(filename, True)
+        params = get_metadata(filename, fast=True, backend=backend)
 
     dt = params.get('EXIF Date', params.get('CreationDate'))
     if not dt:
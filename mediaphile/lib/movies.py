@@ -1,13 +1,13 @@
 import os
-import shutil
 from datetime import datetime
 from mediaphile.lib.file_operations import remove_source_folders, get_files_in_folder, \
     generate_valid_target, generate_folders_from_date, generate_filename_from_date, \
-    get_tag_from_filename
+    get_tag_from_filename, TargetNameRegistry, DirectoryCache, TransferStatistics, transfer_file
+from mediaphile.lib.journal import skip_completed
 
 
 def relocate_movies(source_dir, target_dir=None, append_timestamp=True, remove_source=True, tag=None,
-                    movie_extensions_to_include=None):
+                    movie_extensions_to_include=None, journal=None):
     """
     Relocates movies into a date-based hierarchy based on the creation date of the files.
 
@@ -16,26 +16,40 @@ def relocate_movies(source_dir, target_dir=None, append_timestamp=True, remove_s
     :param append_timestamp: boolean value indicating if we add a timestamp to the filenames.
     :param remove_source: boolean value indicating if we remove the source files from the source dir on success.
     :param tag: single string to use instead of the day-part in the date-based folder structure.
+    :param journal: a Journal every relocated movie is recorded in. Movies recorded as relocated by an earlier run are
+        skipped.
     """
     if not target_dir:
         target_dir = source_dir
 
     movies = get_files_in_folder(source_dir, movie_extensions_to_include)
+    source_folders = list(movies.keys())
+    movies = skip_completed(movies, journal, 'relocate')
+    registry = TargetNameRegistry()
+    directories = DirectoryCache()
+    statistics = TransferStatistics()
     for path, filenames in movies.items():
         current_tag = tag
         for filename in filenames:
             complete_filename = os.path.join(path, filename)
             if not current_tag:
                 current_tag = get_tag_from_filename(complete_filename, source_dir)
-            relocate_movie(complete_filename, target_dir=target_dir, append_timestamp=append_timestamp,
-                           remove_source=remove_source, tag=current_tag)
+            st = journal and os.stat(complete_filename)
+            new_filename = relocate_movie(complete_filename, target_dir=target_dir, append_timestamp=append_timestamp,
+                                          remove_source=remove_source, tag=current_tag, registry=registry,
+                                          directories=directories, statistics=statistics)
+            if journal:
+                journal.record('relocate', complete_filename, new_filename, st)
 
     if remove_source:
-        remove_source_folders(movies.keys())
+        remove_source_folders(source_folders)
+
+    statistics.log()
 
 
 def relocate_movie(filename, target_dir, append_timestamp=True, remove_source=True, tag=None, skip_existing=False,
-                   path_prefix=None):
+                   path_prefix=None, registry=None, directories=None,
+                   statistics=None):
     """
     Will create (or move into if remove_source is set to True) a photo a date-hierarchy based on the EXIF-date found in
     the photo metadata.
@@ -47,6 +61,10 @@ def relocate_movie(filename, target_dir, append_timestamp=True, remove_source=Tr
     :param tag: single word text string to use instead of the day-part of the folder structure, to group photos by tag.
     :param skip_existing: boolean value indicating if the processing should exit if target file is already present.
     :param path_prefix: string to prepend the generated date-based hierarchy folder structure.
+    :param registry: a TargetNameRegistry shared by all movies relocated in a run, see generate_valid_target.
+    :param directories: a DirectoryCache shared by all movies relocated in a run, so every target folder is only
+        created or checked once.
+    :param statistics: a TransferStatistics to record the move or copy in, see transfer_file.
     """
     st = os.stat(filename)
     dt = st.st_ctime < st.st_mtime and datetime.fromtimestamp(st.st_ctime) or datetime.fromtimestamp(st.st_mtime)
@@ -55,21 +73,20 @@ def relocate_movie(filename, target_dir, append_timestamp=True, remove_source=Tr
         target_dir = os.path.join(target_dir, path_prefix, generate_folders_from_date(dt, tag))
     else:
         target_dir = os.path.join(target_dir, generate_folders_from_date(dt, tag))
-    if not os.path.exists(target_dir):
+    if directories:
+        directories.makedirs(target_dir)
+    elif not os.path.exists(target_dir):
         os.makedirs(target_dir)
 
     new_filename = os.path.join(target_dir,
                                 append_timestamp and generate_filename_from_date(filename, dt) or os.path.basename(
                                     filename))
-    new_filename = generate_valid_target(new_filename)
+    new_filename = generate_valid_target(new_filename, registry=registry)
 
     if skip_existing and os.path.exists(new_filename):
         return
 
-    if remove_source:
-        shutil.move(filename, new_filename)
-    else:
-        shutil.copy(filename, new_filename)
+    transfer_file(filename, new_filename, remove_source, statistics)
 
     return new_filename
 
@@ -2,40 +2,49 @@
 import types
 import os
 import logging
-import shutil
 import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.getLogger("verbose")
 
 try:
     from PIL import Image
-    from PIL.ExifTags import TAGS
     PILLOW_SUPPORT = True
 except ImportError:
     PILLOW_SUPPORT = False
 
 from mediaphile.cli import default_timestamp_format, default_duplicate_filename_format, default_new_filename_format, \
-    default_use_checksum_existence_check
+    default_use_checksum_existence_check, default_metadata_backend, default_relocation_batch_size
 from mediaphile.lib.file_operations import dirwalk, get_files_in_folder, remove_source_folders, \
-    generate_folders_from_date, generate_filename_from_date, get_tag_from_filename, generate_valid_target
-from mediaphile.lib.metadata import get_metadata, get_parsed_metadata
+    generate_folders_from_date, generate_filename_from_date, get_tag_from_filename, generate_valid_target, get_checksum, \
+    TargetNameRegistry, DirectoryCache, TransferStatistics, transfer_file
+from mediaphile.lib.metadata import get_metadata, get_metadata_many, get_parsed_metadata, metadata_cache
+from mediaphile.lib.plan import create_plan_entry, write_plan, execute_plan
+from mediaphile.lib.journal import skip_completed
+from mediaphile.lib.thumbnails import get_thumbnail_filename, generate_thumbnails, create_thumbnails, open_image, \
+    save_thumbnail
 
 
-def get_date_from_file(filename):
+def _get_date_from_stat(filename):
+    """
+    Returns the latest of the creation and modification date of filename.
+    """
+    st = os.stat(filename)
+    return datetime.datetime.fromtimestamp(st.st_ctime > st.st_mtime and st.st_ctime or st.st_mtime)
+
+
+def get_date_from_file(filename, backend=default_metadata_backend):
     """
     Get the creation date from the specified filename, either from the EXIF-metadata or the creation-date of the file
     it EXIF-data is not available.
 
     @param filename: the file to process
+    @param backend: the metadata backend to use, see get_metadata.
     @returns: datetime
     """
-
-    def _get_date_from_stat(fname):
-        st = os.stat(fname)
-        return datetime.datetime.fromtimestamp(st.st_ctime > st.st_mtime and st.st_ctime or st.st_mtime)
-
     try:
-        dt = get_metadata(filename).get('EXIF Date', None)
+        dt = get_metadata(filename, fast=True, backend=backend).get('EXIF Date', None)
         if not dt:
             return _get_date_from_stat(filename)
 
@@ -45,6 +54,24 @@ def get_date_from_file(filename):
         return _get_date_from_stat(filename)
 
 
+def get_dates_from_files(filenames, backend=default_metadata_backend):
+    """
+    Get the creation date of several files like get_date_from_file, reading the metadata of all files in one go.
+
+    @param filenames: the files to process
+    @param backend: the metadata backend to use, see get_metadata_many.
+    @returns: a dictionary with the filename as key and datetime as value.
+    """
+    try:
+        metadata = get_metadata_many(filenames, fast=True, backend=backend)
+    except KeyError as ex:
+        logger.warning("'get_metadata_many' threw an exception, reading files one by one: %s" % ex)
+        return dict((filename, get_date_from_file(filename, backend)) for filename in filenames)
+
+    return dict((filename, metadata[filename].get('EXIF Date', None) or _get_date_from_stat(filename))
+                for filename in filenames)
+
+
 def get_photos_in_folder(folder, photo_extensions_to_include=None):
     """
 
@@ -57,14 +84,30 @@ def relocate_photos(source_dir, target_dir=None, append_timestamp=True, remove_s
                     photo_extensions_to_include=None, timestamp_format=default_timestamp_format,
                     duplicate_filename_format=default_duplicate_filename_format,
                     new_filename_format=default_new_filename_format, path_prefix=None, skip_existing=False,
-                    auto_tag=False):
+                    auto_tag=False, workers=None, file_index=None, metadata_backend=default_metadata_backend,
+                    jobs=None, plan_filename=None, checksum_algorithm=None, journal=None):
     """
     Relocates all photos from the source folder into a date-based hierarchy in the target folder.
 
+    Relocation is done in two phases; planning, where the metadata is read and the target filename of every photo is
+    decided, see plan_photos, and execution, where photos are moved or copied, see execute_plan. The plan can be written
+    to a file instead of executed, to be reviewed and applied later using apply_plan.
+
+    :param workers: number of threads scanning the source folder, None or 1 for a serial scan.
+    :param file_index: a FileIndex to look up dates and checksums in, or None to read them from the photos.
+    :param metadata_backend: the metadata backend used to read dates from the photos, see get_metadata. The metadata of
+        every folder is read in one go.
+    :param jobs: if more than one, photos are relocated by a pipeline where a pool of jobs processes reads the metadata
+        and a pool of jobs threads moves or copies the files.
+    :param plan_filename: if provided the plan is written to this file, see write_plan, and no photos are relocated.
+    :param checksum_algorithm: hash algorithm used to add a digest of every photo to the plan written to plan_filename,
+        verified when the plan is applied. If None only the size is verified.
+    :param journal: a Journal every relocated photo is recorded in. Photos recorded as relocated by an earlier run are
+        skipped, without reading their metadata.
     :param auto_tag:
     :param skip_existing:
     :param path_prefix:
-    :param dry_run:
+    :param dry_run: boolean value indicating if we only log what would have been done.
     :param photo_extensions_to_include:
     :param timestamp_format:
     :param duplicate_filename_format:
@@ -78,88 +121,261 @@ def relocate_photos(source_dir, target_dir=None, append_timestamp=True, remove_s
     if not target_dir:
         target_dir = source_dir
 
-    photos = get_files_in_folder(source_dir, photo_extensions_to_include)
+    photos = get_files_in_folder(source_dir, photo_extensions_to_include, workers=workers)
+    source_folders = list(photos.keys())
+    photos = skip_completed(photos, journal, 'relocate')
+    directories = not dry_run and not plan_filename and DirectoryCache() or None
+    entries = plan_photos(
+        photos,
+        source_dir,
+        tag=tag,
+        auto_tag=auto_tag,
+        jobs=jobs,
+        metadata_backend=metadata_backend,
+        checksum_algorithm=plan_filename and checksum_algorithm or None,
+        directories=directories,
+        target_dir=target_dir,
+        append_timestamp=append_timestamp,
+        skip_existing=skip_existing,
+        path_prefix=path_prefix,
+        timestamp_format=timestamp_format,
+        duplicate_filename_format=duplicate_filename_format,
+        new_filename_format=new_filename_format,
+        file_index=file_index)
+
+    if plan_filename:
+        count = write_plan(plan_filename, entries, remove_source, checksum_algorithm)
+        logger.debug("Wrote a plan relocating %s photos to %s" % (count, plan_filename))
+    elif dry_run:
+        for entry in entries:
+            logger.debug('%s %s to %s' % (remove_source and 'move' or 'copy', entry['source'], entry['target']))
+    else:
+        statistics = TransferStatistics()
+        done = journal and (lambda index, entry: journal.record('relocate', entry['source'], entry['target'],
+                                                                size=entry['size'])) or None
+        count = execute_plan(entries, remove_source, jobs, directories, statistics, done=done)
+        logger.debug("Relocated %s photos" % count)
+        if remove_source:
+            remove_source_folders(source_folders)
+        statistics.log()
+
+    logger.debug("Metadata cache: %s" % metadata_cache)
+
+
+def _get_batches(photos, source_dir, tag, auto_tag, batch_size):
+    """
+    Splits the photos found in each folder into batches of at most batch_size files.
+
+    :param photos: the dictionary returned by get_files_in_folder.
+    :param batch_size: max number of files in a batch, None to put all files in a folder in one batch.
+    :returns: a generator yielding tuples of the folder, the complete filenames and the tag to use.
+    """
     for path, filenames in photos.items():
+        complete_filenames = [os.path.join(path, filename) for filename in filenames]
         current_tag = tag
-        for filename in filenames:
-            complete_filename = os.path.join(path, filename)
-            if not current_tag and auto_tag:
-                current_tag = get_tag_from_filename(complete_filename, source_dir)
-
-            relocate_photo(
-                complete_filename,
-                target_dir=target_dir,
-                append_timestamp=append_timestamp,
-                remove_source=remove_source,
-                tag=current_tag,
-                skip_existing=skip_existing,
-                path_prefix=path_prefix,
-                dry_run=False,
-                timestamp_format=timestamp_format,
-                duplicate_filename_format=duplicate_filename_format,
-                new_filename_format=new_filename_format)
-
-    if not dry_run and remove_source:
-        remove_source_folders(photos.keys())
+        if not current_tag and auto_tag and complete_filenames:
+            current_tag = get_tag_from_filename(complete_filenames[0], source_dir)
 
+        size = batch_size or len(complete_filenames) or 1
+        for index in range(0, len(complete_filenames), size):
+            yield path, complete_filenames[index:index + size], current_tag
 
-def relocate_photo(filename, target_dir, file_date=None, append_timestamp=True, remove_source=True, tag=None,
-                   skip_existing=False, path_prefix=None, dry_run=False, timestamp_format=default_timestamp_format,
-                   duplicate_filename_format=default_duplicate_filename_format,
-                   new_filename_format=default_new_filename_format,
-                   use_checksum_existence_check=default_use_checksum_existence_check):
+
+def _get_dated_batches(photos, source_dir, tag, auto_tag, jobs=None, metadata_backend=default_metadata_backend,
+                       file_index=None, batch_size=default_relocation_batch_size):
     """
+    Reads the dates of photos in batches, see _get_batches. If jobs is more than one the dates are read by a pool of
+    processes, up to jobs * 2 batches ahead of the batch returned.
 
-    :param use_checksum_existence_check:
-    :param timestamp_format:
-    :param duplicate_filename_format:
-    :param new_filename_format:
-    :param dry_run:
-    :param filename:
-    :param target_dir:
-    :param file_date:
-    :param append_timestamp:
-    :param remove_source:
-    :param tag:
-    :param skip_existing:
-    :param path_prefix:
+    :returns: a generator yielding tuples of the complete filenames, a dictionary with the date of every photo and the
+        tag to use.
+    """
+    def get_dates(complete_filenames):
+        if file_index:
+            return dict((filename, file_index.get_date(filename)) for filename in complete_filenames)
+        return get_dates_from_files(complete_filenames, metadata_backend)
+
+    if not jobs or jobs < 2:
+        for path, complete_filenames, current_tag in _get_batches(photos, source_dir, tag, auto_tag, None):
+            yield complete_filenames, get_dates(complete_filenames), current_tag
+        return
+
+    batches = deque()
+    with ProcessPoolExecutor(jobs) as metadata_pool:
+        for path, complete_filenames, current_tag in _get_batches(photos, source_dir, tag, auto_tag, batch_size):
+            # dates are looked up in the file index by the calling thread, as it can't be shared between processes
+            future = not file_index and metadata_pool.submit(get_dates_from_files, complete_filenames,
+                                                             metadata_backend) or None
+            batches.append((complete_filenames, current_tag, future))
+            if len(batches) > jobs * 2:
+                complete_filenames, current_tag, future = batches.popleft()
+                yield complete_filenames, future and future.result() or get_dates(complete_filenames), current_tag
+
+        while batches:
+            complete_filenames, current_tag, future = batches.popleft()
+            yield complete_filenames, future and future.result() or get_dates(complete_filenames), current_tag
+
+
+def _plan_batch(complete_filenames, dates, tag, directories, **options):
+    """
+    Decides the target filenames of a batch of photos and creates the target folders needed by the batch up front.
+
+    :param complete_filenames: the photos to process.
+    :param dates: a dictionary with the date of every photo.
+    :param tag: see relocate_photo.
+    :param directories: the DirectoryCache of the run, None to not create any folders.
+    :param options: the keyword arguments for get_target_filename.
+    :returns: a list of (filename, new filename) tuples for the photos to move or copy.
+    """
+    targets = []
+    for complete_filename in complete_filenames:
+        new_filename = get_target_filename(complete_filename, file_date=dates.get(complete_filename), tag=tag,
+                                           **options)
+        if new_filename:
+            targets.append((complete_filename, new_filename))
+
+    if directories:
+        directories.makedirs_many(os.path.dirname(new_filename) for complete_filename, new_filename in targets)
+
+    return targets
+
+
+def plan_photos(photos, source_dir, tag=None, auto_tag=False, jobs=None, metadata_backend=default_metadata_backend,
+                batch_size=default_relocation_batch_size, checksum_algorithm=None, directories=None, **options):
+    """
+    Plans the relocation of photos, reading their dates and deciding their target filenames in the order the photos
+    were found. Target filenames are reserved in a TargetNameRegistry, so two photos never claim the same target
+    filename, even when the plan is executed by several threads.
+
+    If jobs is more than one the metadata is read by a pool of processes while the plan is consumed, so when the plan
+    is executed by execute_plan using a pool of threads, reading metadata, which is CPU bound, and moving or copying
+    files, which is I/O bound, happens at the same time. The number of batches read ahead is bounded, so memory use
+    doesn't grow with the number of photos.
+
+    :param photos: the dictionary returned by get_files_in_folder.
+    :param source_dir: the folder photos were found in, used to generate tags if auto_tag is True.
+    :param tag: see relocate_photos.
+    :param auto_tag: see relocate_photos.
+    :param jobs: number of processes reading metadata.
+    :param metadata_backend: see relocate_photos.
+    :param batch_size: max number of photos in every batch sent to the metadata processes.
+    :param checksum_algorithm: see create_plan_entry.
+    :param directories: the DirectoryCache of the run, target folders of every batch are created when the batch is
+        planned. None to not create any folders.
+    :param options: the keyword arguments for get_target_filename.
+    :returns: a generator yielding plan entries, see create_plan_entry.
+    """
+    options.setdefault('registry', TargetNameRegistry())
+    for complete_filenames, dates, current_tag in _get_dated_batches(
+            photos, source_dir, tag, auto_tag, jobs, metadata_backend, options.get('file_index'), batch_size):
+        for complete_filename, new_filename in _plan_batch(complete_filenames, dates, current_tag, directories,
+                                                           **options):
+            yield create_plan_entry(complete_filename, new_filename, dates.get(complete_filename), checksum_algorithm)
+
+
+def get_target_filename(filename, target_dir, file_date=None, append_timestamp=True, tag=None, skip_existing=False,
+                        path_prefix=None, timestamp_format=default_timestamp_format,
+                        duplicate_filename_format=default_duplicate_filename_format,
+                        new_filename_format=default_new_filename_format,
+                        use_checksum_existence_check=default_use_checksum_existence_check, file_index=None,
+                        registry=None):
+    """
+    Returns the filename a photo will be relocated to, or None if the photo should be skipped. See relocate_photo.
+
+    :param registry: a TargetNameRegistry to reserve the filename in, so it's never handed out twice, even before the
+        photo is moved or copied. If None the filesystem is checked for existing files.
     """
     if not file_date:
-        file_date = get_date_from_file(filename)
+        file_date = file_index and file_index.get_date(filename) or get_date_from_file(filename)
 
     if not file_date:
         logger.warning("Error getting date from %s" % filename)
         return
 
     target_dir = os.path.join(target_dir, generate_folders_from_date(file_date, tag, path_prefix))
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-
     new_filename = os.path.join(target_dir, append_timestamp and generate_filename_from_date(
         filename,
         file_date,
         timestamp_format=timestamp_format,
         new_filename_format=new_filename_format) or os.path.basename(filename))
 
-    if skip_existing and os.path.exists(new_filename):
-        if use_checksum_existence_check and get_checksum(new_filename) == get_checksum(filename):
+    if skip_existing and (registry and registry.exists(new_filename) or os.path.exists(new_filename)):
+        checksum = file_index and file_index.get_checksum or get_checksum
+        if use_checksum_existence_check and checksum(new_filename) == checksum(filename):
             return
         else:
             return
 
-    new_filename = generate_valid_target(new_filename, duplicate_filename_format)
+    return generate_valid_target(new_filename, duplicate_filename_format, registry)
 
-    if remove_source:
-        if not dry_run:
-            shutil.move(filename, new_filename)
+
+def transfer_photo(filename, new_filename, remove_source=True, dry_run=False, directories=None, statistics=None):
+    """
+    Moves or copies filename to new_filename using transfer_file, creating the target folder if needed.
+
+    :param remove_source: boolean value indicating if we move the photo instead of copying it.
+    :param dry_run: boolean value indicating if we only log what would have been done.
+    :param directories: a DirectoryCache shared by all photos relocated in a run, so the target folder is only created
+        or checked the first time it's used.
+    :param statistics: a TransferStatistics to record the move or copy in.
+    """
+    if not dry_run:
+        if directories:
+            directories.makedirs(os.path.dirname(new_filename))
         else:
-            logger.debug('move %s to %s' % (filename, new_filename))
+            os.makedirs(os.path.dirname(new_filename), exist_ok=True)
+
+    if not dry_run:
+        transfer_file(filename, new_filename, remove_source, statistics)
     else:
-        if not dry_run:
-            shutil.copy(filename, new_filename)
-        else:
-            logger.debug('copy %s to %s' % (filename, new_filename))
+        logger.debug('%s %s to %s' % (remove_source and 'move' or 'copy', filename, new_filename))
 
+
+def relocate_photo(filename, target_dir, file_date=None, append_timestamp=True, remove_source=True, tag=None,
+                   skip_existing=False, path_prefix=None, dry_run=False, timestamp_format=default_timestamp_format,
+                   duplicate_filename_format=default_duplicate_filename_format,
+                   new_filename_format=default_new_filename_format,
+                   use_checksum_existence_check=default_use_checksum_existence_check, file_index=None, registry=None,
+                   directories=None, statistics=None):
+    """
+
+    :param file_index: a FileIndex to look up dates and checksums in, or None to read them from the photo.
+    :param registry: a TargetNameRegistry shared by all photos relocated in a run, see get_target_filename.
+    :param directories: a DirectoryCache shared by all photos relocated in a run, see transfer_photo.
+    :param statistics: a TransferStatistics to record the move or copy in.
+    :param use_checksum_existence_check:
+    :param timestamp_format:
+    :param duplicate_filename_format:
+    :param new_filename_format:
+    :param dry_run:
+    :param filename:
+    :param target_dir:
+    :param file_date:
+    :param append_timestamp:
+    :param remove_source:
+    :param tag:
+    :param skip_existing:
+    :param path_prefix:
+    """
+    new_filename = get_target_filename(
+        filename,
+        target_dir,
+        file_date=file_date,
+        append_timestamp=append_timestamp,
+        tag=tag,
+        skip_existing=skip_existing,
+        path_prefix=path_prefix,
+        timestamp_format=timestamp_format,
+        duplicate_filename_format=duplicate_filename_format,
+        new_filename_format=new_filename_format,
+        use_checksum_existence_check=use_checksum_existence_check,
+        file_index=file_index,
+        registry=registry)
+
+    if not new_filename:
+        return
+
+    transfer_photo(filename, new_filename, remove_source, dry_run, directories, statistics)
     return new_filename
 
 
@@ -175,6 +391,7 @@ def print_tag(source_folder):
 def generate_thumb(media_folder, absolute_filename, width, height, do_crop, alternative_thumbnail_name=None,
                    raise_exception_on_error=False):
     """
+    Generates a single thumbnail of a photo. See generate_thumbnails to generate several sizes of a photo at once.
 
     :param media_folder: target folder to hold the generated thumbnails.
     :param absolute_filename: the original photo to use as base for the thumbnail.
@@ -186,10 +403,6 @@ def generate_thumb(media_folder, absolute_filename, width, height, do_crop, alte
     """
     logger.debug("Generating thumb: %s" % absolute_filename)
 
-    filename, ext = os.path.splitext(os.path.basename(absolute_filename))
-    if alternative_thumbnail_name:
-        filename = alternative_thumbnail_name
-
     if not os.path.exists(absolute_filename):
         logger.warning("inputfile %s does not exists" % absolute_filename)
 
@@ -198,15 +411,12 @@ def generate_thumb(media_folder, absolute_filename, width, height, do_crop, alte
 
         return
 
-    if not os.path.exists(media_folder):
-        os.makedirs(media_folder)
-
-    output = os.path.join(media_folder, '%s_%sx%s%s%s' % (filename, width, height, do_crop and '_crop' or '', ext))
-    if not os.path.exists(output):
-        try:
-            resize_image(absolute_filename, output, width, height, crop=do_crop)
-        except (Exception) as ex:
-            logger.warning(ex)
+    output = get_thumbnail_filename(media_folder, absolute_filename, width, height, do_crop,
+                                    alternative_thumbnail_name)
+    try:
+        generate_thumbnails(absolute_filename, media_folder, [(width, height)], do_crop, alternative_thumbnail_name)
+    except (Exception) as ex:
+        logger.warning(ex)
 
     return output
 
@@ -223,65 +433,10 @@ def resize_image(source_file, target_file, width, height, crop=False):
     :param height: max height for the processed photo.
     :param crop: boolean value indicating if the photo should be cropped using width and height as boundries.
     """
-    image = Image.open(source_file)
-    orientation = 0
-    try:
-        for tag, value in image._getexif().items():
-            if TAGS.get(tag, tag) == 'Orientation':
-                orientation = value
-    except (Exception) as ex:
-        logger.warning(ex)
-        orientation = None
-
-    if image.mode not in ('L', 'RGB'):
-        image = image.convert('RGB')
-
-    if not crop:
-        image.thumbnail((width, height), Image.ANTIALIAS)
-    else:
-        src_width, src_height = image.size
-        src_ratio = float(src_width) / float(src_height)
-        dst_width, dst_height = width, height
-        dst_ratio = float(dst_width) / float(dst_height)
-
-        if dst_ratio < src_ratio:
-            crop_height = src_height
-            crop_width = crop_height * dst_ratio
-            x_offset = int(float(src_width - crop_width) / 2)
-            y_offset = 0
-        else:
-            crop_width = src_width
-            crop_height = crop_width / dst_ratio
-            x_offset = 0
-            y_offset = int(float(src_height - crop_height) / 3)
-        image = image.crop((x_offset, y_offset, x_offset + int(crop_width), y_offset + int(crop_height)))
-        image = image.resize((int(dst_width), int(dst_height)), Image.ANTIALIAS)
-
-    # rotate according to orientation stored in exif-data:
-    if orientation:
-        if orientation == 2:
-            # Vertical Mirror
-            image = image.transpose(Image.FLIP_LEFT_RIGHT)
-        elif orientation == 3:
-            # Rotation 180°
-            image = image.transpose(Image.ROTATE_180)
-        elif orientation == 4:
-            # Horizontal Mirror
-            image = image.transpose(Image.FLIP_TOP_BOTTOM)
-        elif orientation == 5:
-            # Horizontal Mirror + Rotation 270°
-            image = image.transpose(Image.FLIP_TOP_BOTTOM).transpose(Image.ROTATE_270)
-        elif orientation == 6:
-            # Rotation 270°
-            image = image.transpose(Image.ROTATE_270)
-        elif orientation == 7:
-            # Vertical Mirror + Rotation 270°
-            image = image.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.ROTATE_270)
-        elif orientation == 8:
-            # Rotation 90°
-            image = image.transpose(Image.ROTATE_90)
-
-    image.save(target_file)
+    sizes = [(width, height)]
+    with open_image(source_file, sizes, crop) as image:
+        for size, thumbnail in create_thumbnails(image, sizes, crop):
+            save_thumbnail(thumbnail, target_file)
 
 
 class MpsPhoto:
@@ -339,19 +494,11 @@ class MpsPhoto:
         """
         return ''.join(self._build_parts(*args))
 
-    def generate_valid_target_filename(self, complete_target_filename):
+    def generate_valid_target_filename(self, complete_target_filename, registry=None):
         """
 
         :complete_target_filename:
+        :param registry: a TargetNameRegistry to reserve the filename in, see generate_valid_target.
         :return:
         """
-        if not os.path.exists(complete_target_filename):
-            return complete_target_filename
-
-        counter = 1
-        while 1:
-            filename, ext = os.path.splitext(complete_target_filename)
-            new_target_filename = '%s~%s%s' % (filename, counter, ext)
-            if not os.path.exists(new_target_filename):
-                return new_target_filename
-            counter += 1
\ No newline at end of file
+        return generate_valid_target(complete_target_filename, registry=registry)
@@ -0,0 +1,244 @@
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+try:
+    import msgpack
+    MSGPACK_SUPPORT = True
+except ImportError:
+    MSGPACK_SUPPORT = False
+
+from mediaphile.cli import default_checksum_algorithm
+from mediaphile.lib.file_operations import get_checksum, transfer_file, remove_source_folders, DirectoryCache, \
+    TransferStatistics
+
+logger = logging.getLogger("verbose")
+
+plan_version = 1
+msgpack_extensions = ('.msgpack', '.mpk')
+
+
+def create_plan_entry(source, target, date, checksum_algorithm=None):
+    """
+    Returns a plan entry for moving or copying source to target.
+
+    :param source: the file to move or copy.
+    :param target: the filename to move or copy it to.
+    :param date: the datetime the target filename was generated from.
+    :param checksum_algorithm: the hash algorithm used to calculate a digest of source, verified before the entry is
+        executed from a plan file. If None no digest is calculated and only the size is verified.
+    :returns: a dictionary with source, target, size, digest and date.
+    """
+    return dict(source=source, target=target, size=os.stat(source).st_size,
+                digest=checksum_algorithm and get_checksum(source, checksum_algorithm) or None,
+                date=date and date.isoformat() or None)
+
+
+def _is_msgpack(filename):
+    return os.path.splitext(filename)[-1].lower() in msgpack_extensions
+
+
+def write_plan(filename, entries, remove_source=True, checksum_algorithm=None):
+    """
+    Writes a plan to filename as msgpack if the extension is .msgpack or .mpk, and as JSON lines otherwise. The first
+    record holds the options of the plan, followed by one record per entry.
+
+    :param filename: the plan file to create.
+    :param entries: the plan entries, see create_plan_entry.
+    :param remove_source: boolean value indicating if the plan moves files instead of copying them.
+    :param checksum_algorithm: the hash algorithm used for the digests of the entries, if any.
+    :returns: the number of entries written.
+    """
+    header = dict(version=plan_version, remove_source=bool(remove_source), checksum_algorithm=checksum_algorithm)
+    count = 0
+    if _is_msgpack(filename):
+        if not MSGPACK_SUPPORT:
+            raise ValueError("msgpack must be installed to write %s." % filename)
+
+        packer = msgpack.Packer()
+        with open(filename, 'wb') as f:
+            f.write(packer.pack(header))
+            for entry in entries:
+                f.write(packer.pack(entry))
+                count += 1
+    else:
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header) + '\n')
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+                count += 1
+
+    return count
+
+
+def _read_plan_records(filename):
+    if _is_msgpack(filename):
+        if not MSGPACK_SUPPORT:
+            raise ValueError("msgpack must be installed to read %s." % filename)
+
+        with open(filename, 'rb') as f:
+            for record in msgpack.Unpacker(f, raw=False):
+                yield record
+    else:
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def read_plan(filename):
+    """
+    Reads a plan written by write_plan. The entries are read as they are iterated.
+
+    :param filename: the plan file to read.
+    :returns: a tuple of the dictionary with the options of the plan and an iterator of entries.
+    """
+    records = _read_plan_records(filename)
+    header = next(records, None)
+    if not header or header.get('version') != plan_version:
+        raise ValueError("%s is not a mediaphile plan." % filename)
+
+    return header, records
+
+
+def _execute_entry(entry, remove_source, directories, statistics, verify, checksum_algorithm):
+    """
+    Moves or copies the source of entry to its target.
+
+    If verify is True, the entry is checked against the filesystem first: an entry found to be completed already, by a
+    run that crashed before recording it, is not executed again, and an entry whose source has changed since the plan
+    was made is skipped.
+
+    :returns: True if the entry is completed.
+    """
+    source, target = entry['source'], entry['target']
+    if verify:
+        source_exists = os.path.exists(source)
+        if os.path.exists(target):
+            if not source_exists:
+                return True
+
+            if get_checksum(source, checksum_algorithm) == get_checksum(target, checksum_algorithm):
+                if remove_source:
+                    os.unlink(source)
+                return True
+
+            logger.warning("%s already exists, skipping %s" % (target, source))
+            return False
+
+        if not source_exists:
+            logger.warning("%s no longer exists, skipping" % source)
+            return False
+
+        if os.stat(source).st_size != entry['size'] or \
+                entry.get('digest') and get_checksum(source, checksum_algorithm) != entry['digest']:
+            logger.warning("%s has changed since the plan was made, skipping" % source)
+            return False
+
+    if directories:
+        directories.makedirs(os.path.dirname(target))
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    transfer_file(source, target, remove_source, statistics, atomic=True)
+    return True
+
+
+def execute_plan(entries, remove_source=True, jobs=None, directories=None, statistics=None, verify=False,
+                 checksum_algorithm=default_checksum_algorithm, completed=None, done=None):
+    """
+    Moves or copies the files of a plan. Files are written to a temporary name and renamed to their target when
+    complete, so a target never exists partially written.
+
+    :param entries: the plan entries, see create_plan_entry.
+    :param remove_source: boolean value indicating if we move files instead of copying them.
+    :param jobs: number of threads moving or copying files, None or 1 to do it in the calling thread.
+    :param directories: the DirectoryCache of the run.
+    :param statistics: a TransferStatistics to record every move or copy in.
+    :param verify: boolean value indicating if every entry is checked against the filesystem first, see _execute_entry.
+    :param checksum_algorithm: the hash algorithm used for the digests of the entries.
+    :param completed: a set of indexes of entries to skip, as they were completed by an earlier run.
+    :param done: a function called with the index and entry of every completed entry, always from the calling thread.
+    :returns: the number of completed entries.
+    """
+    completed = completed or ()
+    count = 0
+
+    def finish(index, entry, result):
+        if result and done:
+            done(index, entry)
+        return result and 1 or 0
+
+    if not jobs or jobs < 2:
+        for index, entry in enumerate(entries):
+            if index not in completed:
+                count += finish(index, entry, _execute_entry(entry, remove_source, directories, statistics, verify,
+                                                             checksum_algorithm))
+        return count
+
+    pending = {}
+    with ThreadPoolExecutor(jobs) as pool:
+        for index, entry in enumerate(entries):
+            if index in completed:
+                continue
+
+            future = pool.submit(_execute_entry, entry, remove_source, directories, statistics, verify,
+                                 checksum_algorithm)
+            pending[future] = (index, entry)
+            while len(pending) > jobs * 16:
+                finished, not_finished = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    count += finish(*pending.pop(future), future.result())
+
+        while pending:
+            finished, not_finished = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                count += finish(*pending.pop(future), future.result())
+
+    return count
+
+
+def apply_plan(filename, jobs=None, statistics=None):
+    """
+    Executes a plan written by write_plan. Every entry is verified before it is executed, see _execute_entry.
+
+    The index of every completed entry is recorded in a progress file next to the plan, so applying the plan again,
+    after a crash or if it was interrupted, continues where it stopped.
+
+    :param filename: the plan file to execute.
+    :param jobs: number of threads moving or copying files, None or 1 to do it in the calling thread.
+    :param statistics: a TransferStatistics to record every move or copy in.
+    :returns: a dictionary with the number of entries completed now and by earlier runs.
+    """
+    header, entries = read_plan(filename)
+    remove_source = header['remove_source']
+    statistics = statistics or TransferStatistics()
+    progress_filename = '%s.done' % filename
+    completed = set()
+    if os.path.exists(progress_filename):
+        with open(progress_filename) as f:
+            completed = set(int(line) for line in f if line.strip())
+        logger.debug("Resuming %s, %s entries already completed" % (filename, len(completed)))
+
+    source_folders = set()
+
+    def remember_source_folders():
+        for entry in entries:
+            source_folders.add(os.path.dirname(entry['source']))
+            yield entry
+
+    with open(progress_filename, 'a') as progress:
+        def done(index, entry):
+            progress.write('%s\n' % index)
+            progress.flush()
+
+        count = execute_plan(remember_source_folders(), remove_source, jobs, DirectoryCache(), statistics, verify=True,
+                             checksum_algorithm=header.get('checksum_algorithm') or default_checksum_algorithm,
+                             completed=completed, done=done)
+
+    if remove_source:
+        remove_source_folders(folder for folder in sorted(source_folders, reverse=True) if os.path.isdir(folder))
+
+    statistics.log()
+    return dict(completed=count, previously_completed=len(completed))
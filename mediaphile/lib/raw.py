@@ -0,0 +1,237 @@
+import io
+import os
+import struct
+import logging
+
+from mediaphile.cli import default_raw_extensions
+
+logger = logging.getLogger("verbose")
+
+# the magic numbers following the byte order of TIFF-based RAW formats: TIFF, NEF and CR2, RW2, ORF
+raw_magic_numbers = (42, 0x55, 0x4f52, 0x5352)
+
+_orientation_tag = 0x0112
+_compression_tag = 0x0103
+_strip_offsets_tag = 0x0111
+_strip_byte_counts_tag = 0x0117
+_sub_ifds_tag = 0x014a
+_exif_ifd_tag = 0x8769
+_jpeg_offset_tag = 0x0201
+_jpeg_length_tag = 0x0202
+# RW2 stores a full-size JPEG as the value of this tag
+_jpg_from_raw_tag = 0x002e
+
+_old_jpeg_compression = 6
+# size in bytes of every TIFF field type
+_type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+_type_formats = {1: 'B', 3: 'H', 4: 'I', 6: 'b', 8: 'h', 9: 'i', 13: 'I'}
+
+# JPEG start of frame markers Pillow can decode: baseline, extended sequential and progressive. The other start of
+# frame markers are lossless or arithmetic coded, like the raw data of a CR2.
+_decodable_sof_markers = (0xc0, 0xc1, 0xc2)
+_sof_markers = tuple(marker for marker in range(0xc0, 0xd0) if marker not in (0xc4, 0xc8, 0xcc))
+
+max_ifds = 32
+max_ifd_entries = 1024
+
+
+def is_raw(filename, raw_extensions_to_include=None):
+    """
+    Returns True if filename has the extension of a RAW format with an embedded preview.
+
+    :param filename: the file to check.
+    :param raw_extensions_to_include: extensions of RAW files, defaults to default_raw_extensions.
+    """
+    return os.path.splitext(filename)[-1][1:].lower() in (raw_extensions_to_include or default_raw_extensions)
+
+
+def _read_ifd(f, offset, byte_order, file_size):
+    """
+    Reads the IFD at offset.
+
+    :returns: a tuple of a dictionary with the tag as key and (type, count, values or value offset) as value, and the
+        offset of the next IFD.
+    """
+    f.seek(offset)
+    data = f.read(2)
+    if len(data) < 2:
+        return {}, 0
+
+    count = min(struct.unpack(byte_order + 'H', data)[0], max_ifd_entries)
+    data = f.read(count * 12 + 4)
+    if len(data) < count * 12 + 4:
+        return {}, 0
+
+    entries = {}
+    for index in range(count):
+        tag, field_type, value_count = struct.unpack(byte_order + 'HHI', data[index * 12:index * 12 + 8])
+        value = data[index * 12 + 8:index * 12 + 12]
+        size = _type_sizes.get(field_type, 1) * value_count
+        if field_type in _type_formats and value_count <= 64:
+            if size > 4:
+                value_offset = struct.unpack(byte_order + 'I', value)[0]
+                if value_offset + size > file_size:
+                    continue
+                position = f.tell()
+                f.seek(value_offset)
+                value = f.read(size)
+                f.seek(position)
+            entries[tag] = (field_type, value_count,
+                            struct.unpack(byte_order + _type_formats[field_type] * value_count, value[:size]))
+        else:
+            entries[tag] = (field_type, value_count, struct.unpack(byte_order + 'I', value))
+
+    return entries, struct.unpack(byte_order + 'I', data[count * 12:count * 12 + 4])[0]
+
+
+def _get_values(entries, tag):
+    entry = entries.get(tag)
+    return entry and entry[2] or ()
+
+
+def _get_jpeg_size(f, offset, length):
+    """
+    Returns the (width, height) of the JPEG of length bytes at offset, or None if it isn't a JPEG Pillow can decode.
+    """
+    end = offset + length
+    f.seek(offset)
+    if f.read(2) != b'\xff\xd8':
+        return None
+
+    while f.tell() < end:
+        data = f.read(4)
+        if len(data) < 4 or data[0] != 0xff:
+            return None
+
+        marker, segment_length = data[1], struct.unpack('>H', data[2:])[0]
+        if marker in _sof_markers:
+            if marker not in _decodable_sof_markers:
+                return None
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:])
+            return width, height
+
+        if marker in (0xd9, 0xda):
+            return None
+
+        f.seek(segment_length - 2, os.SEEK_CUR)
+
+    return None
+
+
+def find_exif_thumbnail(data):
+    """
+    Finds the thumbnail in IFD1 of EXIF-data, as stored in the APP1 segment of a JPEG.
+
+    :param data: the EXIF-data, with or without the Exif identifier in front of the TIFF-header.
+    :returns: a tuple of the offset and length of the thumbnail in data, or None.
+    """
+    # offsets are relative to the TIFF-header, which follows the Exif identifier
+    start = data.startswith(b'Exif\x00\x00') and 6 or 0
+    f = io.BytesIO(data[start:])
+    header = f.read(8)
+    if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+        return None
+
+    byte_order = header[:2] == b'II' and '<' or '>'
+    magic, offset = struct.unpack(byte_order + 'HI', header[2:])
+    entries, offset = _read_ifd(f, offset, byte_order, len(data) - start)
+    if not offset:
+        return None
+
+    entries, next_offset = _read_ifd(f, offset, byte_order, len(data) - start)
+    offset, length = _get_values(entries, _jpeg_offset_tag), _get_values(entries, _jpeg_length_tag)
+    if not offset or not length or start + offset[0] + length[0] > len(data):
+        return None
+
+    return start + offset[0], length[0]
+
+
+def find_previews(filename):
+    """
+    Finds the JPEG previews embedded in a TIFF-based RAW file, like NEF, CR2 and RW2, by walking its IFDs, without
+    reading the rest of the file.
+
+    Previews are found as JPEGInterchangeFormat in any IFD, the single strip of an IFD compressed as JPEG, and the
+    JpgFromRaw tag of RW2. Only JPEGs Pillow can decode are returned, so the lossless JPEG holding the raw data of a
+    CR2 is skipped.
+
+    :param filename: the RAW file.
+    :returns: a tuple of a list of (offset, length, width, height) tuples, one per preview, and the orientation stored
+        in the first IFD, or None.
+    """
+    file_size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        header = f.read(8)
+        if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+            return [], None
+
+        byte_order = header[:2] == b'II' and '<' or '>'
+        magic, offset = struct.unpack(byte_order + 'HI', header[2:])
+        if magic not in raw_magic_numbers:
+            return [], None
+
+        locations = []
+        orientation = None
+        pending = [offset]
+        visited = set()
+        while pending and len(visited) < max_ifds:
+            offset = pending.pop(0)
+            if not offset or offset in visited or offset >= file_size:
+                continue
+
+            visited.add(offset)
+            entries, next_offset = _read_ifd(f, offset, byte_order, file_size)
+            pending.append(next_offset)
+            pending.extend(_get_values(entries, _sub_ifds_tag))
+            pending.extend(_get_values(entries, _exif_ifd_tag))
+            if orientation is None and _get_values(entries, _orientation_tag):
+                orientation = _get_values(entries, _orientation_tag)[0]
+
+            if _get_values(entries, _jpeg_offset_tag) and _get_values(entries, _jpeg_length_tag):
+                locations.append((_get_values(entries, _jpeg_offset_tag)[0],
+                                  _get_values(entries, _jpeg_length_tag)[0]))
+
+            strip_offsets = _get_values(entries, _strip_offsets_tag)
+            strip_byte_counts = _get_values(entries, _strip_byte_counts_tag)
+            if _get_values(entries, _compression_tag) == (_old_jpeg_compression,) and len(strip_offsets) == 1 and \
+                    len(strip_byte_counts) == 1:
+                locations.append((strip_offsets[0], strip_byte_counts[0]))
+
+            if _jpg_from_raw_tag in entries:
+                field_type, count, value = entries[_jpg_from_raw_tag]
+                if count > 4:
+                    locations.append((value[0], count))
+
+        previews = []
+        for offset, length in sorted(set(locations)):
+            if offset + length > file_size:
+                continue
+
+            size = _get_jpeg_size(f, offset, length)
+            if size:
+                previews.append((offset, length) + size)
+
+    return previews, orientation
+
+
+def read_preview(filename):
+    """
+    Reads the largest JPEG preview embedded in a RAW file, see find_previews.
+
+    :param filename: the RAW file.
+    :returns: a tuple of the JPEG data and the orientation stored in the RAW file. The orientation is None if the RAW
+        file doesn't store one.
+    :raises ValueError: if the file has no preview.
+    """
+    previews, orientation = find_previews(filename)
+    if not previews:
+        raise ValueError("No embedded preview found in %s." % filename)
+
+    offset, length, width, height = max(previews, key=lambda preview: (preview[2] * preview[3], preview[1]))
+    logger.debug("Reading %sx%s preview of %s" % (width, height, filename))
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        return f.read(length), orientation
@@ -0,0 +1,812 @@
+import io
+import os
+import math
+import time
+import queue
+import shutil
+import sqlite3
+import logging
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+
+try:
+    from PIL import Image
+    PILLOW_SUPPORT = True
+except ImportError:
+    PILLOW_SUPPORT = False
+
+from mediaphile.cli import default_photo_extensions, default_thumbnail_timeout, default_thumbnail_max_tasks_per_child, \
+    default_thumbnail_queue_size, default_checksum_algorithm
+from mediaphile.lib.file_operations import dirwalk, get_checksum, get_checksum_algorithm
+from mediaphile.lib.raw import is_raw, read_preview, find_exif_thumbnail
+
+logger = logging.getLogger("verbose")
+
+_orientation_tag = 0x0112
+# how to transpose an image with the given EXIF orientation, like ImageOps.exif_transpose does
+_transpositions = PILLOW_SUPPORT and {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+} or {}
+
+
+def parse_dimensions(dimensions):
+    """
+    Parses thumbnail dimensions given on the command-line.
+
+    :param dimensions: a comma separated list of WIDTHxHEIGHT values, like 400x400,800x600.
+    :returns: a list of (width, height) tuples.
+    """
+    result = []
+    for dimension in dimensions.split(','):
+        try:
+            width, height = dimension.lower().split('x')
+            result.append((int(width), int(height)))
+        except ValueError:
+            raise ValueError("Invalid thumbnail dimensions %s, expected WIDTHxHEIGHT." % dimension)
+
+    return result
+
+
+def get_thumbnail_filename(target_folder, source_file, width, height, crop=False, alternative_thumbnail_name=None):
+    """
+    Returns the filename of the thumbnail of source_file with the given dimensions.
+
+    :param target_folder: folder holding the thumbnails.
+    :param source_file: the original photo.
+    :param width: max width of the thumbnail.
+    :param height: max height of the thumbnail.
+    :param crop: boolean value indicating if the thumbnail is cropped to exactly width and height.
+    :param alternative_thumbnail_name: alternative name for the thumbnail, instead of the name of the photo.
+    """
+    filename, ext = os.path.splitext(os.path.basename(source_file))
+    if is_raw(source_file):
+        # thumbnails of RAW files are JPEGs, named so they don't collide with thumbnails of a JPEG shot alongside
+        ext += '.jpg'
+    return os.path.join(target_folder, '%s_%sx%s%s%s' % (alternative_thumbnail_name or filename, width, height,
+                                                           crop and '_crop' or '', ext))
+
+
+def open_image(source_file, sizes=None, crop=False, use_embedded_thumbnail=True):
+    """
+    Opens and decodes an image, rotated and mirrored according to the orientation stored in its EXIF-data.
+
+    If the sizes of the thumbnails to create are given, the image is decoded only as large as the largest thumbnail
+    requires: the thumbnail embedded in the EXIF-data is used if it's big enough, and JPEGs are otherwise decoded at a
+    reduced scale of 1/2, 1/4 or 1/8 by libjpeg, see Image.draft.
+
+    RAW files aren't decoded at all, instead the largest JPEG preview embedded in them is used, see raw.read_preview.
+
+    :param source_file: the photo or image to open.
+    :param sizes: a list of (width, height) tuples the image will be resized to, see create_thumbnails.
+    :param crop: see create_thumbnails.
+    :param use_embedded_thumbnail: boolean value indicating if the thumbnail embedded in the EXIF-data may be used.
+    :returns: a decoded Image in mode L or RGB. Close it when done, see Image.close.
+    """
+    raw_orientation = None
+    if is_raw(source_file):
+        data, raw_orientation = read_preview(source_file)
+        source = Image.open(io.BytesIO(data))
+    else:
+        source = Image.open(source_file)
+
+    image = source
+    try:
+        orientation = None
+        try:
+            orientation = image.getexif().get(_orientation_tag)
+        except Exception as ex:
+            logger.warning("Error reading orientation of %s: %s" % (source_file, ex))
+        # the preview of a RAW file doesn't always have EXIF-data of its own
+        orientation = orientation or raw_orientation
+
+        if sizes:
+            # the sizes apply to the image as shown, which is rotated if orientation is 5 to 8
+            rotated = orientation in (5, 6, 7, 8)
+            width, height = rotated and image.size[::-1] or image.size
+            required_width, required_height = _get_required_size((width, height), sizes, crop)
+            required_size = rotated and (required_height, required_width) or (required_width, required_height)
+            if required_size != image.size:
+                embedded = use_embedded_thumbnail and _get_embedded_thumbnail(image, required_size)
+                if embedded:
+                    logger.debug("Using the embedded thumbnail of %s" % source_file)
+                    image = embedded
+                else:
+                    image.draft(image.mode, required_size)
+
+        if orientation in _transpositions:
+            image = image.transpose(_transpositions[orientation])
+
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+
+        image.load()
+    except BaseException:
+        source.close()
+        raise
+
+    # a transposed, converted or embedded image is a new Image, which no longer needs the file
+    if image is not source:
+        source.close()
+
+    return image
+
+
+def _get_embedded_thumbnail(image, required_size):
+    """
+    Returns the decoded thumbnail embedded in the EXIF-data of image if it is at least required_size and has the aspect
+    ratio of image, as some cameras add black borders to the embedded thumbnail.
+    """
+    try:
+        data = image.info.get('exif')
+        location = data and find_exif_thumbnail(data)
+        if not location:
+            return None
+
+        offset, length = location
+        thumbnail = Image.open(io.BytesIO(data[offset:offset + length]))
+        width, height = thumbnail.size
+        if width < required_size[0] or height < required_size[1] or \
+                abs(float(width) / height - float(image.size[0]) / image.size[1]) > 0.01 * width / height:
+            return None
+
+        thumbnail.load()
+        return thumbnail
+    except Exception as ex:
+        logger.debug("Error reading the embedded thumbnail: %s" % ex)
+        return None
+
+
+def _get_required_size(size, sizes, crop):
+    """
+    Returns the smallest size an image of size can be scaled down to and still make thumbnails in all sizes from it.
+    """
+    scale = max(_get_scale(size, width, height, crop) for width, height in sizes)
+    return int(math.ceil(size[0] * scale)), int(math.ceil(size[1] * scale))
+
+
+def _get_scale(size, width, height, crop):
+    """
+    Returns the factor an image of size must be scaled by to fit within width and height, or to cover them if crop is
+    True. Images are never enlarged.
+    """
+    src_width, src_height = size
+    if crop:
+        return min(1.0, max(float(width) / src_width, float(height) / src_height))
+
+    return min(1.0, float(width) / src_width, float(height) / src_height)
+
+
+def _crop(image, width, height):
+    """
+    Crops image to the aspect ratio of width and height, centered horizontally and at a third from the top, and
+    resizes it to exactly width and height.
+    """
+    src_width, src_height = image.size
+    src_ratio = float(src_width) / float(src_height)
+    dst_ratio = float(width) / float(height)
+
+    if dst_ratio < src_ratio:
+        crop_height = src_height
+        crop_width = crop_height * dst_ratio
+        x_offset = int(float(src_width - crop_width) / 2)
+        y_offset = 0
+    else:
+        crop_width = src_width
+        crop_height = crop_width / dst_ratio
+        x_offset = 0
+        y_offset = int(float(src_height - crop_height) / 3)
+
+    image = image.crop((x_offset, y_offset, x_offset + int(crop_width), y_offset + int(crop_height)))
+    if image.size != (width, height):
+        image = image.resize((int(width), int(height)), Image.LANCZOS)
+
+    return image
+
+
+def create_thumbnails(image, sizes, crop=False):
+    """
+    Creates thumbnails of image in every size using a resize cascade: the sizes are made from the largest to the
+    smallest, every size resized from the one before it instead of from the original image.
+
+    :param image: the decoded image, see open_image.
+    :param sizes: a list of (width, height) tuples.
+    :param crop: boolean value indicating if the thumbnails are cropped to exactly width and height, instead of keeping
+        the aspect ratio of the image within width and height.
+    :returns: a generator yielding ((width, height), thumbnail) tuples, from the largest to the smallest size.
+    """
+    original_size = image.size
+    current = image
+    for width, height in sorted(sizes, key=lambda size: _get_scale(original_size, size[0], size[1], crop),
+                                reverse=True):
+        scale = _get_scale(original_size, width, height, crop)
+        scaled_size = (max(1, int(round(original_size[0] * scale))), max(1, int(round(original_size[1] * scale))))
+        if scaled_size != current.size:
+            current = current.resize(scaled_size, Image.LANCZOS)
+
+        yield (width, height), _crop(current, width, height) if crop else current
+
+
+def save_thumbnail(thumbnail, filename):
+    """
+    Saves thumbnail to a temporary file renamed to filename when complete, so a thumbnail never exists partially
+    written, even if the process is killed while saving.
+
+    :param thumbnail: the Image to save.
+    :param filename: the thumbnail filename. The format is chosen by its extension.
+    """
+    temporary_filename = '%s.%s.part' % (filename, os.getpid())
+    try:
+        thumbnail.save(temporary_filename, Image.registered_extensions().get(os.path.splitext(filename)[-1].lower()))
+        os.replace(temporary_filename, filename)
+    except BaseException:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        raise
+
+
+def generate_thumbnails(source_file, target_folder, sizes, crop=False, alternative_thumbnail_name=None,
+                        overwrite=False):
+    """
+    Generates thumbnails of a photo in several sizes, decoding the photo only once, see create_thumbnails.
+
+    :param source_file: the original photo.
+    :param target_folder: folder to hold the thumbnails, created if needed.
+    :param sizes: a list of (width, height) tuples.
+    :param crop: see create_thumbnails.
+    :param alternative_thumbnail_name: alternative name for the thumbnails, see get_thumbnail_filename.
+    :param overwrite: boolean value indicating if existing thumbnails are generated again.
+    :returns: a dictionary with (width, height) as key and the thumbnail filename as value, for every size.
+    """
+    result = dict((size, get_thumbnail_filename(target_folder, source_file, size[0], size[1], crop,
+                                                alternative_thumbnail_name)) for size in sizes)
+    missing = [size for size, filename in result.items() if overwrite or not os.path.exists(filename)]
+    if not missing:
+        return result
+
+    if not os.path.exists(target_folder):
+        os.makedirs(target_folder, exist_ok=True)
+
+    logger.debug("Generating %s thumbnails of %s" % (len(missing), source_file))
+    with open_image(source_file, missing, crop) as image:
+        for size, thumbnail in create_thumbnails(image, missing, crop):
+            save_thumbnail(thumbnail, result[size])
+
+    return result
+
+
+thumbnail_index_schema = """
+CREATE TABLE IF NOT EXISTS thumbnails (
+    source TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    crop INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    checksum TEXT,
+    path TEXT NOT NULL,
+    PRIMARY KEY (source, width, height, crop)
+);
+CREATE INDEX IF NOT EXISTS thumbnails_checksum ON thumbnails (checksum);
+"""
+
+
+def _is_complete(filename):
+    """
+    Returns True if the image in filename can be decoded completely.
+    """
+    try:
+        with Image.open(filename) as image:
+            image.load()
+        return True
+    except Exception as ex:
+        logger.debug("Ignoring %s: %s" % (filename, ex))
+        return False
+
+
+class ThumbnailIndex:
+    """
+    A persistent catalog of generated thumbnails stored in a SQLite database, so only thumbnails of new or changed
+    photos are generated again.
+
+    Every thumbnail is stored with the size and mtime of its photo when it was generated, and the checksum of the photo.
+    A thumbnail is only trusted as long as the size and mtime match the photo on disk. A photo that is renamed or moved
+    is found by its checksum, and its thumbnails are moved, or copied if the old photo still exists, instead of being
+    generated again.
+
+    Usage:
+
+        with ThumbnailIndex(filename) as thumbnail_index:
+            sizes = thumbnail_index.get_stale(source_file, target_folder, sizes)
+            generate_thumbnails(source_file, target_folder, sizes, overwrite=True)
+            thumbnail_index.store(source_file, target_folder, sizes)
+    """
+
+    def __init__(self, filename, commit_interval=1000, checksum_algorithm=default_checksum_algorithm):
+        """
+
+        :param filename: the SQLite database to use. Created if it doesn't exist.
+        :param commit_interval: number of stored thumbnails between each commit.
+        :param checksum_algorithm: the hash algorithm to use for checksums of photos, see get_checksum_algorithm.
+            None to not use checksums, in which case renamed photos get new thumbnails.
+        """
+        self.filename = filename
+        self.commit_interval = commit_interval
+        self.checksum_algorithm = checksum_algorithm and get_checksum_algorithm(checksum_algorithm) or None
+        self.pending = {}
+        self.changes = 0
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(thumbnail_index_schema)
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Commits any pending changes and closes the database.
+        """
+        if self.connection:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def _store(self, source_file, st, width, height, crop, checksum, path):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO thumbnails (source, width, height, crop, size, mtime, checksum, path) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (source_file, width, height, crop and 1 or 0, st.st_size, st.st_mtime, checksum, path))
+        self.changes += 1
+        if self.changes % self.commit_interval == 0:
+            self.connection.commit()
+
+    def _get_checksum(self, source_file, checksum):
+        if checksum is None and self.checksum_algorithm:
+            checksum = get_checksum(source_file, self.checksum_algorithm)
+        return checksum
+
+    def _has_candidates(self, source_file, st, width, height, crop):
+        """
+        Returns True if another photo of the same size has a thumbnail with a checksum, so the checksum of source_file
+        is only computed when there is a thumbnail to reuse.
+        """
+        return self.checksum_algorithm and self.connection.execute(
+            'SELECT 1 FROM thumbnails WHERE size = ? AND width = ? AND height = ? AND crop = ? AND source != ? '
+            'AND checksum IS NOT NULL LIMIT 1',
+            (st.st_size, width, height, crop and 1 or 0, source_file)).fetchone() is not None
+
+    def _reuse(self, source_file, checksum, width, height, crop, path):
+        """
+        Moves or copies a thumbnail of another photo with the same checksum to path.
+
+        :returns: True if a thumbnail was found.
+        """
+        for other_source, other_path in self.connection.execute(
+                'SELECT source, path FROM thumbnails WHERE checksum = ? AND width = ? AND height = ? AND crop = ? '
+                'AND source != ?', (checksum, width, height, crop and 1 or 0, source_file)).fetchall():
+            if other_path == path or not os.path.exists(other_path):
+                continue
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(other_source):
+                logger.debug("Copying thumbnail of %s to %s" % (other_source, path))
+                shutil.copy2(other_path, path)
+            else:
+                logger.debug("Moving thumbnail of %s to %s" % (other_source, path))
+                os.replace(other_path, path)
+                self.connection.execute(
+                    'DELETE FROM thumbnails WHERE source = ? AND width = ? AND height = ? AND crop = ?',
+                    (other_source, width, height, crop and 1 or 0))
+            return True
+
+        return False
+
+    def get_stale(self, source_file, target_folder, sizes, crop=False, st=None):
+        """
+        Returns the sizes of the thumbnails of source_file that must be generated, because they don't exist or the photo
+        has changed since they were generated.
+
+        Thumbnails that exist but aren't in the index yet, like thumbnails generated before the index was used, are
+        added to the index if they are newer than the photo and can be decoded, as they may have been left partially
+        written by an earlier version. A photo that was only touched keeps its thumbnails, and thumbnails of a photo
+        with the same checksum are reused. The photo is only read to compute its checksum when one of these can apply,
+        so thumbnails adopted this way are stored without a checksum.
+
+        :param source_file: the original photo.
+        :param target_folder: folder holding the thumbnails.
+        :param sizes: a list of (width, height) tuples.
+        :param crop: see create_thumbnails.
+        :param st: the stat_result of the photo, if already known.
+        :returns: a list of (width, height) tuples. Call store with them when they are generated.
+        """
+        source_file = os.path.abspath(source_file)
+        st = st or os.stat(source_file)
+        checksum = None
+        result = []
+        for width, height in sizes:
+            path = os.path.abspath(get_thumbnail_filename(target_folder, source_file, width, height, crop))
+            row = self.connection.execute(
+                'SELECT size, mtime, checksum, path FROM thumbnails WHERE source = ? AND width = ? AND height = ? '
+                'AND crop = ?', (source_file, width, height, crop and 1 or 0)).fetchone()
+            if row and row[:2] == (st.st_size, st.st_mtime) and row[3] == path and os.path.exists(path):
+                continue
+
+            exists = os.path.exists(path)
+            if exists and not row and os.stat(path).st_mtime >= st.st_mtime and _is_complete(path):
+                self._store(source_file, st, width, height, crop, checksum, path)
+                continue
+
+            touched = exists and row and row[3] == path and row[2]
+            if touched or self._has_candidates(source_file, st, width, height, crop):
+                checksum = self._get_checksum(source_file, checksum)
+            if touched and checksum and row[2] == checksum or \
+                    checksum and self._reuse(source_file, checksum, width, height, crop, path):
+                self._store(source_file, st, width, height, crop, checksum, path)
+            else:
+                result.append((width, height))
+
+        if result:
+            self.pending[source_file] = (st, checksum)
+
+        return result
+
+    def store(self, source_file, target_folder, sizes, crop=False, checksum=None):
+        """
+        Stores the thumbnails of source_file returned by get_stale as generated.
+
+        :param source_file: the original photo.
+        :param target_folder: folder holding the thumbnails.
+        :param sizes: a list of (width, height) tuples.
+        :param crop: see create_thumbnails.
+        :param checksum: the checksum of the photo, if already computed. Computed here otherwise.
+        """
+        source_file = os.path.abspath(source_file)
+        st, pending_checksum = self.pending.pop(source_file, None) or (os.stat(source_file), None)
+        checksum = self._get_checksum(source_file, pending_checksum or checksum)
+        for width, height in sizes:
+            self._store(source_file, st, width, height, crop, checksum,
+                        os.path.abspath(get_thumbnail_filename(target_folder, source_file, width, height, crop)))
+
+    def discard(self, source_file):
+        """
+        Forgets the result of get_stale for source_file, when generating its thumbnails failed.
+        """
+        self.pending.pop(os.path.abspath(source_file), None)
+
+    def prune(self, source_folder=None, dry_run=False):
+        """
+        Removes the thumbnails of photos that no longer exist, both from the index and from disk.
+
+        :param source_folder: only prune thumbnails of photos in this folder, None for all photos.
+        :param dry_run: boolean value indicating if we only log what would have been removed.
+        :returns: the number of thumbnails removed.
+        """
+        query = 'SELECT source, width, height, crop, path FROM thumbnails'
+        args = ()
+        if source_folder:
+            prefix = os.path.abspath(source_folder).rstrip(os.sep) + os.sep
+            query += ' WHERE substr(source, 1, ?) = ?'
+            args = (len(prefix), prefix)
+
+        existing = {}
+        removed = []
+        for row in self.connection.execute(query, args).fetchall():
+            if row[0] not in existing:
+                existing[row[0]] = os.path.exists(row[0])
+            if not existing[row[0]]:
+                removed.append(row)
+
+        for source, width, height, crop, path in removed:
+            logger.debug("Removing thumbnail %s of %s" % (path, source))
+            if not dry_run and os.path.exists(path):
+                os.remove(path)
+
+        if not dry_run:
+            self.connection.executemany('DELETE FROM thumbnails WHERE source = ? AND width = ? AND height = ? '
+                                        'AND crop = ?', (row[:4] for row in removed))
+            self.connection.commit()
+
+        return len(removed)
+
+
+def _thumbnail_worker(connection, checksum_algorithm=None):
+    """
+    Runs in a worker process of a ThumbnailPool, generating thumbnails for every task received on connection until it
+    receives None. Sends back a tuple of an error message, or None, and the checksum of the photo if checksum_algorithm
+    is given.
+    """
+    while True:
+        try:
+            task = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        if task is None:
+            break
+
+        try:
+            generate_thumbnails(*task)
+            connection.send((None, checksum_algorithm and get_checksum(task[0], checksum_algorithm) or None))
+        except Exception as ex:
+            connection.send((str(ex) or repr(ex), None))
+
+
+class ThumbnailWorker:
+    """
+    A worker process of a ThumbnailPool, and the task it is working on.
+    """
+
+    def __init__(self, context, checksum_algorithm=None):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_thumbnail_worker, args=(child_connection, checksum_algorithm),
+                                       daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.task = None
+        self.started = None
+        self.tasks = 0
+
+    def submit(self, task):
+        self.connection.send(task)
+        self.task = task
+        self.started = time.monotonic()
+        self.tasks += 1
+
+    def finish(self):
+        task, self.task, self.started = self.task, None, None
+        return task
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class ThumbnailPool:
+    """
+    A pool of processes generating thumbnails, see generate_thumbnails.
+
+    Every worker is given one task at a time. A worker is replaced by a new process after max_tasks_per_child tasks, to
+    release the memory Pillow holds on to, and a worker still busy with a task after timeout seconds is killed and
+    replaced, so a corrupt photo can't stall the whole run. The same goes for a worker that crashes.
+
+    Usage:
+
+        with ThumbnailPool(jobs=4) as pool:
+            for task, error, checksum in pool.run((filename, folder, sizes) for filename in filenames):
+                ...
+    """
+
+    def __init__(self, jobs=None, timeout=default_thumbnail_timeout,
+                 max_tasks_per_child=default_thumbnail_max_tasks_per_child, checksum_algorithm=None):
+        """
+
+        :param jobs: number of processes, defaults to the number of CPUs.
+        :param timeout: max number of seconds a task may take, None to wait forever.
+        :param max_tasks_per_child: number of tasks a process completes before it's replaced, None to keep it forever.
+        :param checksum_algorithm: the hash algorithm the workers compute the checksum of every photo with, so it isn't
+            read again by the parent process. None to not compute checksums.
+        """
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self.checksum_algorithm = checksum_algorithm
+        # the folder is walked in a thread while workers are started, and forking a process with threads may leave a
+        # lock held in the child forever
+        self.context = multiprocessing.get_context(
+            'forkserver' in multiprocessing.get_all_start_methods() and 'forkserver' or 'spawn')
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Stops all worker processes.
+        """
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+    def _replace(self, worker, kill=False):
+        if kill:
+            worker.kill()
+        else:
+            worker.stop()
+        self.workers[self.workers.index(worker)] = ThumbnailWorker(self.context, self.checksum_algorithm)
+
+    def run(self, tasks):
+        """
+        Runs tasks in the worker processes, taking a new task from tasks whenever a worker is idle.
+
+        :param tasks: an iterable of tuples of arguments to generate_thumbnails.
+        :returns: a generator yielding (task, error, checksum) tuples as tasks complete, where error is None if the
+            task succeeded and a message otherwise, and checksum is the checksum of the photo or None.
+        """
+        while len(self.workers) < self.jobs:
+            self.workers.append(ThumbnailWorker(self.context, self.checksum_algorithm))
+
+        tasks = iter(tasks)
+        exhausted = False
+        while True:
+            for worker in self.workers:
+                if not worker.task and not exhausted:
+                    task = next(tasks, None)
+                    if task is None:
+                        exhausted = True
+                    else:
+                        worker.submit(task)
+
+            busy = [worker for worker in self.workers if worker.task]
+            if not busy:
+                break
+
+            timeout = None
+            if self.timeout is not None:
+                timeout = max(0, min(worker.started for worker in busy) + self.timeout - time.monotonic())
+
+            ready = wait([worker.connection for worker in busy], timeout)
+            for worker in busy:
+                if worker.connection in ready:
+                    try:
+                        error, checksum = worker.connection.recv()
+                    except EOFError:
+                        self._replace(worker, kill=True)
+                        yield worker.finish(), "the worker process died", None
+                        continue
+
+                    task = worker.finish()
+                    if self.max_tasks_per_child and worker.tasks >= self.max_tasks_per_child:
+                        self._replace(worker)
+                    yield task, error, checksum
+
+                elif self.timeout is not None and time.monotonic() - worker.started >= self.timeout:
+                    self._replace(worker, kill=True)
+                    yield worker.finish(), "timed out after %s seconds" % self.timeout, None
+
+
+def _put(tasks, task, stopped):
+    """
+    Puts task into the queue tasks, waiting for room unless stopped is set.
+
+    :returns: False if stopped was set first.
+    """
+    while not stopped.is_set():
+        try:
+            tasks.put(task, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+
+def _walk_into(source_folder, target_folder, photo_extensions_to_include, tasks, stopped):
+    """
+    Puts the (filename, thumbnail folder) of every photo in source_folder into the queue tasks, followed by None.
+    """
+    try:
+        for filename in dirwalk(source_folder, photo_extensions_to_include):
+            folder = os.path.join(target_folder, os.path.relpath(os.path.dirname(filename), source_folder))
+            if not _put(tasks, (filename, folder), stopped):
+                break
+    finally:
+        _put(tasks, None, stopped)
+
+
+def generate_folder_thumbnails(source_folder, target_folder, sizes, crop=False, photo_extensions_to_include=None,
+                               dry_run=False, jobs=None, timeout=default_thumbnail_timeout,
+                               max_tasks_per_child=default_thumbnail_max_tasks_per_child,
+                               queue_size=default_thumbnail_queue_size, thumbnail_index=None):
+    """
+    Generates thumbnails in several sizes of every photo in source_folder, see generate_thumbnails. The folder
+    structure of source_folder is repeated in target_folder.
+
+    If jobs is given the thumbnails are generated by a ThumbnailPool of jobs processes, while source_folder is walked
+    in a thread of its own, queueing at most queue_size photos ahead of the pool.
+
+    :param source_folder: the folder holding the photos.
+    :param target_folder: the folder to hold the thumbnails.
+    :param sizes: a list of (width, height) tuples.
+    :param crop: see create_thumbnails.
+    :param photo_extensions_to_include: extensions of the photos to make thumbnails of.
+    :param dry_run: boolean value indicating if we only log what would have been done.
+    :param jobs: number of processes generating thumbnails, None to generate them in the current process.
+    :param timeout: see ThumbnailPool. Only used with jobs.
+    :param max_tasks_per_child: see ThumbnailPool.
+    :param queue_size: max number of photos found and waiting for a process.
+    :param thumbnail_index: a ThumbnailIndex used to only generate thumbnails of new or changed photos. Without an index
+        only thumbnails that don't exist are generated.
+    :returns: the number of photos processed.
+    """
+    photo_extensions_to_include = photo_extensions_to_include or default_photo_extensions
+    count = 0
+
+    def get_sizes(filename, folder):
+        if not thumbnail_index:
+            return sizes
+        return thumbnail_index.get_stale(filename, folder, sizes, crop)
+
+    if not jobs or dry_run:
+        for filename in dirwalk(source_folder, photo_extensions_to_include):
+            folder = os.path.join(target_folder, os.path.relpath(os.path.dirname(filename), source_folder))
+            if dry_run:
+                logger.debug("Generating thumbnails of %s in %s" % (filename, folder))
+            else:
+                try:
+                    stale = get_sizes(filename, folder)
+                    if stale:
+                        generate_thumbnails(filename, folder, stale, crop, overwrite=bool(thumbnail_index))
+                        if thumbnail_index:
+                            thumbnail_index.store(filename, folder, stale, crop)
+                except Exception as ex:
+                    logger.warning("Error generating thumbnails of %s: %s" % (filename, ex))
+                    thumbnail_index and thumbnail_index.discard(filename)
+                    continue
+            count += 1
+
+        return count
+
+    tasks = queue.Queue(queue_size)
+    stopped = threading.Event()
+    walker = threading.Thread(target=_walk_into, args=(source_folder, target_folder, photo_extensions_to_include,
+                                                       tasks, stopped), daemon=True)
+    walker.start()
+
+    def queued_tasks():
+        nonlocal count
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+
+            try:
+                stale = get_sizes(*task)
+            except Exception as ex:
+                logger.warning("Error generating thumbnails of %s: %s" % (task[0], ex))
+                continue
+
+            if stale:
+                yield task + (stale, crop, None, bool(thumbnail_index))
+            else:
+                count += 1
+
+    try:
+        with ThumbnailPool(jobs, timeout, max_tasks_per_child,
+                           thumbnail_index and thumbnail_index.checksum_algorithm or None) as pool:
+            for task, error, checksum in pool.run(queued_tasks()):
+                if error:
+                    logger.warning("Error generating thumbnails of %s: %s" % (task[0], error))
+                    thumbnail_index and thumbnail_index.discard(task[0])
+                else:
+                    if thumbnail_index:
+                        thumbnail_index.store(*task[:4], checksum=checksum)
+                    count += 1
+    finally:
+        stopped.set()
+        walker.join()
+
+    return count
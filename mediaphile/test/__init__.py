@@ -114,6 +114,19 @@ class PhotosWithMetadata(BaseTest):
                 self.assertEqual(str(data['Image Model']), self.expected_model)
 
 
+    def test_fast_metadata(self):
+        """
+        This test ensures that the fast metadata mode finds the same date, make and model as reading all metadata.
+        """
+        self.generate_test_data()
+
+        for complete_filename in self.files:
+            data = get_metadata(complete_filename)
+            fast_data = get_metadata(complete_filename, fast=True)
+            for tag in ('EXIF Date', 'Image Make', 'Image Model'):
+                self.assertEqual(str(fast_data.get(tag)), str(data.get(tag)))
+
+
 class PhotosWithoutMetadata(BaseTest):
     """
     This base class provides tests common for photos without metadata like EXIF, IPTC and XMP.
@@ -159,8 +172,8 @@ class PhotosWithGPSMetadata(BaseTest):
         self.generate_test_data()
 
         for complete_filename in self.files:
-            data = get_metadata(complete_filename)
-            self.assertTrue(data)
-            self.assertTrue('GPS GPSAltitude' in data)
-            self.assertTrue('GPS GPSLatitude' in data)
-            self.assertTrue('GPS GPSLongitude' in data)
+            for data in (get_metadata(complete_filename), get_metadata(complete_filename, fast=True)):
+                self.assertTrue(data)
+                self.assertTrue('GPS GPSAltitude' in data)
+                self.assertTrue('GPS GPSLatitude' in data)
+                self.assertTrue('GPS GPSLongitude' in data)
@@ -0,0 +1,288 @@
+import os
+import sys
+import time
+import hashlib
+import shutil
+import resource
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from optparse import OptionParser, OptionGroup
+
+from mediaphile.lib.file_operations import dirwalk, parallel_dirwalk, find_duplicates, get_checksum, \
+    checksum_strategies
+from mediaphile.lib.metadata import get_metadata
+from mediaphile.lib.thumbnails import open_image, create_thumbnails, parse_dimensions
+
+
+def create_synthetic_tree(root, amount, files_per_folder=100, folders_per_level=10, file_size=0):
+    """
+    Creates amount files spread over a nested folder hierarchy in root.
+
+    :param root: the folder to create the tree in.
+    :param amount: number of files to create.
+    :param files_per_folder: number of files in every leaf folder.
+    :param folders_per_level: number of sub folders per folder.
+    :param file_size: size in bytes of every created file.
+    """
+    data = b'\0' * file_size
+    for counter in range(amount):
+        folder_number = counter // files_per_folder
+        parts = []
+        while True:
+            parts.append(str(folder_number % folders_per_level))
+            folder_number //= folders_per_level
+            if not folder_number:
+                break
+
+        folder = os.path.join(root, *parts)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with open(os.path.join(folder, '%s.jpg' % counter), 'wb') as f:
+            f.write(data)
+
+
+def timed(text, func, *args, **kwargs):
+    """
+    Runs func and prints the time it took.
+
+    :returns: the duration in seconds.
+    """
+    start = time.time()
+    result = func(*args, **kwargs)
+    duration = time.time() - start
+    print("    %-50s %8.3fs %s" % (text, duration, result if result is not None else ''))
+    return duration
+
+
+def throughput(text, size, func, *args, **kwargs):
+    """
+    Runs func, processing size bytes, and prints the throughput in MB/s.
+
+    :returns: the duration in seconds.
+    """
+    start = time.time()
+    func(*args, **kwargs)
+    duration = time.time() - start
+    print("    %-50s %8.3fs %8.1f MB/s" % (text, duration, size / max(duration, 1e-9) / 1024 / 1024))
+    return duration
+
+
+def benchmark_scan(amount, workers):
+    """
+    Compares serial and parallel scanning of a synthetic tree.
+    """
+    root = tempfile.mkdtemp()
+    try:
+        print("Creating %s files in %s ..." % (amount, root))
+        create_synthetic_tree(root, amount)
+
+        print("Scanning:")
+        timed("dirwalk", lambda: len(list(dirwalk(root))))
+        timed("dirwalk, with_stat", lambda: len(list(dirwalk(root, with_stat=True))))
+        for worker_count in workers:
+            timed("parallel_dirwalk, %s workers" % worker_count,
+                  lambda: len(list(parallel_dirwalk(root, workers=worker_count))))
+            timed("parallel_dirwalk, %s workers, with_stat" % worker_count,
+                  lambda: len(list(parallel_dirwalk(root, with_stat=True, workers=worker_count))))
+    finally:
+        shutil.rmtree(root)
+
+
+def naive_find_duplicates(source_folder, target_folder):
+    """
+    Compares every pair of files of equal size by their full checksum, like find_duplicates used to do.
+    """
+    source_files = {}
+    for filename, st in dirwalk(source_folder, with_stat=True):
+        source_files.setdefault(st.st_size, []).append(filename)
+
+    result = 0
+    for filename, st in dirwalk(target_folder, with_stat=True):
+        for existing_filename in source_files.get(st.st_size, []):
+            if get_checksum(filename) == get_checksum(existing_filename):
+                result += 1
+
+    return result
+
+
+def create_same_size_files(folder, amount, file_size, prefix):
+    """
+    Creates amount files of file_size bytes with unique content in folder.
+    """
+    os.makedirs(folder)
+    for counter in range(amount):
+        with open(os.path.join(folder, '%s.nef' % counter), 'wb') as f:
+            header = ('%s-%s' % (prefix, counter)).encode('ascii')
+            f.write(header + os.urandom(file_size - len(header)))
+
+
+def benchmark_duplicates(amount, file_size, jobs):
+    """
+    Compares naive pairwise checksums to the staged duplicate detection on many files of equal size.
+    """
+    root = tempfile.mkdtemp()
+    try:
+        source_folder = os.path.join(root, 'source')
+        target_folder = os.path.join(root, 'target')
+        print("Creating 2 x %s files of %s bytes in %s ..." % (amount, file_size, root))
+        create_same_size_files(source_folder, amount, file_size, 'source')
+        create_same_size_files(target_folder, amount, file_size, 'target')
+        # a few real duplicates
+        for counter in range(0, amount, 10):
+            shutil.copy(os.path.join(source_folder, '%s.nef' % counter), os.path.join(target_folder, 'copy%s.nef' % counter))
+
+        print("Finding duplicates:")
+        timed("pairwise full checksums", naive_find_duplicates, source_folder, target_folder)
+        timed("find_duplicates", lambda: len(list(find_duplicates(source_folder, target_folder))))
+        for job_count in jobs:
+            timed("find_duplicates, %s processes" % job_count,
+                  lambda: len(list(find_duplicates(source_folder, target_folder, jobs=job_count))))
+            timed("find_duplicates, %s threads" % job_count,
+                  lambda: len(list(find_duplicates(source_folder, target_folder, jobs=job_count, use_threads=True))))
+    finally:
+        shutil.rmtree(root)
+
+
+def small_reads_checksum(filename):
+    """
+    Calculates the SHA512 checksum reading 4096 bytes at a time, like get_checksum used to do.
+    """
+    result = hashlib.sha512()
+    with open(filename, 'rb') as f:
+        while 1:
+            data = f.read(4096)
+            if not data:
+                break
+            result.update(data)
+    return result.hexdigest()
+
+
+def benchmark_hashing(file_size, algorithms):
+    """
+    Reports the throughput in MB/s of every checksum strategy.
+    """
+    root = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(root, 'movie.mts')
+        print("Creating a file of %s bytes in %s ..." % (file_size, root))
+        with open(filename, 'wb') as f:
+            for counter in range(0, file_size, 1024 * 1024):
+                f.write(os.urandom(min(1024 * 1024, file_size - counter)))
+
+        # read once to get the file into the page cache, so every strategy is measured on equal terms
+        small_reads_checksum(filename)
+
+        print("Hashing:")
+        throughput("4096 byte reads, sha512", file_size, small_reads_checksum, filename)
+        for algorithm in algorithms:
+            for strategy in sorted(checksum_strategies):
+                for buffer_size in (1024 * 1024, 8 * 1024 * 1024):
+                    throughput("%s, %s KB buffer, %s" % (strategy, buffer_size // 1024, algorithm), file_size,
+                               get_checksum, filename, algorithm, strategy, buffer_size)
+    finally:
+        shutil.rmtree(root)
+
+
+def benchmark_metadata(repeat):
+    """
+    Compares reading all metadata to the fast mode on the test images from Nikon, Canon and Panasonic cameras.
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    filenames = []
+    for camera in ('Nikon', 'Canon', 'Panasonic'):
+        filenames.extend(filename for filename in dirwalk(os.path.join(folder, camera))
+                         if os.path.splitext(filename)[-1].lower() in ('.jpg', '.nef', '.cr2', '.rw2'))
+
+    def read_all(**kwargs):
+        for counter in range(repeat):
+            for filename in filenames:
+                get_metadata(filename, **kwargs)
+
+    print("Reading metadata from %s files %s times:" % (len(filenames), repeat))
+    timed("get_metadata, details", read_all, details=True)
+    timed("get_metadata", read_all)
+    timed("get_metadata, fast", read_all, fast=True)
+
+
+def _make_thumbnails(filename, sizes, repeat, reduced, use_embedded_thumbnail):
+    """
+    Makes thumbnails of filename repeat times, run in a process of its own to measure its peak memory usage.
+
+    :returns: a tuple of the duration in seconds, and the peak resident set size in KB before and after.
+    """
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    for counter in range(repeat):
+        with open_image(filename, reduced and sizes or None, use_embedded_thumbnail=use_embedded_thumbnail) as image:
+            for size, thumbnail in create_thumbnails(image, sizes):
+                thumbnail.tobytes()
+    return time.time() - start, rss_before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def benchmark_thumbnails(sizes, repeat):
+    """
+    Compares decoding the full photo to reduced decoding, with and without the embedded thumbnail, when making thumbnails
+    of a photo from a Nikon camera.
+    """
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Nikon', 'DSC_1807.JPG')
+    print("Making thumbnails of %s in %s, %s times:" % (filename, ','.join('%sx%s' % size for size in sizes), repeat))
+    variants = (
+        ("full decode", False, False),
+        ("reduced decode", True, False),
+        ("reduced decode or embedded thumbnail", True, True),
+    )
+    for text, reduced, use_embedded_thumbnail in variants:
+        with ProcessPoolExecutor(1) as pool:
+            duration, rss_before, rss_after = pool.submit(_make_thumbnails, filename, sizes, repeat, reduced,
+                                                            use_embedded_thumbnail).result()
+        print("    %-50s %8.3fs %8.1f MB peak RSS, %8.1f MB more" % (text, duration, rss_after / 1024.0,
+                                                                      (rss_after - rss_before) / 1024.0))
+
+
+benchmarks = {
+    'scan': lambda options: benchmark_scan(options.files, [int(w) for w in options.workers.split(',')]),
+    'duplicates': lambda options: benchmark_duplicates(options.same_size_files, options.file_size,
+                                                         [int(w) for w in options.workers.split(',')]),
+    'hashing': lambda options: benchmark_hashing(options.hash_file_size, options.algorithms.split(',')),
+    'metadata': lambda options: benchmark_metadata(options.repeat),
+    'thumbnails': lambda options: benchmark_thumbnails(parse_dimensions(options.thumbnail_sizes),
+                                                       options.thumbnail_repeat),
+}
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] [benchmark ...]\n\nAvailable benchmarks: " + ', '.join(sorted(benchmarks)))
+    common_group = OptionGroup(parser, "Benchmark parameters")
+    common_group.add_option("--files", dest="files", type="int", default=100000,
+                            help="number of files in the synthetic tree")
+    common_group.add_option("--workers", dest="workers", default="2,4,8",
+                            help="comma separated list of worker or job counts to compare")
+    common_group.add_option("--same-size-files", dest="same_size_files", type="int", default=30,
+                            help="number of files of equal size in both source and target folder")
+    common_group.add_option("--file-size", dest="file_size", type="int", default=4 * 1024 * 1024,
+                            help="size in bytes of the files of equal size")
+    common_group.add_option("--hash-file-size", dest="hash_file_size", type="int", default=512 * 1024 * 1024,
+                            help="size in bytes of the file to hash")
+    common_group.add_option("--algorithms", dest="algorithms", default="sha512,blake2b",
+                            help="comma separated list of checksum algorithms to compare")
+    common_group.add_option("--repeat", dest="repeat", type="int", default=200,
+                            help="number of times to read the metadata of every test image")
+    common_group.add_option("--thumbnail-sizes", dest="thumbnail_sizes", default="400x400",
+                            help="comma separated list of thumbnail dimensions, like 400x400,160x120")
+    common_group.add_option("--thumbnail-repeat", dest="thumbnail_repeat", type="int", default=20,
+                            help="number of times to make the thumbnails of the test image")
+    parser.add_option_group(common_group)
+
+    (options, args) = parser.parse_args()
+    for name in args or sorted(benchmarks):
+        if name not in benchmarks:
+            print("Unknown benchmark %s." % name)
+            sys.exit(1)
+
+        print("\n%s\n" % name)
+        benchmarks[name](options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Emulates the -stay_open protocol of exiftool for the tests in test_exiftool.py. Every readable file gets the same fake
+make, model, date and GPS position.
+"""
+import os
+import sys
+import json
+
+
+def main():
+    if sys.argv[1:] != ['-stay_open', 'True', '-@', '-']:
+        sys.exit("Unexpected arguments: %s" % sys.argv[1:])
+
+    args = []
+    for line in sys.stdin:
+        arg = line.rstrip('\n')
+        if arg == '-execute':
+            entries = [{
+                'SourceFile': filename,
+                'Make': 'Mediaphile',
+                'Model': 'Stub %s' % os.getpid(),
+                'CreateDate': '2016:05:17 10:20:30',
+                'GPSLatitude': 59.91,
+                'GPSLongitude': 10.75,
+                'FileSize': os.stat(filename).st_size
+            } for filename in args if not filename.startswith('-') and os.path.isfile(filename)]
+            if entries:
+                sys.stdout.write(json.dumps(entries, indent=4) + '\n')
+            sys.stdout.write('{ready}\n')
+            sys.stdout.flush()
+            args = []
+        elif args[-1:] == ['-stay_open'] and arg == 'False':
+            break
+        else:
+            args.append(arg)
+
+
+if __name__ == '__main__':
+    main()
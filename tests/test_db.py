@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mediaphile.lib.db import FileIndex
+from mediaphile.lib.file_operations import get_checksum
+from mediaphile.lib.metadata import get_parsed_metadata
+
+
+class FileIndexTests(unittest.TestCase):
+    """
+    Tests the persistent file index.
+    """
+
+    def setUp(self):
+        """
+
+        """
+        self.testing_area = tempfile.mkdtemp()
+        self.source_folder = os.path.join(self.testing_area, 'photos')
+        os.makedirs(os.path.join(self.source_folder, 'Nikon'))
+        self.photo = os.path.join(self.source_folder, 'Nikon', 'DSC_1807.JPG')
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Nikon', 'DSC_1807.JPG'), self.photo)
+        self.text_file = os.path.join(self.source_folder, 'notes.txt')
+        with open(self.text_file, 'w') as f:
+            f.write('foobar')
+
+        self.file_index = FileIndex(os.path.join(self.testing_area, 'mediaphile.db'))
+
+    def tearDown(self):
+        """
+
+        """
+        self.file_index.close()
+        shutil.rmtree(self.testing_area)
+
+    def test_refresh(self):
+        """
+
+        """
+        stats = self.file_index.refresh(self.source_folder, photo_extensions_to_include=['jpg'])
+        self.assertEqual(stats, dict(added=2, updated=0, unchanged=0, removed=0))
+
+        stats = self.file_index.refresh(self.source_folder, photo_extensions_to_include=['jpg'])
+        self.assertEqual(stats, dict(added=0, updated=0, unchanged=2, removed=0))
+
+        with open(self.text_file, 'a') as f:
+            f.write('foobar')
+        stats = self.file_index.refresh(self.source_folder, photo_extensions_to_include=['jpg'])
+        self.assertEqual(stats, dict(added=0, updated=1, unchanged=1, removed=0))
+        self.assertEqual(self.file_index.get_checksum(self.text_file), get_checksum(self.text_file))
+
+        os.unlink(self.text_file)
+        stats = self.file_index.refresh(self.source_folder, photo_extensions_to_include=['jpg'])
+        self.assertEqual(stats, dict(added=0, updated=0, unchanged=1, removed=1))
+
+    def test_lookups(self):
+        """
+
+        """
+        self.file_index.refresh(self.source_folder, photo_extensions_to_include=['jpg'])
+        self.assertEqual(self.file_index.get_checksum(self.photo), get_checksum(self.photo))
+        self.assertEqual(self.file_index.get_date(self.photo), get_parsed_metadata(self.photo)['date'])
+
+        # files unknown to the index are processed and stored on demand
+        other_photo = os.path.join(self.testing_area, 'other.jpg')
+        shutil.copy(self.photo, other_photo)
+        self.assertEqual(self.file_index.get_date(other_photo), get_parsed_metadata(other_photo)['date'])
+        self.assertEqual(self.file_index.get_checksum(other_photo), get_checksum(self.photo))
+
+    def test_checksum_algorithm(self):
+        """
+
+        """
+        self.file_index.refresh(self.source_folder)
+        self.file_index.close()
+
+        # checksums from another algorithm are never returned, but replaced when refreshing
+        self.file_index = FileIndex(os.path.join(self.testing_area, 'mediaphile.db'), checksum_algorithm='blake2b')
+        self.assertEqual(self.file_index.get_checksum(self.text_file), get_checksum(self.text_file, 'blake2b'))
+        stats = self.file_index.refresh(self.source_folder)
+        self.assertEqual(stats, dict(added=0, updated=1, unchanged=1, removed=0))
+        self.assertEqual(self.file_index.get_checksum(self.photo), get_checksum(self.photo, 'blake2b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
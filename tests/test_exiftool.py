@@ -0,0 +1,67 @@
+import os
+import sys
+import datetime
+import unittest
+
+from mediaphile.lib import exiftool
+from mediaphile.lib.exiftool import ExifTool
+from mediaphile.lib.metadata import get_metadata, get_metadata_many, metadata_cache
+
+
+class ExifToolTests(unittest.TestCase):
+    """
+    Tests the exiftool metadata backend using a stub emulating the exiftool protocol.
+    """
+
+    def setUp(self):
+        """
+
+        """
+        folder = os.path.dirname(os.path.abspath(__file__))
+        self.command = [sys.executable, os.path.join(folder, 'exiftool_stub.py')]
+        self.photos = [os.path.join(folder, 'Nikon', 'DSC_1807.JPG'), os.path.join(folder, 'Panasonic', 'P1060413.JPG'),
+                       os.path.join(folder, 'NonCameraSpecific', 'test.jpg')]
+        self.previous_exiftool = exiftool._exiftool
+        exiftool._exiftool = ExifTool(self.command, batch_size=2)
+        metadata_cache.clear()
+
+    def tearDown(self):
+        """
+
+        """
+        exiftool._exiftool.close()
+        exiftool._exiftool = self.previous_exiftool
+        metadata_cache.clear()
+
+    def test_get_tags(self):
+        """
+        This test ensures that files are read in batches by a single process and missing files are left out.
+        """
+        with ExifTool(self.command, batch_size=2) as tool:
+            pid = tool.process.pid
+            result = tool.get_tags(self.photos + ['does_not_exist.jpg'])
+            self.assertEqual(sorted(result), sorted(self.photos))
+            self.assertEqual(result[self.photos[0]]['Image Make'], 'Mediaphile')
+            self.assertEqual(result[self.photos[0]]['Image Model'], 'Stub %s' % pid)
+            self.assertFalse('FileSize' in result[self.photos[0]])
+            self.assertEqual(tool.get_tags(self.photos[:1])[self.photos[0]]['Image Model'], 'Stub %s' % pid)
+
+    def test_get_metadata_many(self):
+        """
+        This test ensures that both backends return metadata in the same format.
+        """
+        result = get_metadata_many(self.photos, backend='exiftool')
+        pid = exiftool._exiftool.process.pid
+        for photo in self.photos:
+            self.assertEqual(result[photo]['EXIF Date'], datetime.datetime(2016, 5, 17, 10, 20, 30))
+            self.assertEqual(result[photo]['GPS GPSLatitude'], 59.91)
+            self.assertTrue('CreationDate' in result[photo])
+
+        self.assertEqual(get_metadata(self.photos[0], backend='exiftool')['Image Model'], 'Stub %s' % pid)
+        self.assertEqual(str(get_metadata_many(self.photos[:1], use_cache=False)[self.photos[0]]['Image Make']),
+                         str(get_metadata(self.photos[0], use_cache=False)['Image Make']))
+        self.assertRaises(ValueError, get_metadata_many, self.photos, backend='unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
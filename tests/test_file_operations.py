@@ -1,12 +1,19 @@
 import os
+import hashlib
 import tempfile
 import unittest
 import time
 import shutil
 import logging
+import errno
+import threading
 log = logging.getLogger("testlogger")
 
-from mediaphile.lib.file_operations import find_duplicates, find_new_files
+from mediaphile.lib import file_operations
+from mediaphile.lib.file_operations import find_duplicates, find_new_files, dirwalk, \
+    parallel_dirwalk, compare_contents, get_checksum, get_checksum_algorithm, \
+    Checksums, generate_valid_target, TargetNameRegistry, DirectoryCache, TransferStatistics, copy_file, \
+    move_file, copy_strategies
 
 
 class FileOperationTests(unittest.TestCase):
@@ -94,4 +101,202 @@ class FileOperationTests(unittest.TestCase):
         # find_new_files
         self.assertEqual(len(list(find_new_files(source_folder, target_folder))), 2)
 
+    def test_dirwalk(self):
+        """
+
+        """
+        file_a = self.create_file('A', 'foobar', 1)
+        file_b = self.create_file(os.path.join('A', 'B', 'C'), 'foobar', 2)
+        file_c = self.create_file('D', 'foobar', 3)
+        self.assertEqual(sorted(dirwalk(self.testing_area)), sorted([file_a, file_b, file_c]))
+        self.assertEqual(list(dirwalk(self.testing_area, extensions_to_include=['jpg'])), [])
+
+        sizes = dict((filename, st.st_size) for filename, st in dirwalk(self.testing_area, with_stat=True))
+        self.assertEqual(sizes, {file_a: 6, file_b: 12, file_c: 18})
+
+        # a walk abandoned halfway must close the directory it is listing
+        listings = []
+
+        def scandir(path):
+            listings.append(os.scandir(path))
+            return listings[-1]
+
+        file_operations.scandir, original_scandir = scandir, file_operations.scandir
+        for amount in range(3):
+            self.create_file('E', 'foobar', amount)
+        try:
+            walk = dirwalk(os.path.join(self.testing_area, 'E'))
+            next(walk)
+            walk.close()
+        finally:
+            file_operations.scandir = original_scandir
+        self.assertRaises(StopIteration, next, listings[-1])
+
+    def test_parallel_dirwalk(self):
+        """
+
+        """
+        files = [self.create_file(os.path.join('A', str(i % 7), str(i % 3)), 'foobar', i + 1) for i in range(50)]
+        self.assertEqual(sorted(parallel_dirwalk(self.testing_area, workers=3, max_pending=2)), sorted(files))
+
+        sizes = dict(parallel_dirwalk(self.testing_area, with_stat=True, workers=3))
+        self.assertEqual(sorted(st.st_size for st in sizes.values()), [6 * (i + 1) for i in range(50)])
+
+    def test_compare_contents(self):
+        """
+
+        """
+        # equal start and end, but different content in the middle, so only a full checksum tells them apart
+        middle_a = self.create_file('A', 'a' * 100 + 'x' + 'a' * 100, 1)
+        middle_b = self.create_file('B', 'a' * 100 + 'y' + 'a' * 100, 1)
+        equal_a = self.create_file('A', 'b' * 201, 1)
+        equal_b = self.create_file('B', 'b' * 201, 1)
+        start_b = self.create_file('B', 'c' + 'b' * 200, 1)
+
+        source_entries = [(f, os.stat(f)) for f in (middle_a, equal_a)]
+        target_entries = [(f, os.stat(f)) for f in (middle_b, equal_b, start_b)]
+        for chunk_size in (10, 1000):
+            duplicates, new_files = compare_contents(source_entries, target_entries, chunk_size=chunk_size)
+            self.assertEqual(duplicates, [(equal_b, equal_a)])
+            self.assertEqual(new_files, [middle_b, start_b])
+
+        for use_threads in (True, False):
+            with Checksums(jobs=2, use_threads=use_threads, chunk_size=10) as checksums:
+                duplicates, new_files = compare_contents(source_entries, target_entries, checksums)
+                self.assertEqual(duplicates, [(equal_b, equal_a)])
+                self.assertEqual(new_files, [middle_b, start_b])
+                self.assertEqual(checksums.full[middle_b], get_checksum(middle_b))
+
+            source_folder, target_folder = os.path.dirname(middle_a), os.path.dirname(middle_b)
+            self.assertEqual(list(find_duplicates(source_folder, target_folder, jobs=2, use_threads=use_threads)),
+                             [equal_b])
+
+    def test_checksum_algorithms(self):
+        """
+
+        """
+        filename = self.create_file('A', 'foobar', 1000)
+        self.assertEqual(get_checksum(filename), hashlib.sha512(b'foobar' * 1000).hexdigest())
+        self.assertEqual(get_checksum(filename, 'blake2b'), hashlib.blake2b(b'foobar' * 1000).hexdigest())
+        self.assertTrue(get_checksum_algorithm('xxh3_64') in ('xxh3_64', 'blake2b'))
+        self.assertRaises(ValueError, get_checksum_algorithm, 'foobar')
+
+        expected = hashlib.sha512(b'foobar' * 1000).hexdigest()
+        empty = hashlib.sha512(b'').hexdigest()
+        empty_filename = self.create_file('A', '', 0)
+        for strategy in ('readinto', 'mmap'):
+            self.assertEqual(get_checksum(filename, strategy=strategy, buffer_size=1000), expected)
+            self.assertEqual(get_checksum(empty_filename, strategy=strategy), empty)
+
+    def test_find_new_files_yields_once(self):
+        """
+
+        """
+        for counter in range(5):
+            self.create_file('A', 'foobar', 1)
+        source_folder = os.path.dirname(self.create_file('A', 'barfoo', 1))
+        new_file = self.create_file('B', 'foobaz', 1)
+        target_folder = os.path.dirname(self.create_file('B', 'barfoo', 1))
+        self.create_file('B', 'foobar', 1)
+
+        # every new file is yielded once, no matter how many source files of the same size it differs from
+        self.assertEqual(list(find_new_files(source_folder, target_folder)), [new_file])
+
+    def test_target_name_registry(self):
+        """
+
+        """
+        folder = os.path.join(self.testing_area, 'C')
+        os.makedirs(folder)
+        for name in ('a.jpg', 'a~1.jpg'):
+            open(os.path.join(folder, name), 'w').close()
+
+        filename = os.path.join(folder, 'a.jpg')
+        self.assertEqual(generate_valid_target(filename), os.path.join(folder, 'a~2.jpg'))
+
+        registry = TargetNameRegistry()
+        self.assertEqual(generate_valid_target(filename, registry=registry), os.path.join(folder, 'a~2.jpg'))
+        self.assertEqual(registry.reserve(filename), os.path.join(folder, 'a~3.jpg'))
+        self.assertEqual(registry.reserve(os.path.join(folder, 'b.jpg')), os.path.join(folder, 'b.jpg'))
+        self.assertTrue(registry.exists(os.path.join(folder, 'b.jpg')))
+        self.assertEqual(registry.reserve(os.path.join(folder, 'new', 'a.jpg')), os.path.join(folder, 'new', 'a.jpg'))
+
+        # threads sharing a registry never get the same name
+        names = []
+
+        def reserve():
+            for counter in range(50):
+                names.append(registry.reserve(os.path.join(folder, 'c.jpg')))
+
+        threads = [threading.Thread(target=reserve) for counter in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(names)), 400)
+
+    def test_directory_cache(self):
+        """
+
+        """
+        directories = DirectoryCache()
+        folder = os.path.join(self.testing_area, '2016', 'May', '17')
+        directories.makedirs_many([folder, os.path.join(self.testing_area, '2016', 'May', '18'), folder])
+        self.assertTrue(os.path.isdir(folder))
+        self.assertTrue(os.path.isdir(os.path.join(self.testing_area, '2016', 'May', '18')))
+        self.assertTrue(os.path.join(self.testing_area, '2016') in directories.folders)
+
+        # known folders are neither checked nor created again
+        os.rmdir(folder)
+        directories.makedirs(folder)
+        self.assertFalse(os.path.exists(folder))
+        directories.makedirs(os.path.join(folder, 'tag'))
+        self.assertTrue(os.path.isdir(os.path.join(folder, 'tag')))
+
+    def test_transfer_file(self):
+        """
+
+        """
+        source = self.create_file('A', 'foobar' * 100000, 1)
+        os.chmod(source, 0o640)
+        expected = get_checksum(source)
+        statistics = TransferStatistics()
+
+        target = os.path.join(self.testing_area, 'copy.jpg')
+        copy_file(source, target, statistics)
+        self.assertEqual(get_checksum(target), expected)
+        self.assertEqual(os.stat(target).st_mode & 0o777, 0o640)
+
+        # unsupported strategies are skipped and the next one is used
+        def unsupported(src, dst, size):
+            dst.write(b'garbage')
+            raise OSError(errno.EOPNOTSUPP, 'Operation not supported')
+
+        original_strategies = list(copy_strategies)
+        copy_strategies[:] = [('unsupported', unsupported)] + original_strategies[-1:]
+        try:
+            copy_file(source, os.path.join(self.testing_area, 'copy2.jpg'), statistics)
+        finally:
+            copy_strategies[:] = original_strategies
+        self.assertEqual(get_checksum(os.path.join(self.testing_area, 'copy2.jpg')), expected)
+        self.assertEqual(statistics.strategies['read_write'][:2], (1, 600000))
+
+        # a strategy stopping before the end of the file, like a syscall returning 0, is not recorded as a success
+        def incomplete(src, dst, size):
+            dst.write(src.read(1000))
+            return 1000
+
+        copy_strategies[:] = [('incomplete', incomplete)] + original_strategies[-1:]
+        try:
+            copy_file(source, os.path.join(self.testing_area, 'copy3.jpg'), statistics)
+        finally:
+            copy_strategies[:] = original_strategies
+        self.assertEqual(get_checksum(os.path.join(self.testing_area, 'copy3.jpg')), expected)
+        self.assertNotIn('incomplete', statistics.strategies)
+        self.assertEqual(statistics.strategies['read_write'][:2], (2, 1200000))
 
+        moved = os.path.join(self.testing_area, 'moved.jpg')
+        move_file(target, moved, statistics)
+        self.assertFalse(os.path.exists(target))
+        self.assertEqual(get_checksum(moved), expected)
+        self.assertEqual(statistics.strategies['rename'][:2], (1, 600000))
@@ -0,0 +1,359 @@
+import os
+import time
+import asyncio
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+
+from mediaphile.lib import folderwatcher
+from mediaphile.lib.file_operations import dirwalk
+from mediaphile.lib.folderwatcher import Debouncer, Ingester, FolderWatcher, AsyncFolderWatcher, HighWaterMark
+
+Event = namedtuple('Event', 'pathname dir')
+MaskedEvent = namedtuple('MaskedEvent', 'pathname dir mask')
+
+
+class Clock:
+    """
+    A clock only moving when told to.
+    """
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeInotify:
+    """
+    Stands in for pyinotify while used as a context manager, serving as the module, the watch manager and the notifier.
+    Events given to send are delivered through a pipe, like inotify does.
+    """
+    IN_CLOSE_WRITE = 0x08
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    IN_ISDIR = 0x40000000
+
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.batches = []
+        self.watches = []
+        self.proc_fun = None
+        self.loop = None
+        self.stopped = False
+        self.saved = {}
+
+    def __enter__(self):
+        replacements = dict(pyinotify=self, PYINOTIFY_SUPPORT=True,
+                            mask=self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE,
+                            create_mask=self.IN_CREATE, overflow_mask=self.IN_Q_OVERFLOW)
+        for name, value in replacements.items():
+            self.saved[name] = getattr(folderwatcher, name, None)
+            setattr(folderwatcher, name, value)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for name, value in self.saved.items():
+            setattr(folderwatcher, name, value)
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def WatchManager(self):
+        return self
+
+    def Notifier(self, watch_manager, default_proc_fun):
+        self.proc_fun = default_proc_fun
+        return self
+
+    def AsyncioNotifier(self, watch_manager, loop, default_proc_fun):
+        self.proc_fun = default_proc_fun
+        self.loop = loop
+        loop.add_reader(self.read_fd, self.handle_read)
+        return self
+
+    def add_watch(self, path, mask, rec=False, auto_add=False):
+        self.watches.append((path, mask))
+
+    def get_fd(self):
+        return self.read_fd
+
+    def send(self, *events):
+        self.batches.append(events)
+        os.write(self.write_fd, b'x')
+
+    def check_events(self, timeout=None):
+        # interrupts FolderWatcher.run once every event is handled
+        if not self.batches:
+            raise KeyboardInterrupt()
+        return True
+
+    def read_events(self):
+        os.read(self.read_fd, 1)
+
+    def process_events(self):
+        for event in self.batches.pop(0):
+            self.proc_fun(event)
+
+    def handle_read(self):
+        self.read_events()
+        self.process_events()
+
+    def stop(self):
+        if self.loop:
+            self.loop.remove_reader(self.read_fd)
+        self.stopped = True
+
+
+class FolderWatcherTests(unittest.TestCase):
+    """
+    Tests relocating files as they arrive in a watched folder.
+    """
+
+    def setUp(self):
+        """
+
+        """
+        self.testing_area = tempfile.mkdtemp()
+        self.source_folder = os.path.join(self.testing_area, 'source')
+        self.target_folder = os.path.join(self.testing_area, 'target')
+        os.makedirs(self.source_folder)
+
+    def tearDown(self):
+        """
+
+        """
+        shutil.rmtree(self.testing_area)
+
+    def test_debouncer(self):
+        """
+        This test ensures that files are only ready when unchanged for the settle period.
+        """
+        clock = Clock()
+        debouncer = Debouncer(2, clock)
+        filenames = []
+        for counter in range(3):
+            filenames.append(os.path.join(self.source_folder, '%s.jpg' % counter))
+            with open(filenames[-1], 'wb') as f:
+                f.write(b'data')
+            debouncer.add(filenames[-1])
+
+        debouncer.add(os.path.join(self.source_folder, 'missing.jpg'))
+        self.assertEqual(len(debouncer), 3)
+        self.assertEqual(debouncer.ready(), [])
+        self.assertEqual(debouncer.next_timeout(), 2)
+
+        clock.now = 1
+        debouncer.add(filenames[0])
+        with open(filenames[1], 'ab') as f:
+            f.write(b'more data')
+        os.remove(filenames[2])
+
+        clock.now = 2.5
+        self.assertEqual(debouncer.ready(), [])
+        self.assertEqual(len(debouncer), 2)
+
+        clock.now = 3
+        self.assertEqual(debouncer.ready(), [filenames[0]])
+        clock.now = 4.5
+        self.assertEqual(debouncer.ready(), [filenames[1]])
+        self.assertIsNone(debouncer.next_timeout())
+
+    def test_folder_watcher(self):
+        """
+        This test ensures that photos written or moved into the watched folder are relocated in batches.
+        """
+        folder = os.path.dirname(os.path.abspath(__file__))
+        with Ingester(self.source_folder, self.target_folder, jobs=2, photo_extensions_to_include=['jpg']) as ingester:
+            watcher = FolderWatcher(self.source_folder, ingester, settle_seconds=0, batch_size=1)
+            photo = os.path.join(self.source_folder, 'DSC_1807.JPG')
+            shutil.copy(os.path.join(folder, 'Nikon', 'DSC_1807.JPG'), photo)
+            watcher(Event(photo, False))
+            shutil.copytree(os.path.join(folder, 'Panasonic'), os.path.join(self.source_folder, 'Panasonic'))
+            watcher(Event(os.path.join(self.source_folder, 'Panasonic'), True))
+            watcher(Event(os.path.join(self.source_folder, 'notes.txt'), False))
+
+            self.assertEqual(watcher.process_ready(), 1)
+            self.assertEqual(watcher.process_ready(), 1)
+            self.assertEqual(watcher.process_ready(), 0)
+
+        self.assertEqual(len(list(dirwalk(self.target_folder))), 2)
+        self.assertEqual([filename for filename in dirwalk(self.source_folder) if filename.endswith('.JPG')], [])
+
+    def test_created_files(self):
+        """
+        This test ensures that a file is only queued when it's closed after writing, not when it's created.
+        """
+        with FakeInotify() as inotify, \
+                Ingester(self.source_folder, self.target_folder, photo_extensions_to_include=['jpg']) as ingester:
+            watcher = FolderWatcher(self.source_folder, ingester, settle_seconds=0)
+            photo = os.path.join(self.source_folder, 'DSC_1807.JPG')
+            with open(photo, 'wb') as f:
+                f.write(b'partial')
+            watcher(MaskedEvent(photo, False, inotify.IN_CREATE))
+            self.assertEqual(len(watcher.debouncer), 0)
+
+            watcher(MaskedEvent(photo, False, inotify.IN_CLOSE_WRITE))
+            self.assertEqual(len(watcher.debouncer), 1)
+
+    def test_run(self):
+        """
+        This test ensures that the watcher relocates the photos it gets events for, the photos in new folders, and after
+        the kernel dropped events, the photos it hasn't handled yet.
+        """
+        folder = os.path.dirname(os.path.abspath(__file__))
+        photo = os.path.join(self.source_folder, 'DSC_1807.JPG')
+        missed_photo = os.path.join(self.source_folder, 'P1060413.JPG')
+        new_folder = os.path.join(self.source_folder, 'Panasonic')
+        with FakeInotify() as inotify, \
+                Ingester(self.source_folder, self.target_folder, photo_extensions_to_include=['jpg']) as ingester:
+            watcher = FolderWatcher(self.source_folder, ingester, settle_seconds=0)
+            shutil.copy(os.path.join(folder, 'Nikon', 'DSC_1807.JPG'), photo)
+            shutil.copytree(os.path.join(folder, 'Panasonic'), new_folder)
+            shutil.copy(os.path.join(folder, 'Panasonic', 'P1060413.JPG'), missed_photo)
+            inotify.send(MaskedEvent(photo, False, inotify.IN_CREATE),
+                         MaskedEvent(new_folder, True, inotify.IN_CREATE | inotify.IN_ISDIR))
+            self.assertRaises(KeyboardInterrupt, watcher.run)
+            self.assertTrue(os.path.exists(photo))
+            self.assertFalse(os.path.exists(os.path.join(new_folder, 'P1060413.JPG')))
+
+            inotify.send(MaskedEvent(photo, False, inotify.IN_CLOSE_WRITE))
+            inotify.send(MaskedEvent(None, False, inotify.IN_Q_OVERFLOW))
+            self.assertRaises(KeyboardInterrupt, watcher.run)
+
+        self.assertEqual(inotify.watches, [(self.source_folder, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO |
+                                            inotify.IN_CREATE)] * 2)
+        self.assertTrue(inotify.stopped)
+        self.assertEqual([filename for filename in dirwalk(self.source_folder) if filename.endswith('.JPG')], [])
+        self.assertEqual(len(list(dirwalk(self.target_folder))), 3)
+
+    def test_rescan(self):
+        """
+        This test ensures that a rescan, after the kernel dropped events, only queues the photos not yet handled, so
+        copied photos aren't copied again.
+        """
+        folder = os.path.dirname(os.path.abspath(__file__))
+        existing_photo = os.path.join(self.source_folder, 'existing.JPG')
+        shutil.copy(os.path.join(folder, 'Nikon', 'DSC_1807.JPG'), existing_photo)
+        os.utime(existing_photo)
+        time.sleep(0.01)
+
+        with Ingester(self.source_folder, self.target_folder, remove_source=False,
+                      photo_extensions_to_include=['jpg']) as ingester:
+            watcher = FolderWatcher(self.source_folder, ingester, settle_seconds=0)
+            photo = os.path.join(self.source_folder, 'DSC_1807.JPG')
+            shutil.copy(os.path.join(folder, 'Nikon', 'DSC_1807.JPG'), photo)
+            watcher(Event(photo, False))
+            while watcher.process_ready():
+                pass
+
+            self.assertEqual(watcher.rescan(), 0)
+            shutil.copy(os.path.join(folder, 'Panasonic', 'P1060413.JPG'), self.source_folder)
+            self.assertEqual(watcher.rescan(), 1)
+            while watcher.process_ready():
+                pass
+
+        self.assertEqual(len(list(dirwalk(self.target_folder))), 2)
+
+    def test_async_folder_watcher(self):
+        """
+        This test ensures that photos are relocated through the bounded queues of the asyncio watcher.
+        """
+        folder = os.path.dirname(os.path.abspath(__file__))
+        for counter in range(5):
+            shutil.copytree(os.path.join(folder, 'Panasonic'), os.path.join(self.source_folder, str(counter)))
+
+        with Ingester(self.source_folder, self.target_folder, jobs=2, photo_extensions_to_include=['jpg']) as ingester:
+            watcher = AsyncFolderWatcher(self.source_folder, ingester, settle_seconds=0.05, queue_size=2,
+                                         metadata_jobs=2, batch_size=3)
+            watcher(Event(self.source_folder, True))
+            asyncio.run(watcher.process(until_idle=True))
+
+            self.assertEqual(len(list(dirwalk(self.target_folder))), 5)
+
+            # every run has an event loop of its own
+            shutil.copytree(os.path.join(folder, 'Panasonic'), os.path.join(self.source_folder, '5'))
+            watcher(Event(os.path.join(self.source_folder, '5'), True))
+            asyncio.run(watcher.process(until_idle=True))
+
+        self.assertEqual(len(list(dirwalk(self.target_folder))), 6)
+        self.assertEqual(watcher.statistics.placed, 6)
+        self.assertLessEqual(watcher.statistics.max_queue_depths['metadata'], 2)
+
+    def test_watch(self):
+        """
+        This test ensures that the asyncio watcher stops reading events while too many files are pending and resumes
+        once they are handled, rescans the folder after the kernel dropped events and stops the notifier when
+        cancelled.
+        """
+        photo = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Nikon', 'DSC_1807.JPG')
+
+        def copy_photo(name):
+            filename = os.path.join(self.source_folder, name)
+            shutil.copy(photo, filename)
+            return MaskedEvent(filename, False, inotify.IN_CLOSE_WRITE)
+
+        async def wait_until(condition):
+            for counter in range(500):
+                if condition():
+                    return
+                await asyncio.sleep(0.01)
+            self.fail("timed out")
+
+        async def watch():
+            task = asyncio.ensure_future(watcher.watch())
+            await wait_until(lambda: inotify.loop)
+
+            inotify.send(*[copy_photo('%s.jpg' % counter) for counter in range(3)])
+            await wait_until(lambda: watcher.paused)
+            inotify.send(copy_photo('3.jpg'))
+            await asyncio.sleep(0.05)
+            self.assertEqual(len(inotify.batches), 1)
+
+            await wait_until(lambda: not watcher.paused and not inotify.batches)
+            copy_photo('4.jpg')
+            inotify.send(MaskedEvent(None, False, inotify.IN_Q_OVERFLOW))
+            await wait_until(lambda: not list(dirwalk(self.source_folder)))
+
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        with FakeInotify() as inotify, \
+                Ingester(self.source_folder, self.target_folder, photo_extensions_to_include=['jpg']) as ingester:
+            watcher = AsyncFolderWatcher(self.source_folder, ingester, settle_seconds=0.2, max_pending=2)
+            asyncio.run(watch())
+
+        self.assertTrue(inotify.stopped)
+        self.assertIsNone(watcher.notifier)
+        self.assertEqual(len(list(dirwalk(self.target_folder))), 5)
+
+    def test_reconcile(self):
+        """
+        This test ensures that a restarted watcher relocates the photos that arrived while it was down, and only those.
+        """
+        folder = os.path.dirname(os.path.abspath(__file__))
+        state_filename = os.path.join(self.testing_area, 'watcher.state')
+
+        def start_watcher():
+            with Ingester(self.source_folder, self.target_folder, remove_source=False,
+                          photo_extensions_to_include=['jpg']) as ingester:
+                watcher = FolderWatcher(self.source_folder, ingester, settle_seconds=0,
+                                        high_water_mark=HighWaterMark(state_filename))
+                count = watcher.reconcile()
+                while watcher.process_ready():
+                    pass
+                watcher.high_water_mark.save(force=True)
+            return count
+
+        shutil.copy(os.path.join(folder, 'Nikon', 'DSC_1807.JPG'), self.source_folder)
+        self.assertEqual(start_watcher(), 1)
+        self.assertEqual(start_watcher(), 0)
+
+        shutil.copy(os.path.join(folder, 'Panasonic', 'P1060413.JPG'), self.source_folder)
+        self.assertEqual(start_watcher(), 1)
+        self.assertEqual(start_watcher(), 0)
+        self.assertEqual(len(list(dirwalk(self.target_folder))), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mediaphile.lib import file_operations
+from mediaphile.lib.file_operations import dirwalk, find_duplicates
+from mediaphile.lib.journal import Journal
+from mediaphile.lib.photos import relocate_photos
+
+
+class JournalTests(unittest.TestCase):
+    """
+    Tests recording completed operations in a journal and resuming from it.
+    """
+
+    def setUp(self):
+        """
+
+        """
+        self.testing_area = tempfile.mkdtemp()
+        self.journal_filename = os.path.join(self.testing_area, 'test.journal')
+
+    def tearDown(self):
+        """
+
+        """
+        shutil.rmtree(self.testing_area)
+
+    def create_file(self, filename, data):
+        filename = os.path.join(self.testing_area, filename)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+
+    def test_journal(self):
+        """
+        This test ensures that completed operations are read back when resuming, ignoring a partially written entry and
+        changed files.
+        """
+        unchanged = self.create_file('a.jpg', b'a')
+        changed = self.create_file('b.jpg', b'b')
+        with Journal(self.journal_filename, sync_interval=1) as journal:
+            journal.record('relocate', unchanged, 'target/a.jpg', os.stat(unchanged))
+            journal.record('relocate', changed, 'target/b.jpg', os.stat(changed))
+
+        with open(self.journal_filename, 'a') as f:
+            f.write('{"operation": "relocate", "sou')
+        self.create_file('b.jpg', b'changed')
+
+        with Journal(self.journal_filename, resume=True) as journal:
+            self.assertEqual(journal.is_completed('relocate', unchanged, os.stat(unchanged))['target'], 'target/a.jpg')
+            self.assertIsNone(journal.is_completed('relocate', changed, os.stat(changed)))
+            self.assertIsNone(journal.is_completed('compare', unchanged))
+
+        with Journal(self.journal_filename) as journal:
+            self.assertIsNone(journal.is_completed('relocate', unchanged))
+
+    def test_resume_relocate_photos(self):
+        """
+        This test ensures that photos copied by an interrupted run are not copied again when resuming.
+        """
+        source_folder = os.path.join(self.testing_area, 'source')
+        target_folder = os.path.join(self.testing_area, 'target')
+        folder = os.path.dirname(os.path.abspath(__file__))
+        os.makedirs(source_folder)
+        shutil.copy(os.path.join(folder, 'Nikon', 'DSC_1807.JPG'), source_folder)
+        with Journal(self.journal_filename) as journal:
+            relocate_photos(source_folder, target_folder, remove_source=False, photo_extensions_to_include=['jpg'],
+                            journal=journal)
+
+        shutil.copy(os.path.join(folder, 'Panasonic', 'P1060413.JPG'), source_folder)
+        with Journal(self.journal_filename, resume=True) as journal:
+            relocate_photos(source_folder, target_folder, remove_source=False, photo_extensions_to_include=['jpg'],
+                            journal=journal)
+
+        self.assertEqual(len(list(dirwalk(target_folder))), 2)
+
+    def test_resume_find_duplicates(self):
+        """
+        This test ensures that files compared by an interrupted run are not hashed again when resuming.
+        """
+        data = b'0123456789' * 100
+        self.create_file(os.path.join('source', 'original.jpg'), data)
+        self.create_file(os.path.join('source', 'other.jpg'), b'x' * len(data))
+        duplicate = self.create_file(os.path.join('target', 'duplicate.jpg'), data)
+        self.create_file(os.path.join('target', 'new.jpg'), b'y' * len(data))
+        source_folder = os.path.join(self.testing_area, 'source')
+        target_folder = os.path.join(self.testing_area, 'target')
+
+        with Journal(self.journal_filename) as journal:
+            self.assertEqual(list(find_duplicates(source_folder, target_folder, journal=journal)), [duplicate])
+
+        def get_partial_checksum(*args, **kwargs):
+            raise AssertionError("No file should be hashed when resuming")
+
+        original = file_operations.get_partial_checksum
+        file_operations.get_partial_checksum = get_partial_checksum
+        try:
+            with Journal(self.journal_filename, resume=True) as journal:
+                self.assertEqual(list(find_duplicates(source_folder, target_folder, journal=journal)), [duplicate])
+        finally:
+            file_operations.get_partial_checksum = original
+
+
+if __name__ == '__main__':
+    unittest.main()
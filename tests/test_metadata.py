@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mediaphile.lib.metadata import get_metadata, get_parsed_metadata, metadata_cache, MetadataCache
+
+
+class MetadataCacheTests(unittest.TestCase):
+    """
+    Tests memoization of metadata.
+    """
+
+    def setUp(self):
+        """
+
+        """
+        self.testing_area = tempfile.mkdtemp()
+        self.photo = os.path.join(self.testing_area, 'DSC_1807.JPG')
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Nikon', 'DSC_1807.JPG'), self.photo)
+        metadata_cache.clear()
+
+    def tearDown(self):
+        """
+
+        """
+        metadata_cache.clear()
+        shutil.rmtree(self.testing_area)
+
+    def test_parsed_once(self):
+        """
+        This test ensures that the metadata of a file is read once, unless more metadata is asked for or the file changes.
+        """
+        data = get_metadata(self.photo, fast=True)
+        self.assertEqual(get_parsed_metadata(self.photo)['date'], data['EXIF Date'])
+        self.assertEqual((metadata_cache.hits, metadata_cache.misses), (1, 1))
+
+        # the cached metadata was read in fast mode, so asking for all of it is a miss while a second request isn't
+        get_metadata(self.photo)
+        get_metadata(self.photo, fast=True)
+        get_metadata(self.photo)
+        self.assertEqual((metadata_cache.hits, metadata_cache.misses), (3, 2))
+
+        data['Image Make'] = 'Changed'
+        self.assertNotEqual(get_metadata(self.photo)['Image Make'], 'Changed')
+
+        st = os.stat(self.photo)
+        os.utime(self.photo, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+        get_metadata(self.photo)
+        self.assertEqual(metadata_cache.stats()['misses'], 3)
+        self.assertEqual(metadata_cache.stats()['entries'], 1)
+
+    def test_eviction(self):
+        """
+        This test ensures that the cache never holds more than max_entries.
+        """
+        cache = MetadataCache(max_entries=2)
+        for counter in range(3):
+            cache.put(('photo%s.jpg' % counter, 0, 0), 0, {'counter': counter})
+
+        self.assertEqual(cache.get(('photo0.jpg', 0, 0)), None)
+        self.assertEqual(cache.get(('photo2.jpg', 0, 0), 0), {'counter': 2})
+        self.assertEqual(cache.stats(), dict(hits=1, misses=1, evictions=1, entries=2, hit_rate=50.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
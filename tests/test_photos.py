@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mediaphile.lib.file_operations import dirwalk
+from mediaphile.lib.photos import relocate_photos, _get_batches
+
+
+class RelocatePhotosTests(unittest.TestCase):
+    """
+    Tests relocation of photos into a date-based hierarchy.
+    """
+
+    def setUp(self):
+        """
+
+        """
+        self.testing_area = tempfile.mkdtemp()
+        self.source_folder = os.path.join(self.testing_area, 'source')
+        folder = os.path.dirname(os.path.abspath(__file__))
+        # several copies of the same photos end up with the same target filename
+        for counter in range(5):
+            os.makedirs(os.path.join(self.source_folder, str(counter)))
+            for photo in (os.path.join('Nikon', 'DSC_1807.JPG'), os.path.join('Panasonic', 'P1060413.JPG')):
+                shutil.copy(os.path.join(folder, photo), os.path.join(self.source_folder, str(counter)))
+
+    def tearDown(self):
+        """
+
+        """
+        shutil.rmtree(self.testing_area)
+
+    def relocate(self, target_folder, **kwargs):
+        relocate_photos(self.source_folder, target_folder, remove_source=False, photo_extensions_to_include=['jpg'],
+                        **kwargs)
+        return sorted(os.path.relpath(filename, target_folder) for filename in dirwalk(target_folder))
+
+    def test_relocate_photos_concurrently(self):
+        """
+        This test ensures that relocating photos using several jobs gives the same result as relocating them one by one.
+        """
+        expected = self.relocate(os.path.join(self.testing_area, 'serial'))
+        self.assertEqual(len(expected), 10)
+        self.assertEqual(self.relocate(os.path.join(self.testing_area, 'concurrent'), jobs=2), expected)
+        self.assertEqual(self.relocate(os.path.join(self.testing_area, 'batches'), jobs=3, skip_existing=True),
+                         self.relocate(os.path.join(self.testing_area, 'skipped'), skip_existing=True))
+
+    def test_batches(self):
+        """
+        This test ensures that without a batch size every folder is a single batch, however many files it holds.
+        """
+        photos = {'/a': ['1.jpg', '2.jpg'], '/b': ['1.jpg', '2.jpg', '3.jpg', '4.jpg', '5.jpg']}
+
+        def batches(batch_size):
+            return [(path, len(filenames)) for path, filenames, tag in _get_batches(photos, '/', None, False,
+                                                                                   batch_size)]
+
+        self.assertEqual(batches(None), [('/a', 2), ('/b', 5)])
+        self.assertEqual(batches(2), [('/a', 2), ('/b', 2), ('/b', 2), ('/b', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
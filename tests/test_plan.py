@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mediaphile.lib.file_operations import dirwalk, move_file
+from mediaphile.lib.photos import relocate_photos
+from mediaphile.lib.plan import read_plan, write_plan, apply_plan, MSGPACK_SUPPORT
+
+
+class PlanTests(unittest.TestCase):
+    """
+    Tests planning relocation of photos and applying plans.
+    """
+
+    def setUp(self):
+        """
+
+        """
+        self.testing_area = tempfile.mkdtemp()
+        self.source_folder = os.path.join(self.testing_area, 'source')
+        self.target_folder = os.path.join(self.testing_area, 'target')
+        self.plan_filename = os.path.join(self.testing_area, 'plan.jsonl')
+        folder = os.path.dirname(os.path.abspath(__file__))
+        for counter in range(3):
+            os.makedirs(os.path.join(self.source_folder, str(counter)))
+            for photo in (os.path.join('Nikon', 'DSC_1807.JPG'), os.path.join('Panasonic', 'P1060413.JPG')):
+                shutil.copy(os.path.join(folder, photo), os.path.join(self.source_folder, str(counter)))
+
+    def tearDown(self):
+        """
+
+        """
+        shutil.rmtree(self.testing_area)
+
+    def plan(self, **kwargs):
+        relocate_photos(self.source_folder, self.target_folder, remove_source=True, photo_extensions_to_include=['jpg'],
+                        plan_filename=self.plan_filename, **kwargs)
+        header, entries = read_plan(self.plan_filename)
+        return header, list(entries)
+
+    def test_plan_and_apply(self):
+        """
+        This test ensures that photos are only relocated when the plan is applied, and only once.
+        """
+        relocate_photos(self.source_folder, self.target_folder, remove_source=True, photo_extensions_to_include=['jpg'],
+                        dry_run=True)
+        self.assertFalse(os.path.exists(self.target_folder))
+
+        header, entries = self.plan(checksum_algorithm='sha512')
+        self.assertTrue(header['remove_source'])
+        self.assertEqual(len(entries), 6)
+        self.assertEqual(len(set(entry['target'] for entry in entries)), 6)
+        self.assertTrue(all(entry['digest'] and entry['size'] and entry['date'] for entry in entries))
+        self.assertFalse(os.path.exists(self.target_folder))
+
+        self.assertEqual(apply_plan(self.plan_filename, jobs=2), dict(completed=6, previously_completed=0))
+        self.assertEqual(sorted(dirwalk(self.target_folder)), sorted(entry['target'] for entry in entries))
+        self.assertFalse(os.path.exists(self.source_folder))
+        self.assertEqual(apply_plan(self.plan_filename), dict(completed=0, previously_completed=6))
+
+    def test_resume(self):
+        """
+        This test ensures that applying a plan continues where a crashed run stopped.
+        """
+        header, entries = self.plan()
+
+        # the first entry was recorded as completed, the second completed but not recorded before the crash
+        for entry in entries[:2]:
+            os.makedirs(os.path.dirname(entry['target']), exist_ok=True)
+            move_file(entry['source'], entry['target'])
+        with open(self.plan_filename + '.done', 'w') as f:
+            f.write('0\n')
+
+        # the third photo has changed since the plan was made
+        with open(entries[2]['source'], 'ab') as f:
+            f.write(b'changed')
+
+        self.assertEqual(apply_plan(self.plan_filename), dict(completed=4, previously_completed=1))
+        self.assertTrue(os.path.exists(entries[2]['source']))
+        self.assertFalse(os.path.exists(entries[2]['target']))
+
+    @unittest.skipUnless(MSGPACK_SUPPORT, "msgpack is not installed")
+    def test_msgpack(self):
+        """
+        This test ensures that plans can be written and read as msgpack.
+        """
+        header, entries = self.plan()
+        filename = os.path.join(self.testing_area, 'plan.msgpack')
+        self.assertEqual(write_plan(filename, entries, header['remove_source']), len(entries))
+        self.assertEqual(list(read_plan(filename)[1]), entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from PIL import Image
+
+from mediaphile.lib.raw import find_previews, read_preview, find_exif_thumbnail
+from mediaphile.lib.thumbnails import open_image, generate_thumbnails
+
+
+def create_jpeg(width, height):
+    data = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 100, 50)).save(data, 'JPEG')
+    return data.getvalue()
+
+
+def create_raw(filename, byte_order, magic, blobs, ifds):
+    """
+    Writes a minimal TIFF-based RAW file: the header, followed by blobs and a chain of IFDs.
+
+    :param blobs: a list of byte strings.
+    :param ifds: a list of IFDs, each a list of (tag, type, count, value) tuples. A value of ('offset', index) is
+        replaced by the offset of blobs[index], and ('ifd', index) by the offset of ifds[index].
+    """
+    offsets = []
+    position = 8
+    for blob in blobs:
+        offsets.append(position)
+        position += len(blob)
+
+    ifd_offsets = []
+    for ifd in ifds:
+        ifd_offsets.append(position)
+        position += 2 + len(ifd) * 12 + 4
+
+    def resolve(value):
+        if isinstance(value, tuple):
+            return value[0] == 'offset' and offsets[value[1]] or ifd_offsets[value[1]]
+        return value
+
+    with open(filename, 'wb') as f:
+        f.write((byte_order == '<' and b'II' or b'MM') + struct.pack(byte_order + 'HI', magic, ifd_offsets[0]))
+        for blob in blobs:
+            f.write(blob)
+        for index, ifd in enumerate(ifds):
+            f.write(struct.pack(byte_order + 'H', len(ifd)))
+            for tag, field_type, count, value in ifd:
+                if field_type == 3:
+                    f.write(struct.pack(byte_order + 'HHIHH', tag, field_type, count, resolve(value), 0))
+                else:
+                    f.write(struct.pack(byte_order + 'HHII', tag, field_type, count, resolve(value)))
+            f.write(struct.pack(byte_order + 'I', index + 1 < len(ifds) and ifd_offsets[index + 1] or 0))
+
+
+class RawTests(unittest.TestCase):
+    """
+    Tests reading the JPEG previews embedded in RAW files.
+    """
+
+    def setUp(self):
+        """
+
+        """
+        self.testing_area = tempfile.mkdtemp()
+        self.preview = create_jpeg(600, 400)
+        self.thumbnail = create_jpeg(160, 120)
+
+    def tearDown(self):
+        """
+
+        """
+        shutil.rmtree(self.testing_area)
+
+    def test_nef(self):
+        """
+        This test ensures that the largest preview is found in the sub IFDs of a NEF, and rotated according to the
+        orientation of the RAW file.
+        """
+        filename = os.path.join(self.testing_area, 'DSC_0001.NEF')
+        create_raw(filename, '>', 42, [self.thumbnail, self.preview, b'\0' * 64], [
+            [(0x0112, 3, 1, 6), (0x014a, 4, 1, ('ifd', 2))],
+            [(0x0201, 4, 1, ('offset', 0)), (0x0202, 4, 1, len(self.thumbnail))],
+            [(0x0103, 3, 1, 34713), (0x0111, 4, 1, ('offset', 2)), (0x0117, 4, 1, 64), (0x0201, 4, 1, ('offset', 1)),
+             (0x0202, 4, 1, len(self.preview))],
+        ])
+
+        previews, orientation = find_previews(filename)
+        self.assertEqual([preview[2:] for preview in previews], [(160, 120), (600, 400)])
+        self.assertEqual(orientation, 6)
+        self.assertEqual(read_preview(filename), (self.preview, 6))
+        self.assertEqual(open_image(filename).size, (400, 600))
+
+        result = generate_thumbnails(filename, self.testing_area, [(200, 200)])
+        self.assertEqual(os.path.basename(result[(200, 200)]), 'DSC_0001_200x200.NEF.jpg')
+        with Image.open(result[(200, 200)]) as image:
+            self.assertEqual(image.size, (133, 200))
+
+    def test_cr2(self):
+        """
+        This test ensures that the JPEG strip of a CR2 is found, and that the lossless JPEG holding the raw data is
+        skipped.
+        """
+        lossless = b'\xff\xd8\xff\xc3\x00\x0b\x08' + struct.pack('>HH', 3000, 4000) + b'\0' * 64
+        filename = os.path.join(self.testing_area, 'IMG_0001.CR2')
+        create_raw(filename, '<', 42, [self.preview, lossless], [
+            [(0x0103, 3, 1, 6), (0x0111, 4, 1, ('offset', 0)), (0x0117, 4, 1, len(self.preview))],
+            [(0x0103, 3, 1, 6), (0x0111, 4, 1, ('offset', 1)), (0x0117, 4, 1, len(lossless))],
+        ])
+
+        previews, orientation = find_previews(filename)
+        self.assertEqual([preview[2:] for preview in previews], [(600, 400)])
+        self.assertEqual(orientation, None)
+        self.assertEqual(open_image(filename, [(300, 300)]).size, (300, 200))
+
+    def test_rw2(self):
+        """
+        This test ensures that the JpgFromRaw of a RW2 is found, and that files without a preview are rejected.
+        """
+        filename = os.path.join(self.testing_area, 'P0000001.RW2')
+        create_raw(filename, '<', 0x55, [self.preview], [
+            [(0x002e, 7, len(self.preview), ('offset', 0))],
+        ])
+        self.assertEqual(read_preview(filename), (self.preview, None))
+
+        create_raw(filename, '<', 0x55, [b'\0' * 64], [
+            [(0x0103, 3, 1, 34316), (0x0111, 4, 1, ('offset', 0)), (0x0117, 4, 1, 64)],
+        ])
+        self.assertRaises(ValueError, read_preview, filename)
+
+    def test_exif_thumbnail(self):
+        """
+        This test ensures that the thumbnail in IFD1 of the EXIF-data of a JPEG is found.
+        """
+        with Image.open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Nikon', 'DSC_1807.JPG')) as image:
+            data = image.info['exif']
+        offset, length = find_exif_thumbnail(data)
+        with Image.open(io.BytesIO(data[offset:offset + length])) as thumbnail:
+            self.assertEqual(thumbnail.size, (160, 120))
+        self.assertEqual(find_exif_thumbnail(b'Exif\x00\x00'), None)
@@ -0,0 +1,222 @@
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+from PIL import Image
+
+from mediaphile.lib import thumbnails
+from mediaphile.lib.thumbnails import parse_dimensions, open_image, generate_thumbnails, generate_folder_thumbnails, \
+    ThumbnailIndex, save_thumbnail
+
+
+class ThumbnailTests(unittest.TestCase):
+    """
+    Tests generating thumbnails in several sizes.
+    """
+
+    def setUp(self):
+        """
+
+        """
+        self.testing_area = tempfile.mkdtemp()
+        self.source_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Nikon', 'DSC_1807.JPG')
+        self.sizes = [(400, 400), (800, 600), (160, 120)]
+
+    def tearDown(self):
+        """
+
+        """
+        shutil.rmtree(self.testing_area)
+
+    def test_parse_dimensions(self):
+        """
+        This test ensures that a list of dimensions is parsed, and that invalid dimensions are rejected.
+        """
+        self.assertEqual(parse_dimensions('400x400,800X600'), [(400, 400), (800, 600)])
+        self.assertRaises(ValueError, parse_dimensions, '400')
+        self.assertRaises(ValueError, parse_dimensions, '400x400, 800xabc')
+
+    def test_generate_thumbnails(self):
+        """
+        This test ensures that every size is generated within its bounds, keeping the aspect ratio, and that existing
+        thumbnails are not generated again.
+        """
+        result = generate_thumbnails(self.source_file, self.testing_area, self.sizes)
+        self.assertEqual(sorted(result.keys()), sorted(self.sizes))
+        for (width, height), filename in result.items():
+            with Image.open(filename) as image:
+                self.assertTrue(image.size[0] <= width and image.size[1] <= height)
+                self.assertTrue(image.size[0] == width or image.size[1] == height)
+
+        mtimes = dict((filename, os.stat(filename).st_mtime_ns) for filename in result.values())
+        generate_thumbnails(self.source_file, self.testing_area, self.sizes)
+        self.assertEqual(mtimes, dict((filename, os.stat(filename).st_mtime_ns) for filename in result.values()))
+
+    def test_reduced_decoding(self):
+        """
+        This test ensures that photos are decoded only as large as the thumbnails require, using the embedded thumbnail
+        when it's big enough and has the aspect ratio of the photo.
+        """
+        self.assertEqual(open_image(self.source_file).size, (3008, 2000))
+        self.assertEqual(open_image(self.source_file, [(400, 400)]).size, (752, 500))
+        self.assertEqual(open_image(self.source_file, [(400, 400), (1200, 800)]).size, (1504, 1000))
+        self.assertEqual(open_image(self.source_file, [(400, 400)], crop=True).size, (752, 500))
+        # the embedded thumbnail of the Nikon has black borders, and is not used
+        self.assertEqual(open_image(self.source_file, [(160, 120)]).size, (376, 250))
+
+        iphone_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'iphone', 'iPhone4', 'IMG_1069.JPG')
+        self.assertEqual(open_image(iphone_file, [(100, 100)]).size, (120, 160))
+        self.assertEqual(open_image(iphone_file, [(100, 100)], use_embedded_thumbnail=False).size, (242, 324))
+        self.assertEqual(open_image(iphone_file, [(200, 200)]).size, (242, 324))
+
+        # the file is closed once the photo is decoded, also when a new, rotated Image is returned
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            open_image(iphone_file, [(200, 200)])
+            open_image(self.source_file)
+            gc.collect()
+        self.assertEqual([warning for warning in caught if issubclass(warning.category, ResourceWarning)], [])
+
+    def test_save_thumbnail(self):
+        """
+        This test ensures that a thumbnail failing to save leaves nothing behind, so it's generated again next time.
+        """
+        filename = os.path.join(self.testing_area, 'thumbnail.jpg')
+        self.assertRaises(OSError, save_thumbnail, Image.new('RGBA', (10, 10)), filename)
+        self.assertEqual(os.listdir(self.testing_area), [])
+
+        save_thumbnail(Image.new('RGB', (10, 10)), filename)
+        self.assertEqual(os.listdir(self.testing_area), ['thumbnail.jpg'])
+
+    def test_crop(self):
+        """
+        This test ensures that cropped thumbnails have exactly the given dimensions.
+        """
+        result = generate_thumbnails(self.source_file, self.testing_area, self.sizes, crop=True)
+        for size, filename in result.items():
+            self.assertTrue(filename.endswith('_crop.JPG'))
+            with Image.open(filename) as image:
+                self.assertEqual(image.size, size)
+
+    def test_generate_folder_thumbnails(self):
+        """
+        This test ensures that the folder structure of the source folder is repeated in the target folder.
+        """
+        source_folder = os.path.join(self.testing_area, 'source')
+        target_folder = os.path.join(self.testing_area, 'target')
+        os.makedirs(os.path.join(source_folder, '2014'))
+        shutil.copy(self.source_file, os.path.join(source_folder, '2014'))
+
+        self.assertEqual(generate_folder_thumbnails(source_folder, target_folder, [(160, 120)]), 1)
+        self.assertTrue(os.path.exists(os.path.join(target_folder, '2014', 'DSC_1807_160x120.JPG')))
+
+    def test_jobs(self):
+        """
+        This test ensures that thumbnails are generated by a pool of processes, and that a photo that can't be read or
+        takes too long doesn't stop the others.
+        """
+        source_folder = os.path.join(self.testing_area, 'source')
+        target_folder = os.path.join(self.testing_area, 'target')
+        for folder in ('2014', '2015'):
+            os.makedirs(os.path.join(source_folder, folder))
+            for counter in range(3):
+                shutil.copy(self.source_file, os.path.join(source_folder, folder, '%s.JPG' % counter))
+
+        with open(os.path.join(source_folder, 'corrupt.jpg'), 'wb') as f:
+            f.write(b'not a photo')
+        # opening a named pipe blocks until something writes to it, like reading from a stalled network share
+        os.mkfifo(os.path.join(source_folder, 'stalled.jpg'))
+
+        self.assertEqual(generate_folder_thumbnails(source_folder, target_folder, [(160, 120)], jobs=2, timeout=2,
+                                                    max_tasks_per_child=2, queue_size=2), 6)
+        for folder in ('2014', '2015'):
+            self.assertEqual(sorted(os.listdir(os.path.join(target_folder, folder))),
+                             ['0_160x120.JPG', '1_160x120.JPG', '2_160x120.JPG'])
+
+    def test_index(self):
+        """
+        This test ensures that the thumbnail index only lets changed photos get new thumbnails, moves the thumbnails of
+        renamed photos and prunes thumbnails of removed photos.
+        """
+        source_folder = os.path.join(self.testing_area, 'source')
+        target_folder = os.path.join(self.testing_area, 'target')
+        os.makedirs(source_folder)
+        photo = os.path.join(source_folder, 'DSC_1807.JPG')
+        shutil.copy(self.source_file, photo)
+        thumbnail = os.path.join(target_folder, 'DSC_1807_160x120.JPG')
+
+        with ThumbnailIndex(os.path.join(self.testing_area, 'thumbnails.db')) as thumbnail_index:
+            self.assertEqual(thumbnail_index.get_stale(photo, target_folder, [(160, 120)]), [(160, 120)])
+
+            # a partially written thumbnail isn't adopted
+            generate_thumbnails(photo, target_folder, [(160, 120)])
+            with open(thumbnail, 'rb') as f:
+                data = f.read()
+            with open(thumbnail, 'wb') as f:
+                f.write(data[:len(data) // 2])
+            self.assertEqual(thumbnail_index.get_stale(photo, target_folder, [(160, 120)]), [(160, 120)])
+            os.remove(thumbnail)
+            self.assertEqual(generate_folder_thumbnails(source_folder, target_folder, [(160, 120)],
+                                                        thumbnail_index=thumbnail_index), 1)
+            self.assertEqual(thumbnail_index.get_stale(photo, target_folder, [(160, 120), (400, 400)]), [(400, 400)])
+
+            # an edited photo gets a new thumbnail
+            with Image.open(self.source_file) as image:
+                image.rotate(90, expand=True).save(photo)
+            os.utime(photo, (os.stat(thumbnail).st_mtime + 10, os.stat(thumbnail).st_mtime + 10))
+            self.assertEqual(thumbnail_index.get_stale(photo, target_folder, [(160, 120)]), [(160, 120)])
+            generate_folder_thumbnails(source_folder, target_folder, [(160, 120)], thumbnail_index=thumbnail_index)
+            with Image.open(thumbnail) as image:
+                self.assertEqual(image.size, (80, 120))
+
+            # a renamed photo gets the thumbnail of its old name
+            renamed_photo = os.path.join(source_folder, 'renamed.JPG')
+            os.rename(photo, renamed_photo)
+            self.assertEqual(thumbnail_index.get_stale(renamed_photo, target_folder, [(160, 120)]), [])
+            self.assertFalse(os.path.exists(thumbnail))
+            self.assertTrue(os.path.exists(os.path.join(target_folder, 'renamed_160x120.JPG')))
+
+            os.remove(renamed_photo)
+            self.assertEqual(thumbnail_index.prune(source_folder), 1)
+            self.assertEqual(os.listdir(target_folder), [])
+
+    def test_index_checksums(self):
+        """
+        This test ensures that existing thumbnails are added to the index without reading their photos, and that the
+        checksums of photos are computed by the worker processes.
+        """
+        source_folder = os.path.join(self.testing_area, 'source')
+        target_folder = os.path.join(self.testing_area, 'target')
+        os.makedirs(source_folder)
+        photo = os.path.join(source_folder, 'DSC_1807.JPG')
+        shutil.copy(self.source_file, photo)
+        generate_thumbnails(photo, target_folder, [(160, 120)])
+
+        checksums = []
+
+        def get_checksum(filename, algorithm):
+            checksums.append(filename)
+            return original_get_checksum(filename, algorithm)
+
+        thumbnails.get_checksum, original_get_checksum = get_checksum, thumbnails.get_checksum
+        try:
+            with ThumbnailIndex(os.path.join(self.testing_area, 'thumbnails.db')) as thumbnail_index:
+                self.assertEqual(thumbnail_index.get_stale(photo, target_folder, [(160, 120)]), [])
+                self.assertEqual(checksums, [])
+
+                copied_photo = os.path.join(source_folder, 'copy.JPG')
+                shutil.copy(self.source_file, copied_photo)
+                self.assertEqual(generate_folder_thumbnails(source_folder, target_folder, [(160, 120)], jobs=1,
+                                                            thumbnail_index=thumbnail_index), 2)
+                self.assertEqual(checksums, [])
+
+                renamed_photo = os.path.join(source_folder, 'renamed.JPG')
+                os.rename(copied_photo, renamed_photo)
+                self.assertEqual(thumbnail_index.get_stale(renamed_photo, target_folder, [(160, 120)]), [])
+                self.assertEqual(checksums, [renamed_photo])
+                self.assertTrue(os.path.exists(os.path.join(target_folder, 'renamed_160x120.JPG')))
+        finally:
+            thumbnails.get_checksum = original_get_checksum
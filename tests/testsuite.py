@@ -11,6 +11,15 @@ from NonCameraSpecific import NonCameraSpecificTests
 from iphone import iPhone4Tests
 from mediaphile.lib import PerformanceLogger
 from test_file_operations import FileOperationTests
+from test_db import FileIndexTests
+from test_exiftool import ExifToolTests
+from test_metadata import MetadataCacheTests
+from test_photos import RelocatePhotosTests
+from test_plan import PlanTests
+from test_journal import JournalTests
+from test_folderwatcher import FolderWatcherTests
+from test_thumbnails import ThumbnailTests
+from test_raw import RawTests
 
 
 class DummyTests(unittest.TestCase):